@@ -19,6 +19,7 @@ from .models import (
     TemporaryToken, 
     User, 
     ExportMedia,
+    NewsletterSubscription,
 )
 from .resources import (
     AcademicFieldResource,
@@ -154,6 +155,14 @@ class ExportMediaAdmin(admin.ModelAdmin):
     )
 
 
+class NewsletterSubscriptionAdmin(admin.ModelAdmin):
+    list_display = ('email', 'status', 'synced_at',)
+    search_fields = ('email',)
+    list_filter = (
+        'status',
+    )
+
+
 admin.site.register(User, CustomUserAdmin)
 admin.site.register(Organization, CustomOrganizationAdmin)
 admin.site.register(Domain, SimpleHistoryAdmin)
@@ -163,3 +172,4 @@ admin.site.register(TemporaryToken, TemporaryTokenAdmin)
 admin.site.register(AcademicField, AcademicFieldAdmin)
 admin.site.register(AcademicLevel, AcademicLevelAdmin)
 admin.site.register(ExportMedia, ExportMediaAdmin)
+admin.site.register(NewsletterSubscription, NewsletterSubscriptionAdmin)
@@ -1,16 +1,24 @@
 from rest_framework import exceptions
 from rest_framework.authentication import TokenAuthentication
 
+from django.contrib.auth import get_user_model
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django.conf import settings
 
 from .models import TemporaryToken
 
+User = get_user_model()
+
 
 class TemporaryTokenAuthentication(TokenAuthentication):
     """
     Extends default token auth to handle temporary tokens.
+
+    The token and its user are read with a single query on each request, so
+    a logout or a change of permissions applies immediately in every process.
+    The expiration date of the token and the last login of the user are only
+    written when older than RENEW_THRESHOLD_SECONDS.
     """
     models = TemporaryToken
 
@@ -18,9 +26,10 @@ class TemporaryTokenAuthentication(TokenAuthentication):
         """
         Attempt token authentication using the provided key.
         """
-        try:
-            token = self.models.objects.get(key=key)
-        except self.models.DoesNotExist:
+        CONFIG = settings.REST_FRAMEWORK_TEMPORARY_TOKENS
+        token = self.get_token(key)
+
+        if token is None:
             raise exceptions.AuthenticationFailed(_('Invalid token'))
 
         if not token.user.is_active:
@@ -31,15 +40,33 @@ class TemporaryTokenAuthentication(TokenAuthentication):
         if token.expired:
             raise exceptions.AuthenticationFailed(_('Token has expired'))
 
-        if settings.REST_FRAMEWORK_TEMPORARY_TOKENS['RENEW_ON_SUCCESS']:
+        now = timezone.now()
+        threshold = timezone.timedelta(
+            seconds=CONFIG['RENEW_THRESHOLD_SECONDS']
+        )
+
+        if CONFIG['RENEW_ON_SUCCESS']:
             # Reset the token expiration time on successful authentication
-            expires = timezone.now() + timezone.timedelta(
-                minutes=settings.REST_FRAMEWORK_TEMPORARY_TOKENS['MINUTES']
-            )
-            token.expires = expires
-            token.save()
-            
-        token.user.last_login = timezone.now()
-        token.user.save()
+            expires = now + timezone.timedelta(minutes=CONFIG['MINUTES'])
+            if expires - token.expires >= threshold:
+                self.models.objects.filter(pk=token.pk).update(
+                    expires=expires,
+                )
+                token.expires = expires
 
-        return token.user, token
+        user = token.user
+        if user.last_login is None or now - user.last_login >= threshold:
+            User.objects.filter(pk=user.pk).update(last_login=now)
+            user.last_login = now
+
+        return user, token
+
+    def get_token(self, key):
+        """
+        Returns the token of the key with its user, or None if it doesn't
+        exist.
+        """
+        try:
+            return self.models.objects.select_related('user').get(key=key)
+        except self.models.DoesNotExist:
+            return None
@@ -34,6 +34,18 @@ app.conf.beat_schedule = {
         'task': 'retirement.tasks.notify_wait_queue_place',
         'schedule': crontab(minute=0, hour='*'),
     },
+    'sync_newsletter_subscriptions': {
+        'task': 'blitz_api.tasks.sync_newsletter_subscriptions',
+        'schedule': crontab(minute=30, hour='*'),
+    },
+    'send_outbox_emails': {
+        'task': 'log_management.tasks.send_outbox_emails',
+        'schedule': crontab(minute='*'),
+    },
+    'reconcile_pending_orders': {
+        'task': 'store.tasks.reconcile_pending_orders',
+        'schedule': crontab(minute='*/5'),
+    },
 }
 
 app.autodiscover_tasks()
@@ -1,3 +1,4 @@
+from django.db.models import Q
 from django.utils import timezone
 
 from django.urls import reverse
@@ -8,6 +9,8 @@ from cron_manager.models import Task
 
 class CronManager:
 
+    EMAIL_CELERY_TASK = 'retirement.tasks.execute_automatic_email'
+
     def __init__(self):
         self.url_to_call = settings.EXTERNAL_SCHEDULER['URL_TO_CALL']
 
@@ -25,19 +28,48 @@ class CronManager:
             args=[retreat.id]
         ) + "/execute_automatic_email/?email=" + str(email.id)
 
+    def get_email_task_kwargs(self, retreat, email):
+        """
+        :param retreat: The Retreat associate with this email
+        :param email: The AutomaticEmail we want to schedule
+        :return: arguments of the Celery task sending the email
+        """
+        return {
+            'retreat_id': retreat.id,
+            'email_id': email.id,
+        }
+
+    def get_email_tasks(self, retreat, email):
+        """
+        :param retreat: The Retreat associate with this email
+        :param email: The AutomaticEmail we want to schedule
+        :return: tasks sending this email, including the tasks calling the
+        API created before emails were sent by Celery
+        """
+        return Task.objects.filter(
+            Q(url=self.get_retreat_target_url(retreat, email)) |
+            Q(
+                task_type=Task.TYPE_CELERY,
+                celery_task=self.EMAIL_CELERY_TASK,
+                celery_kwargs=self.get_email_task_kwargs(retreat, email),
+            )
+        )
+
     def create_email_task(self, retreat, email, execution_date):
         """
+        The email is sent by a Celery task dispatched directly to a worker,
+        instead of calling the API.
         :param retreat: The Retreat associate with this email
         :param email: The AutomaticEmail we want to schedule
         :return: None
         """
-        target_url = self.get_retreat_target_url(retreat, email)
-
         description = "Automatic email #" + str(email.id) + \
                       " for retreat #" + str(retreat.id)
         data = {
             "execution_datetime": execution_date,
-            "url": target_url,
+            "task_type": Task.TYPE_CELERY,
+            "celery_task": self.EMAIL_CELERY_TASK,
+            "celery_kwargs": self.get_email_task_kwargs(retreat, email),
             "description": description
         }
 
@@ -40,6 +40,24 @@ def get_member(
         )
 
 
+def get_list_members(count: int = 1000):
+    """
+    Returns the email address and the status of all members of the list,
+    fetched by pages of `count` members. Returns None if Mailchimp is
+    disabled.
+    """
+    client: MailChimp = get_mail_chimp_client()
+    result = client.lists.members.all(
+        LIST_ID,
+        get_all=True,
+        count=count,
+        fields='members.email_address,members.status',
+    )
+    if result is None:
+        return None
+    return result['members']
+
+
 def is_email_on_list(
     email: str
 ) -> bool:
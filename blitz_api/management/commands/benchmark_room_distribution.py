@@ -0,0 +1,122 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from retirement.room_distribution import (
+    GENDER_PREFERENCE_MIXED,
+    GENDER_PREFERENCES,
+    NOT_APPLICABLE,
+    ROOM_OPTION_SHARED,
+    ROOM_OPTION_SINGLE,
+    distribute_rooms,
+)
+
+
+def generate_participants(count, seed=None):
+    """
+    Generate the room data of a synthetic retreat. A fifth of participants
+    ask for a single room, a fifth of the others ask to share with a friend
+    who asks for them in return most of the time.
+    """
+    generator = random.Random(seed)
+    participants = []
+    for index in range(count):
+        participants.append({
+            'id': index + 1,
+            'first_name': 'Participant',
+            'last_name': str(index + 1),
+            'email': f'participant{index + 1}@example.com',
+            'room_option': ROOM_OPTION_SINGLE,
+            'gender_preference': NOT_APPLICABLE,
+            'share_with': NOT_APPLICABLE,
+            'room_number': 0,
+            'placed': False,
+        })
+
+    shared = []
+    for participant in participants:
+        if generator.random() < 0.2:
+            continue
+        participant['room_option'] = ROOM_OPTION_SHARED
+        participant['gender_preference'] = generator.choice(
+            GENDER_PREFERENCES + [GENDER_PREFERENCE_MIXED]
+        )
+        shared.append(participant)
+
+    generator.shuffle(shared)
+    friends = shared[:len(shared) // 5]
+    for participant, friend in zip(friends[::2], friends[1::2]):
+        participant['share_with'] = friend['email']
+        if generator.random() < 0.8:
+            friend['share_with'] = participant['email']
+    return participants
+
+
+class Command(BaseCommand):
+    help = 'Measure the room distribution of synthetic retreats.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--participants',
+            type=int,
+            default=200,
+            help='Number of participants of each retreat.',
+        )
+        parser.add_argument(
+            '--runs',
+            type=int,
+            default=20,
+            help='Number of retreats to distribute.',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=None,
+            help='Seed of the generated retreats.',
+        )
+
+    def handle(self, *args, **options):
+        if options['runs'] < 1:
+            raise CommandError('--runs must be at least 1.')
+
+        durations = []
+        rooms = 0
+        unplaced = 0
+        for run in range(options['runs']):
+            seed = None if options['seed'] is None else options['seed'] + run
+            participants = generate_participants(
+                options['participants'],
+                seed,
+            )
+
+            start = time.perf_counter()
+            distribution = distribute_rooms(participants)
+            durations.append(time.perf_counter() - start)
+
+            room_numbers = {
+                participant['room_number']
+                for participant in distribution.values()
+                if participant['placed']
+            }
+            rooms += len(room_numbers)
+            unplaced += sum(
+                not participant['placed']
+                for participant in distribution.values()
+                if participant['room_option'] != NOT_APPLICABLE
+            )
+
+        runs = len(durations)
+        self.stdout.write(
+            f'{runs} retreat(s) of {options["participants"]} participants'
+        )
+        self.stdout.write(
+            f'Average rooms: {rooms / runs:.1f}, '
+            f'unplaced participants: {unplaced}'
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Average: {sum(durations) / runs * 1000:.2f} ms, '
+                f'max: {max(durations) * 1000:.2f} ms'
+            )
+        )
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Q, Sum
+from django.db.models.functions import Coalesce
+
+from store.models import Coupon
+
+
+class Command(BaseCommand):
+    help = 'Reconcile the total uses counter of coupons with the uses of ' \
+           'their CouponUser. Only coupons with a wrong counter are ' \
+           'updated.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Display the wrong counters without fixing them.',
+        )
+
+    def handle(self, *args, **options):
+        coupons = Coupon.objects.annotate(
+            real_total_uses=Coalesce(
+                Sum(
+                    'coupon_users__uses',
+                    filter=Q(coupon_users__deleted__isnull=True),
+                ),
+                0,
+            ),
+        ).exclude(total_uses=F('real_total_uses'))
+
+        nb_reconciled = 0
+        for coupon in coupons:
+            self.stdout.write(
+                f'{coupon.code}: {coupon.total_uses} -> '
+                f'{coupon.real_total_uses}'
+            )
+            if options['dry_run']:
+                continue
+
+            with transaction.atomic():
+                # Recount under lock so uses recorded since the first count
+                # are not lost.
+                Coupon.objects.select_for_update().get(pk=coupon.pk)
+                real_total_uses = coupon.coupon_users.aggregate(
+                    total=Coalesce(Sum('uses'), 0),
+                )['total']
+                Coupon.objects.filter(pk=coupon.pk).update(
+                    total_uses=real_total_uses,
+                )
+            nb_reconciled += 1
+
+        self.stdout.write(
+            self.style.SUCCESS(f'{nb_reconciled} coupon(s) reconciled')
+        )
@@ -1,4 +1,32 @@
+import calendar
+
+from django.apps import apps
+from django.contrib.auth.models import UserManager as DjangoUserManager
 from django.db import models
+from django.db.models import (
+    Case,
+    Count,
+    DecimalField,
+    DurationField,
+    ExpressionWrapper,
+    F,
+    FloatField,
+    Func,
+    IntegerField,
+    OuterRef,
+    Subquery,
+    Value,
+    When,
+)
+from django.db.models.functions import (
+    Cast,
+    Coalesce,
+    Extract,
+    Floor,
+    Mod,
+    NullIf,
+)
+from django.utils import timezone
 
 
 class ActionTokenManager(models.Manager):
@@ -20,3 +48,137 @@ class ActionTokenManager(models.Manager):
             )
 
         return filtered_token
+
+
+class UserManager(DjangoUserManager):
+
+    def with_tomato_statistics(self, now=None):
+        """
+        Annotates the tomatoes of each user: acquired, acquired this month,
+        and acquired or still to come by timeslot and retreat.
+        """
+        if now is None:
+            now = timezone.now()
+        Tomato = apps.get_model('tomato', 'Tomato')
+        TimeSlotReservation = apps.get_model('workplace', 'Reservation')
+        RetreatReservation = apps.get_model('retirement', 'Reservation')
+        RetreatDate = apps.get_model('retirement', 'RetreatDate')
+
+        first_day = now.replace(
+            day=1, hour=0, minute=0, second=0, microsecond=0
+        )
+        day = calendar.monthrange(now.year, now.month)[1]
+        last_day = now.replace(
+            day=day, hour=23, minute=59, second=59, microsecond=999999
+        )
+
+        def sum_per_user(queryset, expression, output_field):
+            # SUM isn't an aggregate for the ORM: the subquery isn't grouped
+            # and returns the sum of all its rows
+            return Coalesce(
+                Subquery(
+                    queryset.order_by().annotate(
+                        total=Func(
+                            expression,
+                            function='SUM',
+                            output_field=output_field,
+                        ),
+                    ).values('total'),
+                    output_field=output_field,
+                ),
+                Value(0),
+                output_field=output_field,
+            )
+
+        def acquired_tomatoes(**filters):
+            return sum_per_user(
+                Tomato.objects.filter(user=OuterRef('pk'), **filters),
+                'number_of_tomato',
+                DecimalField(),
+            )
+
+        # 1 hour = 1 tomato, we don't count minutes
+        timeslot_tomatoes = Cast(
+            Floor(
+                ExpressionWrapper(
+                    Extract(
+                        ExpressionWrapper(
+                            F('timeslot__end_time') -
+                            F('timeslot__start_time'),
+                            output_field=DurationField(),
+                        ),
+                        'epoch',
+                    ) / Value(3600),
+                    output_field=FloatField(),
+                ),
+            ),
+            output_field=IntegerField(),
+        )
+
+        # The tomatoes of a retreat are split between its dates, the last
+        # date gets the remainder of the division
+        retreat_dates = RetreatDate.objects.filter(
+            retreat=OuterRef('retreat'),
+        ).order_by()
+        number_of_dates = Subquery(
+            retreat_dates.values('retreat').annotate(
+                count=Count('pk'),
+            ).values('count'),
+            output_field=IntegerField(),
+        )
+        last_date = Subquery(
+            retreat_dates.order_by('-end_time').values('pk')[:1]
+        )
+        retreat_tomatoes = Coalesce(
+            NullIf(F('retreat__number_of_tomatoes'), 0),
+            F('retreat__type__number_of_tomatoes'),
+        )
+        retreat_date_tomatoes = ExpressionWrapper(
+            retreat_tomatoes / number_of_dates + Case(
+                When(
+                    pk=last_date,
+                    then=Mod(retreat_tomatoes, number_of_dates),
+                ),
+                default=Value(0),
+                output_field=IntegerField(),
+            ),
+            output_field=IntegerField(),
+        )
+        future_retreat_dates = RetreatDate.objects.filter(
+            end_time__gte=now,
+            tomatoes_assigned=False,
+            retreat__in=RetreatReservation.objects.filter(
+                user=OuterRef(OuterRef('pk')),
+                is_active=True,
+            ).values('retreat'),
+        )
+
+        return self.get_queryset().annotate(
+            past_tomatoes=acquired_tomatoes(acquisition_date__lte=now),
+            past_timeslot_tomatoes=acquired_tomatoes(
+                source=Tomato.TOMATO_SOURCE_TIMESLOT,
+                acquisition_date__lte=now,
+            ),
+            past_retreat_tomatoes=acquired_tomatoes(
+                source=Tomato.TOMATO_SOURCE_RETREAT,
+                acquisition_date__lte=now,
+            ),
+            month_tomatoes=acquired_tomatoes(
+                acquisition_date__gte=first_day,
+                acquisition_date__lte=last_day,
+            ),
+            future_timeslot_tomatoes=sum_per_user(
+                TimeSlotReservation.objects.filter(
+                    user=OuterRef('pk'),
+                    is_active=True,
+                    timeslot__end_time__gte=now,
+                ),
+                timeslot_tomatoes,
+                IntegerField(),
+            ),
+            future_retreat_tomatoes=sum_per_user(
+                future_retreat_dates,
+                retreat_date_tomatoes,
+                IntegerField(),
+            ),
+        )
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.14 on 2026-10-17 04:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blitz_api', '0036_alter_historicalacademicfield_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exportmedia',
+            name='progress',
+            field=models.PositiveIntegerField(default=0, verbose_name='Progress'),
+        ),
+        migrations.AddField(
+            model_name='exportmedia',
+            name='status',
+            field=models.CharField(choices=[('PENDING', 'Pending'), ('IN PROGRESS', 'In progress'), ('DONE', 'Done'), ('FAILED', 'Failed')], default='DONE', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='exportmedia',
+            name='total',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Total'),
+        ),
+    ]
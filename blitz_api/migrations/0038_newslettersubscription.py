@@ -0,0 +1,27 @@
+# Generated by Django 5.2.14 on 2026-10-17 07:02
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blitz_api', '0037_exportmedia_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NewsletterSubscription',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email', models.EmailField(max_length=254, unique=True, verbose_name='Email')),
+                ('status', models.CharField(max_length=100, verbose_name='Status')),
+                ('synced_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Synchronization date')),
+            ],
+            options={
+                'verbose_name': 'Newsletter subscription',
+                'verbose_name_plural': 'Newsletter subscriptions',
+            },
+        ),
+    ]
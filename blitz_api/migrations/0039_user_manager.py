@@ -0,0 +1,20 @@
+# Generated by Django 5.2.14 on 2026-10-17 07:10
+
+import blitz_api.managers
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blitz_api', '0038_newslettersubscription'),
+    ]
+
+    operations = [
+        migrations.AlterModelManagers(
+            name='user',
+            managers=[
+                ('objects', blitz_api.managers.UserManager()),
+            ],
+        ),
+    ]
@@ -1,18 +1,28 @@
+import hashlib
 from datetime import datetime
 
 import pytz
 from django.conf import settings
+from django.core.cache import cache
 from django.core.files.base import ContentFile
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags, quote_etag
+from django.utils.translation import get_language
 from import_export.resources import ModelResource
 from rest_framework import status
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAdminUser
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 
 from blitz_api import serializers
 from blitz_api.models import ExportMedia
 from blitz_api.resources import UserResource
-from blitz_api.services import ExportPagination
+from blitz_api.services import (
+    ExportPagination,
+    get_response_cache_version,
+)
+from blitz_api.tasks import export_queryset
 
 LOCAL_TIMEZONE = pytz.timezone(settings.TIME_ZONE)
 
@@ -54,3 +64,118 @@ class ExportMixin(object):
         )
 
         return response
+
+    @action(
+        methods=['post'],
+        detail=False,
+        permission_classes=[IsAdminUser],
+        url_path='export-job',
+    )
+    def export_job(self, request):
+        """
+        Export all the filtered objects to a csv file in a Celery task.
+        The response contains the id of the ExportMedia that reports the
+        progress of the job, the author is notified when the file is ready.
+        """
+        date_file = LOCAL_TIMEZONE.localize(datetime.now()) \
+            .strftime("%Y%m%d-%H%M%S")
+        filename = f'{request.resolver_match.view_name}-{date_file}.csv'
+
+        new_export = ExportMedia.objects.create(
+            name=filename,
+            author=request.user,
+            status=ExportMedia.STATUS_PENDING,
+        )
+        # The task filters the queryset again from the query parameters, so
+        # the message only holds plain data
+        viewset_class = self.__class__
+        export_queryset.delay(
+            new_export.id,
+            f'{viewset_class.__module__}.{viewset_class.__qualname__}',
+            dict(request.query_params.lists()),
+        )
+
+        return Response(
+            status=status.HTTP_202_ACCEPTED,
+            data={
+                'job_id': new_export.id,
+                'status': new_export.status,
+            }
+        )
+
+
+class CachedResponseMixin(object):
+    """
+    Caches the responses of the list of the viewset, with an ETag to answer
+    unchanged lists with a 304.
+
+    Responses are cached per path, query string, language and staff flag, or
+    per user when the serializer depends on the user. They are cached with
+    the version of their namespace, which is changed by signals on the models
+    of the response, see blitz_api.services.invalidate_response_cache.
+
+    Nothing is cached when RESPONSE_CACHE_TIMEOUT is 0, the default unless
+    the cache backend is shared by all the processes.
+    """
+
+    response_cache_namespace: str = None
+    response_cache_per_user = False
+
+    def get_response_cache_key(self, request):
+        user = request.user
+        if self.response_cache_per_user and user.is_authenticated:
+            user_key = f'user{user.pk}'
+        elif user.is_staff:
+            user_key = 'staff'
+        else:
+            user_key = 'public'
+
+        path_hash = hashlib.sha256(
+            request.get_full_path().encode()
+        ).hexdigest()
+
+        return 'response_{0}_{1}_{2}_{3}_{4}'.format(
+            self.response_cache_namespace,
+            get_response_cache_version(self.response_cache_namespace),
+            get_language(),
+            user_key,
+            path_hash,
+        )
+
+    def list(self, request, *args, **kwargs):
+        if not settings.RESPONSE_CACHE_TIMEOUT:
+            return super(CachedResponseMixin, self).list(
+                request, *args, **kwargs)
+
+        cache_key = self.get_response_cache_key(request)
+        cached_response = cache.get(cache_key)
+
+        if cached_response is None:
+            response = super(CachedResponseMixin, self).list(
+                request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+
+            content = JSONRenderer().render(response.data)
+            cached_response = {
+                'data': response.data,
+                'etag': quote_etag(hashlib.md5(content).hexdigest()),
+            }
+            cache.set(
+                cache_key,
+                cached_response,
+                settings.RESPONSE_CACHE_TIMEOUT,
+            )
+        else:
+            response = Response(cached_response['data'])
+
+        etag = cached_response['etag']
+        # Weak comparison, as done by Django for the If-None-Match header
+        if_none_match = parse_etags(request.headers.get('If-None-Match', ''))
+        if_none_match = [tag.removeprefix('W/') for tag in if_none_match]
+        if etag in if_none_match or '*' in if_none_match:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+
+        response['ETag'] = etag
+        patch_vary_headers(response, ('Accept-Language', 'Authorization'))
+        return response
@@ -2,12 +2,11 @@ import binascii
 import datetime
 import os
 import logging
-import calendar
 import uuid
 
 from django.conf import settings
 from django.db import models
-from django.db.models import Sum
+from django.db.models.functions import Lower
 from django.utils import timezone
 from django.contrib.auth.models import AbstractUser
 from django.utils.translation import gettext_lazy as _
@@ -16,12 +15,10 @@ from dateutil.relativedelta import relativedelta
 from jsonfield import JSONField
 from rest_framework.authtoken.models import Token
 from simple_history.models import HistoricalRecords
-from . import mailchimp
 
-from tomato.models import Tomato
 from utils.tomato_field import TomatoFieldManager
 from blitz_api import services
-from blitz_api.managers import ActionTokenManager
+from blitz_api.managers import ActionTokenManager, UserManager
 
 logger = logging.getLogger(__name__)
 
@@ -191,6 +188,8 @@ class User(AbstractUser):
 
     history = HistoricalRecords()
 
+    objects = UserManager()
+
     def last_seen(self):
         # If user has never logged in, use date of account creation
         # Since we did not log last_login date before end of december 2025, set a minimum 2 years delay to all users before inactivity alerts
@@ -305,77 +304,52 @@ class User(AbstractUser):
                 "CONFIRM_SIGN_UP",
             )
 
-    def get_number_of_past_tomatoes(self):
-        today = timezone.now()
-        nb_tomatoes = Tomato.objects.filter(
-            user=self,
-            acquisition_date__lte=today
-        ).aggregate(Sum('number_of_tomato'))['number_of_tomato__sum']
-        nb_tomatoes = nb_tomatoes if nb_tomatoes else 0
+    def get_tomato_statistics(self, *names):
+        """
+        Returns the statistics of tomatoes annotated by
+        User.objects.with_tomato_statistics, computed with a single query
+        when the user doesn't come from such a queryset.
+        """
+        # Use the annotations of list querysets
+        if all(name in self.__dict__ for name in names):
+            return {name: self.__dict__[name] for name in names}
 
-        return nb_tomatoes
+        return type(self).objects.with_tomato_statistics().filter(
+            pk=self.pk,
+        ).values(*names).get()
 
-    def get_number_of_future_tomatoes(self):
-        timeslots = self.get_nb_tomatoes_timeslot()
-        retreats = self.get_nb_tomatoes_retreat()
+    def get_number_of_past_tomatoes(self):
+        return self.get_tomato_statistics('past_tomatoes')['past_tomatoes']
 
-        future_count = timeslots['future'] + retreats['future']
+    def get_number_of_future_tomatoes(self):
+        statistics = self.get_tomato_statistics(
+            'future_timeslot_tomatoes',
+            'future_retreat_tomatoes',
+        )
 
-        return future_count
+        return statistics['future_timeslot_tomatoes'] + \
+            statistics['future_retreat_tomatoes']
 
     def get_nb_tomatoes_timeslot(self):
-        from workplace.models import Reservation as TimeslotReservation
-        today = timezone.now()
-        nb_tomatoes = Tomato.objects.filter(
-            user=self,
-            source=Tomato.TOMATO_SOURCE_TIMESLOT,
-            acquisition_date__lte=today
-        ).aggregate(Sum('number_of_tomato'))['number_of_tomato__sum']
-        past_count = nb_tomatoes if nb_tomatoes else 0
-
-        reservations = TimeslotReservation.objects.filter(
-            user=self,
-            is_active=True,
+        statistics = self.get_tomato_statistics(
+            'past_timeslot_tomatoes',
+            'future_timeslot_tomatoes',
         )
-        future_count = 0
-        for reservation in reservations:
-            if reservation.timeslot.end_time >= timezone.now():
-                future_count += reservation.timeslot.number_of_tomatoes
 
         return {
-            'past': past_count,
-            'future': future_count,
+            'past': statistics['past_timeslot_tomatoes'],
+            'future': statistics['future_timeslot_tomatoes'],
         }
 
     def get_nb_tomatoes_retreat(self):
-        from retirement.models import (
-            Reservation as RetreatReservation,
-            RetreatDate,
-        )
-        today = timezone.now()
-        nb_tomatoes = Tomato.objects.filter(
-            user=self,
-            source=Tomato.TOMATO_SOURCE_RETREAT,
-            acquisition_date__lte=today
-        ).aggregate(Sum('number_of_tomato'))['number_of_tomato__sum']
-        past_count = nb_tomatoes if nb_tomatoes else 0
-
-        reservations = RetreatReservation.objects.filter(
-            user=self,
-            is_active=True,
+        statistics = self.get_tomato_statistics(
+            'past_retreat_tomatoes',
+            'future_retreat_tomatoes',
         )
-        future_dates = RetreatDate.objects.filter(
-            end_time__gte=today,
-            tomatoes_assigned=False,
-            retreat__reservations__in=reservations,
-        )
-        future_count = 0
-        for date in future_dates:
-            future_count += date.number_of_tomatoes
 
         return {
-            'past': past_count,
-            'future': future_count,
+            'past': statistics['past_retreat_tomatoes'],
+            'future': statistics['future_retreat_tomatoes'],
         }
 
     def get_active_membership(self):
@@ -386,7 +360,12 @@ class User(AbstractUser):
 
     @property
     def is_in_newsletter(self):
-        return mailchimp.is_email_on_list(self.email)
+        # Use the annotation of list querysets
+        if 'newsletter_subscribed' in self.__dict__:
+            return self.newsletter_subscribed
+        return NewsletterSubscription.objects.filter(
+            email=self.email.lower(),
+        ).exists()
 
     @classmethod
     def create_user(cls,
@@ -515,22 +494,7 @@ class User(AbstractUser):
 
     @property
     def current_month_tomatoes(self):
-        today = timezone.now()
-        first_day = today.replace(
-            day=1, hour=0, minute=0, second=0, microsecond=0
-        )
-        day = calendar.monthrange(today.year, today.month)[1]
-        last_day = today.replace(
-            day=day, hour=23, minute=59, second=59, microsecond=999999
-        )
-        nb_tomatoes = Tomato.objects.filter(
-            user=self,
-            acquisition_date__gte=first_day,
-            acquisition_date__lte=last_day
-        ).aggregate(Sum('number_of_tomato'))['number_of_tomato__sum']
-        nb_tomatoes = nb_tomatoes if nb_tomatoes else 0
-
-        return nb_tomatoes
+        return self.get_tomato_statistics('month_tomatoes')['month_tomatoes']
 
 
 class TemporaryToken(Token):
@@ -873,6 +837,43 @@ class MagicLink(models.Model):
         )
 
 
+class NewsletterSubscription(models.Model):
+    """
+    Local copy of the members of the Mailchimp newsletter list, refreshed by
+    the sync_newsletter_subscriptions task so that users are serialized
+    without calling Mailchimp.
+    """
+    email = models.EmailField(
+        verbose_name=_("Email"),
+        unique=True,
+    )
+    status = models.CharField(
+        verbose_name=_("Status"),
+        max_length=100,
+    )
+    synced_at = models.DateTimeField(
+        verbose_name=_("Synchronization date"),
+        default=timezone.now,
+    )
+
+    class Meta:
+        verbose_name = _("Newsletter subscription")
+        verbose_name_plural = _("Newsletter subscriptions")
+
+    def __str__(self):
+        return self.email
+
+    @classmethod
+    def is_subscribed(cls, email):
+        """
+        Returns an Exists expression telling if the email (an expression or
+        an OuterRef) is on the newsletter list, to annotate users.
+        """
+        return models.Exists(
+            cls.objects.filter(email=Lower(email))
+        )
+
+
 class ExportMedia(models.Model):
     EXPORT_ANONYMOUS_CHRONO_DATA = 'ANONYMOUS CHRONO DATA'
     EXPORT_OTHER = 'OTHER'
@@ -894,6 +895,18 @@ class ExportMedia(models.Model):
         (EXPORT_PERSONAL_DATA, _('Personal data')),
     )
 
+    STATUS_PENDING = 'PENDING'
+    STATUS_IN_PROGRESS = 'IN PROGRESS'
+    STATUS_DONE = 'DONE'
+    STATUS_FAILED = 'FAILED'
+
+    STATUS_CHOICES = (
+        (STATUS_PENDING, _('Pending')),
+        (STATUS_IN_PROGRESS, _('In progress')),
+        (STATUS_DONE, _('Done')),
+        (STATUS_FAILED, _('Failed')),
+    )
+
     file = models.FileField(
         verbose_name='file',
         upload_to='export/%Y/%m/'
@@ -919,6 +932,25 @@ class ExportMedia(models.Model):
         default=EXPORT_OTHER,
     )
 
+    # Exports made by a job are created before their file, the status and the
+    # number of exported rows report the progress of the job.
+    status = models.CharField(
+        max_length=255,
+        choices=STATUS_CHOICES,
+        default=STATUS_DONE,
+    )
+
+    progress = models.PositiveIntegerField(
+        verbose_name=_('Progress'),
+        default=0,
+    )
+
+    total = models.PositiveIntegerField(
+        verbose_name=_('Total'),
+        null=True,
+        blank=True,
+    )
+
     def __str__(self):
         return self.name if self.name else str(self.id)
 
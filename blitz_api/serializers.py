@@ -20,6 +20,7 @@ from .models import (
     AcademicLevel,
     ExportMedia,
     MagicLink,
+    NewsletterSubscription,
 )
 from .services import remove_translation_fields, check_if_translated_field
 from . import services, mailchimp
@@ -773,6 +774,15 @@ class MailChimpSerializer(serializers.Serializer):
                 first_name=validated_data['first_name'],
                 last_name=validated_data['last_name']
             )
+            if response:
+                # Users are shown as subscribed until the next sync
+                NewsletterSubscription.objects.update_or_create(
+                    email=validated_data['email'].lower(),
+                    defaults={
+                        'status': response.get('status', 'subscribed'),
+                        'synced_at': timezone.now(),
+                    },
+                )
         except MailChimpError as e:
             if e.args[0]['title'] == 'Member Exists':
                 raise serializers.ValidationError({
@@ -1,19 +1,23 @@
 import json
+from datetime import timedelta
 from django.utils import timezone
 
 import pytz
 import re
+import uuid
 
 from django.apps import apps
 from django.conf import settings
-from django.core.mail import EmailMessage
+from django.core.cache import cache
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
 from django.http import HttpResponse
 from django.utils.translation import gettext_lazy as _
 from django.template.loader import render_to_string
 
 from rest_framework.pagination import PageNumberPagination
 
-from log_management.models import Log, EmailLog
+from log_management.models import Log, EmailLog, OutboxEmail
 from .exceptions import MailServiceError
 from django.core.mail import send_mail as django_send_mail
 
@@ -34,13 +38,22 @@ def send_mail(users, context, template):
     return send_email_from_template_id(users, context, template)
 
 
-def send_email_from_template_id(users, context, template):
+def send_email_from_template_id(users, context, template, merge_data=None,
+                                batch=False):
     """
-    Uses Anymail to send templated emails.
+    Uses Anymail to send templated emails over a single connection.
+    Each user is sent its own message, a failure is logged and raised.
+    With batch, users are split in batch sends of EMAIL_BATCH_SIZE recipients
+    instead: the ESP sends a separate email to each user, and a batch that
+    fails is logged and reported without preventing the others from being
+    sent.
     Returns a list of email addresses to which emails failed to be delivered.
     :param users: The list of users to notify
     :param context: The context variables of the template
     :param template: The template of the ESP
+    :param merge_data: The context variables of each user, by email, only
+    used by batch sends
+    :param batch: True to send the emails with batch sends
     :return: A list of email addresses to which emails failed to be delivered
     """
 
@@ -49,44 +62,236 @@ def send_email_from_template_id(users, context, template):
             "Email service is disabled."
         ))
 
-    failed_emails = list()
-    for user in users:
+    merge_data = merge_data or {}
+    emails = [user.email for user in users]
+    if batch:
+        emails = list(dict.fromkeys(emails))
+        batch_size = settings.EMAIL_BATCH_SIZE
+    else:
+        batch_size = 1
+
+    messages = []
+    for index in range(0, len(emails), batch_size):
+        batch_emails = emails[index:index + batch_size]
         message = EmailMessage(
             subject=None,  # required for SendinBlue templates
             body='',  # required for SendinBlue templates
-            to=[user.email]
+            to=batch_emails
         )
         message.from_email = None  # required for SendinBlue templates
         # use this SendinBlue template
         message.template_id = int(template)
         message.merge_global_data = context
-        try:
-            # return number of successfully sent emails
-            response = message.send()
-            EmailLog.add(
-                user.email,
-                "Template #" + str(template),
-                response
-            )
-        except Exception as err:
-            additional_data = {
-                'email': user.email,
-                'context': context,
-                'template': "Template #" + str(template)
+        if batch:
+            # Setting merge_data, even empty, makes it a batch send
+            message.merge_data = {
+                email: merge_data[email]
+                for email in batch_emails if email in merge_data
             }
-            Log.error(
-                source='SENDING_BLUE_TEMPLATE',
-                message=err,
-                additional_data=json.dumps(additional_data)
-            )
-            raise
+        messages.append(message)
 
-        if not response:
-            failed_emails.append(user.email)
+    return deliver_email_messages(
+        messages,
+        "Template #" + str(template),
+        fail_silently=batch,
+    )
+
+
+def deliver_email_messages(messages, type_email, fail_silently=False):
+    """
+    Sends email messages over a single connection to the email backend and
+    logs their recipients in one query. A message that fails is logged and
+    the exception is raised, or with fail_silently, reported without
+    preventing the other messages from being sent.
+    Returns a list of email addresses to which emails failed to be delivered.
+    :param messages: The EmailMessage to send
+    :param type_email: The type of the emails in EmailLog
+    :param fail_silently: True to report the messages that fail instead of
+    raising their exception
+    :return: A list of email addresses to which emails failed to be delivered
+    """
+    failed_emails = []
+    email_logs = []
+
+    try:
+        with get_connection() as connection:
+            for message in messages:
+                message.connection = connection
+                try:
+                    # return number of successfully sent emails
+                    response = message.send()
+                except Exception as err:
+                    additional_data = {
+                        'emails': message.to,
+                        'context': getattr(message, 'merge_global_data',
+                                           None),
+                        'template': type_email
+                    }
+                    Log.error(
+                        source='SENDING_BLUE_TEMPLATE',
+                        message=err,
+                        additional_data=json.dumps(additional_data,
+                                                   default=str)
+                    )
+                    if not fail_silently:
+                        raise
+                    failed_emails += message.to
+                    continue
+
+                message_failed_emails = get_failed_recipients(
+                    message,
+                    response,
+                )
+                failed_emails += message_failed_emails
+                email_logs += [
+                    EmailLog(
+                        user_email=email,
+                        type_email=type_email,
+                        nb_email_sent=(
+                            0 if email in message_failed_emails else 1
+                        ),
+                    )
+                    for email in message.to
+                ]
+    finally:
+        # The emails sent before a failure are logged too
+        EmailLog.objects.bulk_create(email_logs)
 
     return failed_emails
 
 
+def queue_email_from_template_id(users, context, template, merge_data=None):
+    """
+    Sends templated emails from a Celery worker once the current transaction
+    is committed, with batch sends, see send_email_from_template_id. The
+    context must be serializable in JSON.
+    """
+    from blitz_api.tasks import send_email_from_template_id_task
+
+    if settings.LOCAL_SETTINGS['EMAIL_SERVICE'] is False:
+        raise MailServiceError(_(
+            "Email service is disabled."
+        ))
+
+    user_ids = [user.id for user in users]
+    if user_ids:
+        transaction.on_commit(
+            lambda: send_email_from_template_id_task.delay(
+                user_ids,
+                context,
+                template,
+                merge_data,
+            )
+        )
+
+
+def get_failed_recipients(message, response):
+    """
+    Returns the recipients of a sent message that the ESP didn't accept.
+    Backends other than Anymail only report if the whole message was sent.
+    """
+    anymail_status = getattr(message, 'anymail_status', None)
+    if anymail_status is not None and anymail_status.recipients:
+        return [
+            email for email, status in anymail_status.recipients.items()
+            if status.status in ('failed', 'invalid', 'rejected')
+        ]
+    if not response:
+        return list(message.to)
+    return []
+
+
+def queue_email_messages(messages, type_email):
+    """
+    Stores email messages in the outbox, in the current transaction. They are
+    sent by a Celery worker once the transaction is committed, and are
+    dropped if it is rolled back.
+    :param messages: The EmailMessage to send
+    :param type_email: The type of the emails in EmailLog
+    :return: The OutboxEmail created
+    """
+    from log_management.tasks import send_outbox_emails
+
+    outbox_emails = OutboxEmail.objects.bulk_create([
+        OutboxEmail.from_message(message, type_email) for message in messages
+    ])
+    if outbox_emails:
+        # The emails are still sent by the periodic task if the broker can't
+        # be reached
+        transaction.on_commit(send_outbox_emails.delay, robust=True)
+    return outbox_emails
+
+
+def deliver_outbox_emails(outbox_emails):
+    """
+    Sends emails of the outbox over a single connection to the email backend.
+    An email that fails is retried later, with an exponential backoff, until
+    EMAIL_OUTBOX['MAX_TRIES'] tries are made.
+    Returns the number of emails sent.
+    :param outbox_emails: The OutboxEmail leased to the caller
+    :return: The number of emails sent
+    """
+    now = timezone.now()
+    email_logs = []
+    sent = 0
+
+    with get_connection() as connection:
+        for outbox_email in outbox_emails:
+            outbox_email.tries += 1
+            outbox_email.locked_until = None
+            message = outbox_email.get_message(connection)
+            try:
+                # return number of successfully sent emails
+                response = message.send()
+            except Exception as err:
+                outbox_email.last_error = str(err)
+                if outbox_email.tries >= settings.EMAIL_OUTBOX['MAX_TRIES']:
+                    outbox_email.status = OutboxEmail.STATUS_FAILED
+                    additional_data = {
+                        'outbox_email': outbox_email.id,
+                        'emails': outbox_email.to,
+                        'template': outbox_email.type_email,
+                    }
+                    Log.error(
+                        source='SENDING_BLUE_TEMPLATE',
+                        message=err,
+                        additional_data=json.dumps(additional_data)
+                    )
+                else:
+                    outbox_email.next_try_at = now + timedelta(
+                        seconds=settings.EMAIL_OUTBOX['RETRY_DELAY_SECONDS'] *
+                        2 ** (outbox_email.tries - 1)
+                    )
+                continue
+
+            outbox_email.status = OutboxEmail.STATUS_SENT
+            outbox_email.sent_at = now
+            sent += 1
+            failed_emails = get_failed_recipients(message, response)
+            email_logs += [
+                EmailLog(
+                    user_email=email,
+                    type_email=outbox_email.type_email,
+                    nb_email_sent=0 if email in failed_emails else 1,
+                )
+                for email in message.to
+            ]
+
+    OutboxEmail.objects.bulk_update(
+        outbox_emails,
+        [
+            'status',
+            'tries',
+            'next_try_at',
+            'locked_until',
+            'last_error',
+            'sent_at',
+        ],
+    )
+    EmailLog.objects.bulk_create(email_logs)
+    return sent
+
+
 def remove_translation_fields(data_dict):
     """
     Used to removed translation fields.
@@ -264,6 +469,39 @@ def notify_user_of_renew_membership(user, membership_end, log=True):
         )
 
 
+def get_response_cache_version(namespace):
+    """
+    Returns the current version of the cached responses of the namespace,
+    responses cached with another version are not used anymore.
+    """
+    version_key = f'response_cache_version_{namespace}'
+    version = cache.get(version_key)
+    if version is None:
+        version = uuid.uuid4().hex
+        # Another process may have set the version in the meantime
+        if not cache.add(version_key, version, None):
+            version = cache.get(version_key, version)
+    return version
+
+
+def invalidate_response_cache(namespace):
+    """
+    Changes the version of the cached responses of the namespace. It is
+    changed again once the current transaction is committed, in case a
+    response has been cached with the data of before the transaction in the
+    meantime.
+    """
+    def set_new_version():
+        cache.set(
+            f'response_cache_version_{namespace}',
+            uuid.uuid4().hex,
+            None,
+        )
+
+    set_new_version()
+    transaction.on_commit(set_new_version)
+
+
 class ExportPagination(PageNumberPagination):
     """ Custom paginator for data exportation """
     page_size = 1000
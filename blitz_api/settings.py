@@ -18,6 +18,7 @@ from pathlib import Path
 import sys
 
 from decouple import config, Csv
+from django.core.exceptions import ImproperlyConfigured
 from django.utils.translation import gettext_lazy as _
 
 IS_GAE_ENV = config('GAE_INSTANCE', False)
@@ -162,6 +163,43 @@ DATABASES = {
 
 DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
 
+# Cache
+# Use a shared backend (ie: django.core.cache.backends.redis.RedisCache) when
+# the API runs in many processes, otherwise the cached responses of each
+# process are not invalidated by the changes made in the other ones.
+
+CACHE_BACKEND = config(
+    'CACHE_BACKEND',
+    default='django.core.cache.backends.locmem.LocMemCache',
+)
+
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': config('CACHE_LOCATION', default=''),
+    }
+}
+
+# Backends whose entries are not shared between the processes of the API
+PROCESS_LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+# Maximum number of seconds the responses of the catalog endpoints are cached,
+# 0 disables the cache. It requires a shared cache backend.
+RESPONSE_CACHE_TIMEOUT = config(
+    'RESPONSE_CACHE_TIMEOUT',
+    default=0 if CACHE_BACKEND in PROCESS_LOCAL_CACHE_BACKENDS else 300,
+    cast=int,
+)
+
+if RESPONSE_CACHE_TIMEOUT and CACHE_BACKEND in PROCESS_LOCAL_CACHE_BACKENDS:
+    raise ImproperlyConfigured(
+        "RESPONSE_CACHE_TIMEOUT requires a cache backend shared by all the "
+        "processes, set CACHE_BACKEND or set RESPONSE_CACHE_TIMEOUT=0."
+    )
+
 # Custom user model
 
 AUTH_USER_MODEL = 'blitz_api.User'
@@ -293,7 +331,7 @@ REST_FRAMEWORK = {
 # CORS Header Django Rest Framework
 
 CORS_ORIGIN_ALLOW_ALL = True
-CORS_EXPOSE_HEADERS = ["Link", ]
+CORS_EXPOSE_HEADERS = ["Link", "ETag", ]
 
 # Temporary Token
 
@@ -303,6 +341,13 @@ REST_FRAMEWORK_TEMPORARY_TOKENS = {
                                default=True, cast=bool),
     'USE_AUTHENTICATION_BACKENDS': config('USE_AUTHENTICATION_BACKENDS',
                                           default=False, cast=bool),
+    # The expiration date of a token and the last login of its user are only
+    # written when older than this number of seconds
+    'RENEW_THRESHOLD_SECONDS': config(
+        'TEMPORARY_TOKEN_RENEW_THRESHOLD_SECONDS',
+        default=300,
+        cast=int,
+    ),
 }
 
 # Activation Token
@@ -383,6 +428,19 @@ ANYMAIL = {
 }
 EMAIL_BACKEND = config('EMAIL_BACKEND',
                        default='django.core.mail.backends.smtp.EmailBackend')
+# Maximum number of recipients of a batch send of a template
+EMAIL_BATCH_SIZE = config('EMAIL_BATCH_SIZE', default=500, cast=int)
+# Emails stored in the outbox are sent by a Celery worker, by batches of
+# BATCH_SIZE. Failed emails are retried after RETRY_DELAY_SECONDS, doubled on
+# each try, until MAX_TRIES.
+EMAIL_OUTBOX = {
+    'BATCH_SIZE': config('EMAIL_OUTBOX_BATCH_SIZE', default=100, cast=int),
+    'MAX_TRIES': config('EMAIL_OUTBOX_MAX_TRIES', default=5, cast=int),
+    'RETRY_DELAY_SECONDS': config('EMAIL_OUTBOX_RETRY_DELAY_SECONDS',
+                                  default=60, cast=int),
+    'LEASE_SECONDS': config('EMAIL_OUTBOX_LEASE_SECONDS', default=300,
+                            cast=int),
+}
 # This 'FROM' email is not used with SendInBlue templates
 DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL',
                             default='noreply@example.org')
@@ -492,6 +550,25 @@ PAYSAFE = {
                        default='https://api.test.paysafe.com/'),
     'VAULT_URL': config('PAYSAFE_VAULT_URL', default='customervault/v1/'),
     'CARD_URL': config('PAYSAFE_CARD_URL', default='cardpayments/v1/'),
+    'CONNECT_TIMEOUT': config('PAYSAFE_CONNECT_TIMEOUT', default=5,
+                              cast=float),
+    'READ_TIMEOUT': config('PAYSAFE_READ_TIMEOUT', default=30, cast=float),
+    # Retries only apply to idempotent calls (GET, PUT, DELETE)
+    'MAX_RETRIES': config('PAYSAFE_MAX_RETRIES', default=2, cast=int),
+    'RETRY_BACKOFF': config('PAYSAFE_RETRY_BACKOFF', default=0.5,
+                            cast=float),
+    'POOL_SIZE': config('PAYSAFE_POOL_SIZE', default=10, cast=int),
+    # Automatic refunds
+    'REFUND_WORKERS': config('PAYSAFE_REFUND_WORKERS', default=4, cast=int),
+    'REFUND_BATCH_SIZE': config('PAYSAFE_REFUND_BATCH_SIZE', default=100,
+                                cast=int),
+    'REFUND_RETRY_DELAY_HOURS': config('PAYSAFE_REFUND_RETRY_DELAY_HOURS',
+                                       default=12, cast=int),
+    'REFUND_MAX_TRIES': config('PAYSAFE_REFUND_MAX_TRIES', default=5,
+                               cast=int),
+    # Delay before looking up the charge of an order left pending
+    'PENDING_ORDER_DELAY_MINUTES': config(
+        'PAYSAFE_PENDING_ORDER_DELAY_MINUTES', default=15, cast=int),
 }
 
 # django-import-export
@@ -506,6 +583,18 @@ EXTERNAL_SCHEDULER = {
     'URL_TO_CALL': config('URL_TO_CALL', default='http://example.com'),
 }
 
+# Tasks of cron_manager, executed concurrently by each Celery worker. A task
+# is leased to one worker until executed, or until the lease expires.
+CRON_MANAGER = {
+    'WORKERS': config('CRON_MANAGER_WORKERS', default=4, cast=int),
+    'CONNECT_TIMEOUT': config('CRON_MANAGER_CONNECT_TIMEOUT', default=5,
+                              cast=float),
+    'READ_TIMEOUT': config('CRON_MANAGER_READ_TIMEOUT', default=60,
+                           cast=float),
+    'LEASE_SECONDS': config('CRON_MANAGER_LEASE_SECONDS', default=600,
+                            cast=int),
+}
+
 MAILCHIMP_API_KEY = config('MAILCHIMP_API_KEY', default='')
 MAILCHIMP_SUBSCRIBE_LIST_ID = config(
     'MAILCHIMP_SUBSCRIBE_LIST_ID', default='')
@@ -1,12 +1,28 @@
+import csv
+import io
+import json
+import tempfile
+
 from celery import shared_task
+from rest_framework.request import Request
+from django.db import transaction
+from django.http import HttpRequest, QueryDict
 from django.utils import timezone
+from django.utils.module_loading import import_string
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from blitz_api.resources import UserPersonalDataResource
-from blitz_api.models import ExportMedia
+from blitz_api import mailchimp
+from blitz_api.models import ExportMedia, NewsletterSubscription
+from blitz_api.services import send_email_from_template_id
+from log_management.models import Log
 from datetime import datetime
 import pytz
-from django.core.files.base import ContentFile
+from django.core.files.base import ContentFile, File
+
+# Number of objects fetched at once by export jobs, the progress of the job
+# is saved after each chunk.
+EXPORT_CHUNK_SIZE = 1000
 
 
 @shared_task
@@ -87,4 +103,155 @@ def export_personal_data_of_users(author_id, user_id):
     
     new_export.send_confirmation_email()
     
-    return f"Exported personal data for user"
\ No newline at end of file
+    return f"Exported personal data for user"
+
+
+def get_export_queryset(viewset_path, query_params, user):
+    """
+    Rebuilds the filtered queryset of an export job from the import path of
+    its viewset and the query parameters of the request, as if the user
+    requested it again.
+    """
+    http_request = HttpRequest()
+    http_request.method = 'POST'
+    http_request.GET = QueryDict(mutable=True)
+    for key, values in query_params.items():
+        http_request.GET.setlist(key, values)
+
+    request = Request(http_request)
+    request.user = user
+
+    viewset = import_string(viewset_path)(
+        request=request,
+        args=(),
+        kwargs={},
+        format_kwarg=None,
+        action='export_job',
+    )
+    return viewset.filter_queryset(viewset.get_queryset()).order_by('pk')
+
+
+@shared_task
+def export_queryset(export_id, viewset_path, query_params):
+    """
+    Exports all the objects filtered by a viewset to the csv file of an
+    ExportMedia. Objects are fetched and written by chunks, so the memory
+    doesn't grow with the size of the queryset.
+    :params export_id: id of the ExportMedia created by ExportMixin
+    :params viewset_path: import path of the viewset of the export
+    :params query_params: query parameters of the request, as lists of values
+    """
+    export = ExportMedia.objects.select_related('author').get(id=export_id)
+    queryset = get_export_queryset(viewset_path, query_params, export.author)
+    resource = import_string(viewset_path).export_resource.__class__()
+
+    exports = ExportMedia.objects.filter(id=export_id)
+    exports.update(
+        status=ExportMedia.STATUS_IN_PROGRESS,
+        total=queryset.count(),
+    )
+
+    try:
+        resource.before_export(queryset)
+        queryset = resource.filter_export(queryset)
+
+        with tempfile.TemporaryFile() as output_file:
+            output_stream = io.TextIOWrapper(
+                output_file,
+                encoding='utf-8',
+                newline='',
+            )
+            writer = csv.writer(output_stream)
+            writer.writerow(resource.get_export_headers())
+
+            progress = 0
+            for obj in resource.iter_queryset(queryset):
+                writer.writerow(resource.export_resource(obj))
+                progress += 1
+                if progress % EXPORT_CHUNK_SIZE == 0:
+                    exports.update(progress=progress)
+
+            output_stream.flush()
+            output_file.seek(0)
+            export.file.save(export.name, File(output_file), save=False)
+            output_stream.detach()
+    except Exception:
+        exports.update(status=ExportMedia.STATUS_FAILED)
+        raise
+
+    exports.update(
+        file=export.file.name,
+        status=ExportMedia.STATUS_DONE,
+        progress=progress,
+    )
+    export.send_confirmation_email()
+
+    return f"Exported {progress} objects"
+
+
+@shared_task
+def send_email_from_template_id_task(user_ids, context, template,
+                                     merge_data=None):
+    """
+    Sends templated emails out of the request cycle with batch sends, see
+    send_email_from_template_id. The emails that failed to be delivered are
+    logged and returned.
+    """
+    users = get_user_model().objects.filter(id__in=user_ids)
+    failed_emails = send_email_from_template_id(
+        users,
+        context,
+        template,
+        merge_data,
+        batch=True,
+    )
+
+    if failed_emails:
+        Log.error(
+            source='SENDING_BLUE_TEMPLATE',
+            message=f'{len(failed_emails)} email(s) of {len(user_ids)} '
+                    f'failed to be delivered',
+            additional_data=json.dumps({
+                'emails': failed_emails,
+                'template': "Template #" + str(template),
+            })
+        )
+
+    return failed_emails
+
+
+@shared_task
+def sync_newsletter_subscriptions():
+    """
+    Replaces the local copy of the newsletter list with the members fetched
+    from Mailchimp by pages. Nothing is changed if Mailchimp is disabled.
+    Returns the number of members of the list.
+    """
+    members = mailchimp.get_list_members()
+    if members is None:
+        return None
+
+    now = timezone.now()
+    statuses = {
+        member['email_address'].lower(): member['status']
+        for member in members
+    }
+    with transaction.atomic():
+        NewsletterSubscription.objects.exclude(
+            email__in=statuses.keys(),
+        ).delete()
+        NewsletterSubscription.objects.bulk_create(
+            [
+                NewsletterSubscription(
+                    email=email,
+                    status=status,
+                    synced_at=now,
+                )
+                for email, status in statuses.items()
+            ],
+            update_conflicts=True,
+            unique_fields=['email'],
+            update_fields=['status', 'synced_at'],
+        )
+
+    return len(statuses)
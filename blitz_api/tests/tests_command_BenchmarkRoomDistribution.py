@@ -0,0 +1,29 @@
+from io import StringIO
+
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase
+
+
+class BenchmarkRoomDistributionTest(SimpleTestCase):
+
+    def test_benchmark_room_distribution(self):
+        out = StringIO()
+
+        call_command(
+            'benchmark_room_distribution',
+            '--participants', '50',
+            '--runs', '2',
+            '--seed', '1',
+            stdout=out,
+        )
+
+        self.assertIn('2 retreat(s) of 50 participants', out.getvalue())
+        self.assertIn('unplaced participants: 0', out.getvalue())
+
+    def test_benchmark_room_distribution_without_runs(self):
+        with self.assertRaises(CommandError):
+            call_command(
+                'benchmark_room_distribution',
+                '--runs', '0',
+                stdout=StringIO(),
+            )
@@ -0,0 +1,62 @@
+from io import StringIO
+from datetime import datetime
+
+import pytz
+from django.conf import settings
+from django.core.management import call_command
+from django.test import TestCase
+
+from blitz_api.factories import UserFactory
+from store.models import Coupon, CouponUser
+
+LOCAL_TIMEZONE = pytz.timezone(settings.TIME_ZONE)
+
+
+class ReconcileCouponUsesTest(TestCase):
+
+    def setUp(self):
+        self.user = UserFactory()
+        self.user2 = UserFactory()
+        self.coupon = Coupon.objects.create(
+            code="ABCD1234",
+            start_time=LOCAL_TIMEZONE.localize(datetime(2000, 1, 15, 8)),
+            end_time=LOCAL_TIMEZONE.localize(datetime(2130, 1, 15, 8)),
+            value=10,
+            max_use_per_user=0,
+            max_use=0,
+            total_uses=1,
+            owner=self.user,
+        )
+        CouponUser.objects.create(
+            user=self.user,
+            coupon=self.coupon,
+            uses=2,
+        )
+        CouponUser.objects.create(
+            user=self.user2,
+            coupon=self.coupon,
+            uses=3,
+        )
+
+    def test_reconcile_coupon_uses(self):
+        out = StringIO()
+
+        call_command('reconcile_coupon_uses', stdout=out)
+
+        self.coupon.refresh_from_db()
+        self.assertEqual(self.coupon.total_uses, 5)
+        self.assertIn('ABCD1234: 1 -> 5', out.getvalue())
+        self.assertIn('1 coupon(s) reconciled', out.getvalue())
+
+        call_command('reconcile_coupon_uses', stdout=out)
+
+        self.assertIn('0 coupon(s) reconciled', out.getvalue())
+
+    def test_reconcile_coupon_uses_dry_run(self):
+        out = StringIO()
+
+        call_command('reconcile_coupon_uses', '--dry-run', stdout=out)
+
+        self.coupon.refresh_from_db()
+        self.assertEqual(self.coupon.total_uses, 1)
+        self.assertIn('ABCD1234: 1 -> 5', out.getvalue())
@@ -6,6 +6,7 @@ from datetime import datetime
 from rest_framework.test import APITestCase
 
 from blitz_api.factories import UserFactory
+from blitz_api.models import User
 from tomato.factories import TomatoFactory
 from tomato.models import Tomato
 from blitz_api.factories import (
@@ -307,3 +308,52 @@ class UserTests(APITestCase):
         )
 
         self.assertEqual(user3.get_number_of_past_tomatoes(), 0)
+
+    def test_with_tomato_statistics(self):
+        """
+        Ensure users annotated with their statistics of tomatoes don't query
+        them again
+        """
+        user1 = UserFactory()
+        TomatoFactory(
+            user=user1,
+            number_of_tomato=15,
+            acquisition_date=timezone.now(),
+            source=Tomato.TOMATO_SOURCE_TIMESLOT)
+        timeslot = TimeSlotFactory()
+        TimeSlotReservationFactory(timeslot=timeslot, user=user1)
+        retreat = RetreatFactory(
+            number_of_tomatoes=11,
+            type=RetreatTypeFactory(),
+            display_start_time=LOCAL_TIMEZONE.localize(
+                datetime(1990, 1, 15, 8))
+        )
+        RetreatDateFactory(retreat=retreat)
+        RetreatDateFactory(
+            retreat=retreat,
+            start_time=LOCAL_TIMEZONE.localize(datetime(2130, 1, 18, 8)),
+            end_time=LOCAL_TIMEZONE.localize(datetime(2130, 1, 20, 12))
+        )
+        ReservationFactory(retreat=retreat, user=user1, is_active=True)
+
+        user = User.objects.with_tomato_statistics().get(pk=user1.pk)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(user.get_number_of_past_tomatoes(), 15)
+            self.assertEqual(user.current_month_tomatoes, 15)
+            self.assertEqual(
+                user.get_nb_tomatoes_timeslot(),
+                {
+                    'past': 15,
+                    'future': timeslot.number_of_tomatoes,
+                })
+            self.assertEqual(
+                user.get_nb_tomatoes_retreat(),
+                {
+                    'past': 0,
+                    'future': 11,
+                })
+            self.assertEqual(
+                user.get_number_of_future_tomatoes(),
+                timeslot.number_of_tomatoes + 11,
+            )
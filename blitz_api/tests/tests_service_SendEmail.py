@@ -0,0 +1,254 @@
+from types import SimpleNamespace
+from unittest import mock
+
+from django.core import mail
+from django.core.mail import EmailMessage
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from log_management.models import EmailLog, Log
+
+from ..exceptions import MailServiceError
+from ..factories import UserFactory
+from ..services import (
+    queue_email_from_template_id,
+    send_email_from_template_id,
+)
+from ..tasks import send_email_from_template_id_task
+
+
+@override_settings(
+    LOCAL_SETTINGS={
+        "EMAIL_SERVICE": True,
+    }
+)
+class SendEmailTests(TestCase):
+
+    def setUp(self):
+        self.user = UserFactory()
+        self.user2 = UserFactory()
+        self.user3 = UserFactory()
+
+    def test_send_email_batch(self):
+        """
+        Ensure all users are emailed with a single batch send holding the
+        data of each user
+        """
+        merge_data = {
+            self.user.email: {'USER_FIRST_NAME': 'A'},
+            self.user2.email: {'USER_FIRST_NAME': 'B'},
+        }
+
+        failed_emails = send_email_from_template_id(
+            [self.user, self.user2, self.user],
+            {'RETREAT_NAME': 'Retreat'},
+            '5',
+            merge_data,
+            batch=True,
+        )
+
+        self.assertEqual(failed_emails, [])
+        self.assertEqual(len(mail.outbox), 1)
+        message = mail.outbox[0]
+        self.assertEqual(message.to, [self.user.email, self.user2.email])
+        self.assertEqual(message.template_id, 5)
+        self.assertEqual(
+            message.merge_global_data,
+            {'RETREAT_NAME': 'Retreat'},
+        )
+        self.assertEqual(message.merge_data, merge_data)
+        self.assertEqual(
+            EmailLog.objects.filter(
+                type_email='Template #5',
+                nb_email_sent=1,
+            ).count(),
+            2,
+        )
+
+    def test_send_email(self):
+        """
+        Ensure each user is emailed with its own message over a single
+        connection
+        """
+        connection = mail.get_connection()
+        with mock.patch(
+            'blitz_api.services.get_connection',
+            return_value=connection,
+        ) as get_connection:
+            failed_emails = send_email_from_template_id(
+                [self.user, self.user2],
+                {'RETREAT_NAME': 'Retreat'},
+                5,
+            )
+
+        self.assertEqual(failed_emails, [])
+        get_connection.assert_called_once_with()
+        self.assertEqual(
+            [message.to for message in mail.outbox],
+            [[self.user.email], [self.user2.email]],
+        )
+        self.assertFalse(hasattr(mail.outbox[0], 'merge_data'))
+        self.assertEqual(EmailLog.objects.count(), 2)
+
+    def test_send_email_failure(self):
+        """
+        Ensure a message that fails is logged and its exception raised, the
+        messages sent before are logged
+        """
+        original_send = EmailMessage.send
+
+        def send(message, *args, **kwargs):
+            if self.user2.email in message.to:
+                raise Exception('ESP unavailable')
+            return original_send(message, *args, **kwargs)
+
+        with mock.patch.object(EmailMessage, 'send', send):
+            with self.assertRaises(Exception):
+                send_email_from_template_id(
+                    [self.user, self.user2, self.user3],
+                    {},
+                    5,
+                )
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(
+            Log.objects.filter(source='SENDING_BLUE_TEMPLATE').count(),
+            1,
+        )
+        self.assertEqual(
+            list(EmailLog.objects.values_list('user_email', flat=True)),
+            [self.user.email],
+        )
+
+    @override_settings(EMAIL_BATCH_SIZE=2)
+    def test_send_email_batches(self):
+        """
+        Ensure users are split in batches sent over a single connection
+        """
+        connection = mail.get_connection()
+        with mock.patch(
+            'blitz_api.services.get_connection',
+            return_value=connection,
+        ) as get_connection, self.assertNumQueries(1):
+            failed_emails = send_email_from_template_id(
+                [self.user, self.user2, self.user3],
+                {},
+                5,
+                batch=True,
+            )
+
+        self.assertEqual(failed_emails, [])
+        get_connection.assert_called_once_with()
+        self.assertEqual(
+            [message.to for message in mail.outbox],
+            [[self.user.email, self.user2.email], [self.user3.email]],
+        )
+        self.assertEqual(EmailLog.objects.count(), 3)
+
+    @override_settings(EMAIL_BATCH_SIZE=2)
+    def test_send_email_batch_failure(self):
+        """
+        Ensure a batch that fails doesn't prevent the others from being sent
+        """
+        original_send = EmailMessage.send
+
+        def send(message, *args, **kwargs):
+            if self.user3.email in message.to:
+                raise Exception('ESP unavailable')
+            return original_send(message, *args, **kwargs)
+
+        with mock.patch.object(EmailMessage, 'send', send):
+            failed_emails = send_email_from_template_id(
+                [self.user, self.user2, self.user3],
+                {},
+                5,
+                batch=True,
+            )
+
+        self.assertEqual(failed_emails, [self.user3.email])
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(
+            Log.objects.filter(source='SENDING_BLUE_TEMPLATE').count(),
+            1,
+        )
+        self.assertEqual(EmailLog.objects.count(), 2)
+
+    def test_send_email_rejected(self):
+        """
+        Ensure the recipients rejected by the ESP are returned
+        """
+        def send(message):
+            message.anymail_status = SimpleNamespace(recipients={
+                self.user.email: SimpleNamespace(status='queued'),
+                self.user2.email: SimpleNamespace(status='rejected'),
+            })
+            return 1
+
+        with mock.patch.object(EmailMessage, 'send', send):
+            failed_emails = send_email_from_template_id(
+                [self.user, self.user2],
+                {},
+                5,
+                batch=True,
+            )
+
+        self.assertEqual(failed_emails, [self.user2.email])
+        self.assertEqual(
+            EmailLog.objects.get(user_email=self.user2.email).nb_email_sent,
+            0,
+        )
+
+    @override_settings(
+        LOCAL_SETTINGS={
+            "EMAIL_SERVICE": False,
+        }
+    )
+    def test_send_email_disabled(self):
+        """
+        Ensure nothing is sent when the email service is disabled
+        """
+        with self.assertRaises(MailServiceError):
+            send_email_from_template_id([self.user], {}, 5)
+
+        with self.assertRaises(MailServiceError):
+            queue_email_from_template_id([self.user], {}, 5)
+
+        self.assertEqual(len(mail.outbox), 0)
+
+    @mock.patch('blitz_api.tasks.send_email_from_template_id_task.delay')
+    def test_queue_email(self, delay):
+        """
+        Ensure emails are sent by a worker once the transaction is committed
+        """
+        with self.captureOnCommitCallbacks(execute=True):
+            queue_email_from_template_id(
+                [self.user, self.user2],
+                {'RETREAT_NAME': 'Retreat'},
+                5,
+            )
+            delay.assert_not_called()
+
+        delay.assert_called_once_with(
+            [self.user.id, self.user2.id],
+            {'RETREAT_NAME': 'Retreat'},
+            5,
+            None,
+        )
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_send_email_task(self):
+        """
+        Ensure the task emails the given users
+        """
+        failed_emails = send_email_from_template_id_task(
+            [self.user.id, self.user2.id],
+            {},
+            5,
+        )
+
+        self.assertEqual(failed_emails, [])
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(
+            sorted(mail.outbox[0].to),
+            sorted([self.user.email, self.user2.email]),
+        )
@@ -0,0 +1,97 @@
+from unittest import mock
+
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient, APITestCase
+
+from ..factories import AdminFactory, UserFactory
+from ..models import NewsletterSubscription
+from ..tasks import sync_newsletter_subscriptions
+
+
+class SyncNewsletterSubscriptionsTests(APITestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = AdminFactory()
+        self.user = UserFactory(email='Subscriber@example.org')
+        self.user2 = UserFactory(email='other@example.org')
+
+    @mock.patch('blitz_api.mailchimp.get_list_members')
+    def test_sync_newsletter_subscriptions(self, get_list_members):
+        """
+        Ensure the local list is replaced by the members of the Mailchimp
+        list
+        """
+        NewsletterSubscription.objects.create(
+            email='unsubscribed@example.org',
+            status='subscribed',
+        )
+        NewsletterSubscription.objects.create(
+            email='subscriber@example.org',
+            status='pending',
+            synced_at=timezone.now() - timezone.timedelta(days=1),
+        )
+        get_list_members.return_value = [
+            {
+                'email_address': 'Subscriber@example.org',
+                'status': 'subscribed',
+            },
+            {
+                'email_address': 'new@example.org',
+                'status': 'subscribed',
+            },
+        ]
+
+        self.assertEqual(sync_newsletter_subscriptions(), 2)
+
+        self.assertEqual(
+            dict(NewsletterSubscription.objects.values_list(
+                'email',
+                'status',
+            )),
+            {
+                'subscriber@example.org': 'subscribed',
+                'new@example.org': 'subscribed',
+            },
+        )
+        self.assertTrue(self.user.is_in_newsletter)
+        self.assertFalse(self.user2.is_in_newsletter)
+
+    @mock.patch('blitz_api.mailchimp.get_list_members', return_value=None)
+    def test_sync_newsletter_subscriptions_disabled(self, get_list_members):
+        """
+        Ensure the local list is kept when Mailchimp is disabled
+        """
+        NewsletterSubscription.objects.create(
+            email='subscriber@example.org',
+            status='subscribed',
+        )
+
+        self.assertIsNone(sync_newsletter_subscriptions())
+
+        self.assertTrue(NewsletterSubscription.objects.exists())
+
+    @mock.patch('blitz_api.mailchimp.get_member')
+    def test_list_users_is_in_newsletter(self, get_member):
+        """
+        Ensure users are listed with their subscription without calling
+        Mailchimp
+        """
+        NewsletterSubscription.objects.create(
+            email='subscriber@example.org',
+            status='subscribed',
+        )
+        self.client.force_authenticate(user=self.admin)
+
+        response = self.client.get(reverse('user-list'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        subscriptions = {
+            user['email']: user['is_in_newsletter']
+            for user in response.json()['results']
+        }
+        self.assertTrue(subscriptions[self.user.email])
+        self.assertFalse(subscriptions[self.user2.email])
+        get_member.assert_not_called()
@@ -2,6 +2,9 @@ import json
 
 from django.urls import reverse
 from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
 
 from rest_framework.test import APIClient
 from rest_framework import status
@@ -147,3 +150,102 @@ class TemporaryTokenAuthenticationTests(APITestCase):
         self.assertEqual(json.loads(response.content), content)
 
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_authenticate_without_writes(self):
+        """
+        Ensure authenticated requests don't write the token nor the user
+        while their renewal is recent, and read both with a single query.
+        """
+        token = TemporaryToken.objects.create(user=self.user)
+        self.user.last_login = timezone.now()
+        self.user.save()
+        url = reverse('academiclevel-list')
+        user_history_count = self.user.history.count()
+
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        for query in queries.captured_queries:
+            self.assertTrue(query['sql'].startswith('SELECT'))
+        token_queries = [
+            query for query in queries.captured_queries
+            if '"blitz_api_temporarytoken"' in query['sql']
+        ]
+        self.assertEqual(len(token_queries), 1)
+
+        self.assertFalse(TemporaryToken.history.filter(
+            key=token.key,
+            history_type='~',
+        ).exists())
+        self.assertEqual(self.user.history.count(), user_history_count)
+
+    @override_settings(
+        REST_FRAMEWORK_TEMPORARY_TOKENS={
+            'MINUTES': 60,
+            'RENEW_ON_SUCCESS': True,
+            'USE_AUTHENTICATION_BACKENDS': False,
+            'RENEW_THRESHOLD_SECONDS': 300,
+        }
+    )
+    def test_authenticate_renew(self):
+        """
+        Ensure the expiration date of the token and the last login of the
+        user are renewed once older than the threshold.
+        """
+        last_renewal = timezone.now() - timezone.timedelta(minutes=10)
+        token = TemporaryToken.objects.create(
+            user=self.user,
+            expires=last_renewal + timezone.timedelta(minutes=60),
+        )
+        self.user.last_login = last_renewal
+        self.user.save()
+
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        self.client.get(reverse('academiclevel-list'))
+
+        token.refresh_from_db()
+        self.user.refresh_from_db()
+        self.assertGreater(
+            token.expires,
+            timezone.now() + timezone.timedelta(minutes=59),
+        )
+        self.assertGreater(self.user.last_login, last_renewal)
+
+    def test_authenticate_after_logout(self):
+        """
+        Ensure a token can't be used once the user logged out.
+        """
+        token = TemporaryToken.objects.create(user=self.user)
+        url = reverse('authentication-detail', kwargs={'pk': token.key})
+
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        response = self.client.get(
+            reverse('academiclevel-list')
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_authenticate_after_bulk_delete(self):
+        """
+        Ensure a token deleted without calling its delete method, ie: by
+        another process or a queryset, can't be used anymore.
+        """
+        token = TemporaryToken.objects.create(user=self.user)
+
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        response = self.client.get(reverse('academiclevel-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        TemporaryToken.objects.filter(key=token.key).delete()
+
+        response = self.client.get(reverse('academiclevel-list'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
@@ -1,5 +1,8 @@
+import csv
+import io
 import json
 import re
+from unittest import mock
 
 from rest_framework import status
 from rest_framework.response import Response
@@ -8,11 +11,14 @@ from rest_framework.test import APIClient, APITestCase
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from django.conf import settings
+from django.test import override_settings
 
 from xlrd import open_workbook
 from xlrd.sheet import Sheet
 
 from ..factories import UserFactory, AdminFactory
+from ..models import ExportMedia
+from ..tasks import export_queryset
 
 User = get_user_model()
 
@@ -113,3 +119,68 @@ class UsersTests(APITestCase):
             user_0.first_name,
             users[0]
         )
+
+    @override_settings(
+        LOCAL_SETTINGS={
+            "EMAIL_SERVICE": True,
+            "FRONTEND_INTEGRATION": {
+                "SSO_URL": "fake_url",
+                "MAGIC_LINK_URL": "fake_url/{{token}}",
+            }
+        }
+    )
+    @mock.patch('blitz_api.mixins.export_queryset.delay')
+    def test_export_job(self, export_delay):
+        """
+        Ensure an export job exports all the filtered objects to a csv file.
+        """
+        export_delay.side_effect = export_queryset
+
+        response: Response = self.client_authenticate.post(
+            reverse('user-export-job') + f'?search={self.user.email}'
+        )
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_202_ACCEPTED,
+            response.content
+        )
+
+        export_response = json.loads(response.content)
+        self.assertEqual(export_response['status'], 'PENDING')
+
+        # The task only receives plain data to filter the queryset again
+        export_delay.assert_called_once_with(
+            export_response['job_id'],
+            'blitz_api.views.UserViewSet',
+            {'search': [self.user.email]},
+        )
+
+        export = ExportMedia.objects.get(id=export_response['job_id'])
+        self.assertEqual(export.status, ExportMedia.STATUS_DONE)
+        self.assertEqual(export.author, self.admin)
+        self.assertEqual(export.progress, 1)
+        self.assertEqual(export.total, 1)
+
+        with export.file.open('rb') as export_file:
+            users = list(csv.DictReader(
+                io.TextIOWrapper(export_file, encoding='utf-8')
+            ))
+
+        self.assertEqual(len(users), 1)
+        self.assertEqual(users[0]['id'], str(self.user.id))
+        self.assertEqual(users[0]['first_name'], self.user.first_name)
+
+    def test_export_job_as_user(self):
+        """
+        Ensure only admins can start an export job.
+        """
+        self.client.force_authenticate(user=self.user)
+
+        response: Response = self.client.post(reverse('user-export-job'))
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_403_FORBIDDEN,
+            response.content
+        )
@@ -5,6 +5,7 @@ from django.conf import settings
 from django.utils import timezone
 from django.http import Http404
 from django.core.exceptions import ValidationError
+from django.db.models import OuterRef
 from django.utils.translation import gettext_lazy as _
 from django_filters import (
     FilterSet,
@@ -33,6 +34,7 @@ from .models import (
     AcademicField,
     ExportMedia,
     MagicLink,
+    NewsletterSubscription,
 )
 from .resources import (AcademicFieldResource, AcademicLevelResource,
                         OrganizationResource, UserResource)
@@ -96,7 +98,17 @@ class UserViewSet(ExportMixin, viewsets.ModelViewSet):
 
     def get_queryset(self):
         user = self.request.user
-        queryset = User.objects.all()
+        if self.action == 'list':
+            # The other actions handle a single user, which computes its
+            # statistics itself when serialized
+            queryset = User.objects.with_tomato_statistics()
+        else:
+            queryset = User.objects.all()
+        queryset = queryset.annotate(
+            newsletter_subscribed=NewsletterSubscription.is_subscribed(
+                OuterRef('email'),
+            ),
+        )
         if self.kwargs.get("pk", "") == "me":
             self.kwargs['pk'] = user.id
         return queryset
@@ -111,7 +123,7 @@ class UserViewSet(ExportMixin, viewsets.ModelViewSet):
             'execute_automatic_email_membership_end'
         ]:
             permission_classes = []
-        elif self.action == 'list':
+        elif self.action in ['list', 'export', 'export_job']:
             permission_classes = [IsAdminUser, ]
         else:
             permission_classes = [
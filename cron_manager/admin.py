@@ -27,6 +27,7 @@ class TaskAdmin(admin.ModelAdmin):
     list_display = (
         'id',
         'description',
+        'task_type',
         'execution_datetime',
         'execution_interval',
         'active',
@@ -34,6 +35,7 @@ class TaskAdmin(admin.ModelAdmin):
     )
     list_filter = (
         'description',
+        'task_type',
         'active'
     )
     search_fields = (
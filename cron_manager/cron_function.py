@@ -1,12 +1,61 @@
-from cron_manager.models import Task
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from cron_manager.managers import get_claim_size
+from cron_manager.models import Execution, Task
 
 
 def execute_tasks():
+    """
+    Executes the tasks due. They are leased to this worker by batches that
+    can be triggered before the end of the lease. Each batch is triggered
+    concurrently on a bounded pool of threads, then its executions are
+    recorded in one query.
+    """
+    claim_size = get_claim_size()
+    executions = []
+    executed_pks = []
+    while True:
+        # Tasks that failed are due again, they are executed by a next call
+        tasks = Task.objects.claim_due(
+            limit=claim_size,
+            exclude=executed_pks,
+        )
+        if tasks:
+            executed_pks += [task.pk for task in tasks]
+            executions += execute_claimed_tasks(tasks)
+        if len(tasks) < claim_size:
+            return executions
+
+
+def execute_claimed_tasks(tasks):
+    """
+    Triggers tasks leased to this worker, records their executions and
+    releases their leases.
+    """
+    try:
+        with ThreadPoolExecutor(
+                max_workers=settings.CRON_MANAGER['WORKERS']
+        ) as executor:
+            results = list(
+                executor.map(lambda task: task.trigger(), tasks)
+            )
 
-    task_actives = Task.objects.filter(
-        active=True
-    )
+        executions = Execution.objects.bulk_create([
+            task.build_execution(task.next_execution_datetime(), result)
+            for task, result in zip(tasks, results)
+        ])
+        Task.objects.filter(
+            pk__in=[
+                task.pk for task, result in zip(tasks, results)
+                if result['deactivate']
+            ],
+        ).update(active=False)
+    finally:
+        # Release the leases
+        Task.objects.filter(
+            pk__in=[task.pk for task in tasks],
+        ).update(locked_until=None)
 
-    for task in task_actives:
-        if task.can_be_execute:
-            task.execute()
+    return executions
@@ -0,0 +1,108 @@
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import (
+    DateTimeField,
+    DurationField,
+    ExpressionWrapper,
+    F,
+    OuterRef,
+    Q,
+    Subquery,
+    Value,
+)
+from django.utils import timezone
+
+
+class TaskManager(models.Manager):
+
+    def with_last_execution(self):
+        """
+        Annotates the date of the last successful execution of each task and
+        the date of its next execution.
+        """
+        Execution = apps.get_model('cron_manager', 'Execution')
+        last_executed_at = Execution.objects.filter(
+            task=OuterRef('pk'),
+            success=True,
+        ).order_by('-executed_at').values('executed_at')[:1]
+
+        return self.get_queryset().annotate(
+            last_executed_at=Subquery(
+                last_executed_at,
+                output_field=DateTimeField(),
+            ),
+        ).annotate(
+            next_executed_at=ExpressionWrapper(
+                F('last_executed_at') + ExpressionWrapper(
+                    F('execution_interval') * Value(
+                        timedelta(milliseconds=1),
+                        output_field=DurationField(),
+                    ),
+                    output_field=DurationField(),
+                ),
+                output_field=DateTimeField(),
+            ),
+        )
+
+    def due(self, now=None):
+        """
+        Returns the active tasks to execute, in a single query.
+        """
+        if now is None:
+            now = timezone.now()
+        return self.with_last_execution().filter(
+            Q(last_executed_at__isnull=True, execution_datetime__lte=now) |
+            Q(next_executed_at__lte=now),
+            active=True,
+        )
+
+    def claim_due(self, now=None, limit=None, exclude=()):
+        """
+        Leases at most `limit` tasks due to the caller and returns them.
+        Tasks leased by another worker are skipped until executed or until
+        their lease expires, so concurrent workers never execute the same
+        task. By default, only the number of tasks the workers can trigger
+        before the end of the lease are claimed, see get_claim_size.
+        :param exclude: The pk of tasks not to claim, ie: already executed
+        """
+        if limit is None:
+            limit = get_claim_size()
+        if now is None:
+            now = timezone.now()
+        lease_end = now + timedelta(
+            seconds=settings.CRON_MANAGER['LEASE_SECONDS']
+        )
+
+        with transaction.atomic():
+            tasks = list(
+                self.due(now).filter(
+                    Q(locked_until__isnull=True) | Q(locked_until__lte=now),
+                ).exclude(
+                    pk__in=exclude,
+                ).select_for_update(
+                    skip_locked=True,
+                ).order_by('pk')[:limit]
+            )
+            self.filter(pk__in=[task.pk for task in tasks]).update(
+                locked_until=lease_end,
+            )
+
+        for task in tasks:
+            task.locked_until = lease_end
+        return tasks
+
+
+def get_claim_size():
+    """
+    Returns the number of tasks the workers can trigger during a lease, even
+    if each of them reaches the connect and read timeouts.
+    """
+    config = settings.CRON_MANAGER
+    task_seconds = config['CONNECT_TIMEOUT'] + config['READ_TIMEOUT']
+    return max(
+        1,
+        int(config['WORKERS'] * config['LEASE_SECONDS'] // task_seconds),
+    )
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.14 on 2026-10-17 06:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cron_manager', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='locked_until',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Locked until'),
+        ),
+    ]
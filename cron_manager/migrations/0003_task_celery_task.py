@@ -0,0 +1,33 @@
+# Generated by Django 5.2.14 on 2026-10-17 06:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cron_manager', '0002_task_locked_until'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='celery_kwargs',
+            field=models.JSONField(blank=True, null=True, verbose_name='Celery task arguments'),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='celery_task',
+            field=models.CharField(blank=True, help_text='Dotted name of the Celery task to dispatch', max_length=255, verbose_name='Celery task'),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='task_type',
+            field=models.CharField(choices=[('url', 'URL'), ('celery', 'Celery task')], default='url', max_length=20, verbose_name='Type'),
+        ),
+        migrations.AlterField(
+            model_name='task',
+            name='url',
+            field=models.URLField(blank=True, verbose_name='URL to execute'),
+        ),
+    ]
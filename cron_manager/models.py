@@ -1,19 +1,54 @@
 import datetime
 
 import requests
+from celery import current_app
+from django.conf import settings
 from django.db import models
 from django.utils import timezone
 
 from django.utils.translation import gettext_lazy as _
 
+from cron_manager.managers import TaskManager
+
 
 class Task(models.Model):
     """Model for tasks"""
 
+    # Calls an url, for external targets
+    TYPE_URL = 'url'
+    # Dispatches a Celery task of the API to a worker
+    TYPE_CELERY = 'celery'
+
+    TYPE_CHOICES = [
+        (TYPE_URL, _('URL')),
+        (TYPE_CELERY, _('Celery task')),
+    ]
+
+    task_type = models.CharField(
+        max_length=20,
+        choices=TYPE_CHOICES,
+        default=TYPE_URL,
+        verbose_name=_("Type"),
+    )
+
     url = models.URLField(
+        blank=True,
         verbose_name=_("URL to execute"),
     )
 
+    celery_task = models.CharField(
+        max_length=255,
+        blank=True,
+        verbose_name=_("Celery task"),
+        help_text=_("Dotted name of the Celery task to dispatch"),
+    )
+
+    celery_kwargs = models.JSONField(
+        blank=True,
+        null=True,
+        verbose_name=_("Celery task arguments"),
+    )
+
     description = models.CharField(
         max_length=150,
         verbose_name=_("Description"),
@@ -39,6 +74,14 @@ class Task(models.Model):
         verbose_name=_("Created_at"),
     )
 
+    locked_until = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name=_("Locked until"),
+    )
+
+    objects = TaskManager()
+
     def __str__(self):
         return self.description
 
@@ -47,11 +90,24 @@ class Task(models.Model):
         return self.executions.filter(success=True)\
             .order_by('-executed_at').first()
 
+    @property
+    def last_executed_at(self):
+        # Use the date annotated by TaskManager.with_last_execution() if any
+        if 'last_executed_at' in self.__dict__:
+            return self.__dict__['last_executed_at']
+        last_execution = self.last_execution
+        return last_execution.executed_at if last_execution else None
+
+    @last_executed_at.setter
+    def last_executed_at(self, value):
+        self.__dict__['last_executed_at'] = value
+
     def next_execution_datetime(self):
-        if self.last_execution:
+        last_executed_at = self.last_executed_at
+        if last_executed_at:
             if self.execution_interval:
                 next_execution_datetime = \
-                    self.last_execution.executed_at + \
+                    last_executed_at + \
                     datetime.timedelta(milliseconds=self.execution_interval)
             else:
                 next_execution_datetime = False
@@ -66,40 +122,106 @@ class Task(models.Model):
             next_execution_datetime = self.next_execution_datetime()
 
             if next_execution_datetime:
-                return timezone.now() >= self.next_execution_datetime()
+                return timezone.now() >= next_execution_datetime
             else:
                 return False
         else:
             return False
 
-    def execute(self):
-
-        executed_at = self.next_execution_datetime()
-
-        execution = Execution.objects.create(
-            task=self,
-            executed_at=executed_at
-        )
-
-        response = requests.get(self.url)
-
-        success = False
+    def send_request(self):
+        """
+        Calls the url of the task and returns the result to record. The
+        database is not used so it can run in a worker thread.
+        """
+        result = {
+            'success': False,
+            'http_code': None,
+            'http_response': None,
+            'deactivate': False,
+        }
+        try:
+            response = requests.get(
+                self.url,
+                timeout=(
+                    settings.CRON_MANAGER['CONNECT_TIMEOUT'],
+                    settings.CRON_MANAGER['READ_TIMEOUT'],
+                ),
+            )
+        except requests.RequestException as err:
+            result['http_response'] = repr(err)
+            return result
+
+        result['http_code'] = response.status_code
+        result['http_response'] = response.text
         if 200 <= response.status_code < 300:
-            success = True
+            result['success'] = True
 
         try:
             content = response.json()
             stop_cron_task = content.get('stop', False)
             if stop_cron_task or not self.execution_interval:
-                self.active = False
-                self.save()
+                result['deactivate'] = True
         except Exception:
-            success = False
+            result['success'] = False
+
+        return result
+
+    def dispatch_celery_task(self):
+        """
+        Sends the Celery task to a worker and returns the result to record,
+        like send_request().
+        """
+        result = {
+            'success': False,
+            'http_code': None,
+            'http_response': None,
+            'deactivate': False,
+        }
+        try:
+            async_result = current_app.send_task(
+                self.celery_task,
+                kwargs=self.celery_kwargs or {},
+            )
+        except Exception as err:
+            result['http_response'] = repr(err)
+            return result
+
+        result['success'] = True
+        result['http_response'] = f'Celery task {async_result.id}'
+        result['deactivate'] = not self.execution_interval
+        return result
+
+    def trigger(self):
+        """
+        Executes the task according to its type and returns the result to
+        record. The database is not used so it can run in a worker thread.
+        """
+        if self.task_type == self.TYPE_CELERY:
+            return self.dispatch_celery_task()
+        return self.send_request()
+
+    def build_execution(self, executed_at, result):
+        return Execution(
+            task=self,
+            executed_at=executed_at,
+            success=result['success'],
+            http_code=result['http_code'],
+            http_response=result['http_response'],
+        )
+
+    def execute(self):
+
+        executed_at = self.next_execution_datetime()
+
+        result = self.trigger()
+
+        if result['deactivate']:
+            self.active = False
+            self.save(update_fields=['active'])
 
-        execution.success = success
-        execution.http_code = response.status_code
-        execution.http_response = response.text
+        execution = self.build_execution(executed_at, result)
         execution.save()
+        return execution
 
 
 class Execution(models.Model):
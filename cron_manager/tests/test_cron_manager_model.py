@@ -2,11 +2,14 @@ import json
 from datetime import datetime
 from unittest import mock
 
+import requests
 import responses
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.utils import timezone
 
-from cron_manager.models import Task
+from cron_manager.cron_function import execute_tasks
+from cron_manager.managers import get_claim_size
+from cron_manager.models import Execution, Task
 from log_management.models import Log
 
 
@@ -138,3 +141,227 @@ class CronManagerTests(TestCase):
 
             execution = self.task.executions.first()
             self.assertFalse(execution.success)
+
+    def test_due(self):
+        """
+        Ensure the tasks due are found in a single query
+        """
+        now = timezone.now() + timezone.timedelta(minutes=10)
+        Execution.objects.create(
+            task=self.task,
+            executed_at=now - timezone.timedelta(hours=1),
+            success=True,
+        )
+        executed_task = Task.objects.create(
+            url=self.url_test,
+            description='test_description_task',
+            execution_datetime=timezone.now(),
+            execution_interval=3600000,
+        )
+        Execution.objects.create(
+            task=executed_task,
+            executed_at=now - timezone.timedelta(hours=2),
+            success=True,
+        )
+        Task.objects.create(
+            url=self.url_test,
+            description='test_description_task',
+            execution_datetime=now + timezone.timedelta(minutes=10),
+        )
+
+        with self.assertNumQueries(1):
+            tasks = list(Task.objects.due(now).order_by('pk'))
+
+        self.assertEqual(
+            [task.pk for task in tasks],
+            [self.task_without_interval.pk, executed_task.pk],
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                tasks[1].next_execution_datetime(),
+                now - timezone.timedelta(hours=1),
+            )
+
+    def test_claim_due(self):
+        """
+        Ensure leased tasks are not claimed again until their lease expires
+        """
+        self.task.locked_until = timezone.now() + timezone.timedelta(
+            minutes=1)
+        self.task.save()
+
+        tasks = Task.objects.claim_due()
+
+        self.assertEqual(
+            [task.pk for task in tasks],
+            [self.task_without_interval.pk],
+        )
+        self.assertEqual(Task.objects.claim_due(), [])
+
+        later = timezone.now() + timezone.timedelta(days=1)
+        tasks = Task.objects.claim_due(later)
+
+        self.assertEqual(
+            [task.pk for task in tasks],
+            [self.task.pk, self.task_without_interval.pk],
+        )
+
+    @override_settings(CRON_MANAGER={
+        'WORKERS': 1,
+        'CONNECT_TIMEOUT': 5,
+        'READ_TIMEOUT': 55,
+        'LEASE_SECONDS': 60,
+    })
+    def test_claim_due_limit(self):
+        """
+        Ensure no more tasks are claimed than the workers can trigger before
+        the end of their lease
+        """
+        self.assertEqual(get_claim_size(), 1)
+
+        tasks = Task.objects.claim_due()
+
+        self.assertEqual([task.pk for task in tasks], [self.task.pk])
+
+        tasks = Task.objects.claim_due()
+
+        self.assertEqual(
+            [task.pk for task in tasks],
+            [self.task_without_interval.pk],
+        )
+
+    @override_settings(CRON_MANAGER={
+        'WORKERS': 1,
+        'CONNECT_TIMEOUT': 5,
+        'READ_TIMEOUT': 55,
+        'LEASE_SECONDS': 60,
+    })
+    @responses.activate
+    def test_execute_tasks_by_batches(self):
+        """
+        Ensure due tasks are claimed and executed by batches, each task only
+        once even when it fails
+        """
+        other_url = 'http://local/other/'
+        responses.add(
+            responses.GET,
+            self.url_test,
+            json={
+                'stop': False
+            },
+            status=200
+        )
+        responses.add(
+            responses.GET,
+            other_url,
+            body=requests.exceptions.ReadTimeout('timeout'),
+        )
+        failing_task = Task.objects.create(
+            url=other_url,
+            description='test_description_task',
+            execution_datetime=timezone.now(),
+            execution_interval=86400000
+        )
+
+        executions = execute_tasks()
+
+        self.assertEqual(len(executions), 3)
+        self.assertEqual(failing_task.executions.count(), 1)
+        self.assertFalse(
+            Task.objects.filter(locked_until__isnull=False).exists()
+        )
+
+    @responses.activate
+    def test_execute_tasks(self):
+        """
+        Ensure due tasks are executed, recorded and released, and a failing
+        url doesn't prevent other tasks from being executed
+        """
+        other_url = 'http://local/other/'
+        responses.add(
+            responses.GET,
+            self.url_test,
+            json={
+                'stop': False
+            },
+            status=200
+        )
+        responses.add(
+            responses.GET,
+            other_url,
+            body=requests.exceptions.ReadTimeout('timeout'),
+        )
+        failing_task = Task.objects.create(
+            url=other_url,
+            description='test_description_task',
+            execution_datetime=timezone.now(),
+            execution_interval=86400000
+        )
+
+        executions = execute_tasks()
+
+        self.assertEqual(len(executions), 3)
+        self.assertEqual(Execution.objects.count(), 3)
+        self.assertTrue(self.task.executions.get().success)
+        self.assertTrue(self.task_without_interval.executions.get().success)
+        execution = failing_task.executions.get()
+        self.assertFalse(execution.success)
+        self.assertIn('ReadTimeout', execution.http_response)
+
+        self.task.refresh_from_db()
+        self.task_without_interval.refresh_from_db()
+        self.assertTrue(self.task.active)
+        self.assertFalse(self.task_without_interval.active)
+        self.assertFalse(
+            Task.objects.filter(locked_until__isnull=False).exists()
+        )
+
+        # Only the failed task is due again
+        self.assertEqual(
+            [task.pk for task in Task.objects.due()],
+            [failing_task.pk],
+        )
+
+    @mock.patch('cron_manager.models.current_app.send_task')
+    def test_execution_celery_task(self, mock_send_task):
+        """
+        Ensure Celery tasks are dispatched to a worker instead of calling an
+        url
+        """
+        task = Task.objects.create(
+            task_type=Task.TYPE_CELERY,
+            celery_task='retirement.tasks.execute_automatic_email',
+            celery_kwargs={'retreat_id': 1, 'email_id': 2},
+            description='test_description_task',
+            execution_datetime=timezone.now(),
+        )
+
+        execution = task.execute()
+
+        mock_send_task.assert_called_once_with(
+            'retirement.tasks.execute_automatic_email',
+            kwargs={'retreat_id': 1, 'email_id': 2},
+        )
+        self.assertTrue(execution.success)
+        task.refresh_from_db()
+        self.assertFalse(task.active)
+
+    @mock.patch('cron_manager.models.current_app.send_task')
+    def test_execution_celery_task_fail(self, mock_send_task):
+        """
+        Ensure a Celery task that can't be dispatched is executed again later
+        """
+        mock_send_task.side_effect = ConnectionError('broker unreachable')
+        task = Task.objects.create(
+            task_type=Task.TYPE_CELERY,
+            celery_task='retirement.tasks.execute_automatic_email',
+            description='test_description_task',
+            execution_datetime=timezone.now(),
+        )
+
+        execution = task.execute()
+
+        self.assertFalse(execution.success)
+        task.refresh_from_db()
+        self.assertTrue(task.active)
+        self.assertTrue(task.can_be_execute)
@@ -8,6 +8,7 @@ from log_management.models import (
     Log,
     EmailLog,
     ActionLog,
+    OutboxEmail,
 )
 
 
@@ -65,6 +66,26 @@ class EmailLogAdmin(admin.ModelAdmin):
     date_hierarchy = 'created'
 
 
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = (
+        'id',
+        'type_email',
+        'subject',
+        'status',
+        'tries',
+        'next_try_at',
+        'created',
+        'sent_at',
+    )
+    search_fields = (
+        'id', 'to', 'type_email', 'subject',)
+    list_filter = (
+        'status',
+        'type_email',
+    )
+    date_hierarchy = 'created'
+
+
 class ActionLogAdmin(admin.ModelAdmin):
     actions = [
         export_anonymous_chrono_data_month,
@@ -95,3 +116,4 @@ class ActionLogAdmin(admin.ModelAdmin):
 admin.site.register(Log, LogAdmin)
 admin.site.register(EmailLog, EmailLogAdmin)
 admin.site.register(ActionLog, ActionLogAdmin)
+admin.site.register(OutboxEmail, OutboxEmailAdmin)
@@ -0,0 +1,39 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+
+class OutboxEmailManager(models.Manager):
+
+    def claim_due(self, limit, now=None):
+        """
+        Leases at most `limit` pending emails due to the caller and returns
+        them. Emails leased by another worker are skipped until sent or until
+        their lease expires, so concurrent workers never send the same email.
+        """
+        if now is None:
+            now = timezone.now()
+        lease_end = now + timedelta(
+            seconds=settings.EMAIL_OUTBOX['LEASE_SECONDS']
+        )
+
+        with transaction.atomic():
+            outbox_emails = list(
+                self.filter(
+                    Q(locked_until__isnull=True) | Q(locked_until__lte=now),
+                    status=self.model.STATUS_PENDING,
+                    next_try_at__lte=now,
+                ).select_for_update(
+                    skip_locked=True,
+                ).order_by('next_try_at', 'pk')[:limit]
+            )
+            self.filter(
+                pk__in=[outbox_email.pk for outbox_email in outbox_emails],
+            ).update(locked_until=lease_end)
+
+        for outbox_email in outbox_emails:
+            outbox_email.locked_until = lease_end
+        return outbox_emails
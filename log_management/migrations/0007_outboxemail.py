@@ -0,0 +1,38 @@
+# Generated by Django 5.2.14 on 2026-10-17 06:44
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('log_management', '0006_actionlog_categories'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEmail',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type_email', models.CharField(max_length=1024, verbose_name='Type email')),
+                ('subject', models.TextField(verbose_name='Subject')),
+                ('body', models.TextField(verbose_name='Body')),
+                ('html_message', models.TextField(blank=True, null=True, verbose_name='HTML message')),
+                ('from_email', models.CharField(max_length=1024, verbose_name='From email')),
+                ('to', models.JSONField(verbose_name='To')),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('SENT', 'Sent'), ('FAILED', 'Failed')], default='PENDING', max_length=100, verbose_name='Status')),
+                ('tries', models.PositiveIntegerField(default=0, verbose_name='Tries')),
+                ('next_try_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Next try date')),
+                ('locked_until', models.DateTimeField(blank=True, null=True, verbose_name='Locked until')),
+                ('last_error', models.TextField(blank=True, null=True, verbose_name='Last error')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Creation date')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='Sending date')),
+            ],
+            options={
+                'verbose_name': 'Outbox Email',
+                'verbose_name_plural': 'Outbox Emails',
+                'indexes': [models.Index(fields=['status', 'next_try_at'], name='log_managem_status_810873_idx')],
+            },
+        ),
+    ]
@@ -2,9 +2,13 @@ import traceback
 import uuid
 
 from django.conf import settings
+from django.core.mail import EmailMultiAlternatives
 from django.db import models
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+from log_management.managers import OutboxEmailManager
+
 
 class Log(models.Model):
 
@@ -112,6 +116,129 @@ class EmailLog(models.Model):
         return new_email_log
 
 
+class OutboxEmail(models.Model):
+    """
+    An email to send once the transaction that created it is committed. The
+    outbox is drained by a Celery worker, see send_outbox_emails.
+    """
+
+    STATUS_PENDING = 'PENDING'
+    STATUS_SENT = 'SENT'
+    STATUS_FAILED = 'FAILED'
+
+    STATUS_CHOICES = (
+        (STATUS_PENDING, _('Pending')),
+        (STATUS_SENT, _('Sent')),
+        (STATUS_FAILED, _('Failed')),
+    )
+
+    type_email = models.CharField(
+        max_length=1024,
+        verbose_name=_("Type email")
+    )
+
+    subject = models.TextField(
+        verbose_name=_("Subject"),
+    )
+
+    body = models.TextField(
+        verbose_name=_("Body"),
+    )
+
+    html_message = models.TextField(
+        verbose_name=_("HTML message"),
+        blank=True,
+        null=True,
+    )
+
+    from_email = models.CharField(
+        max_length=1024,
+        verbose_name=_("From email"),
+    )
+
+    to = models.JSONField(
+        verbose_name=_("To"),
+    )
+
+    status = models.CharField(
+        max_length=100,
+        choices=STATUS_CHOICES,
+        default=STATUS_PENDING,
+        verbose_name=_("Status"),
+    )
+
+    tries = models.PositiveIntegerField(
+        verbose_name=_("Tries"),
+        default=0,
+    )
+
+    next_try_at = models.DateTimeField(
+        verbose_name=_("Next try date"),
+        default=timezone.now,
+    )
+
+    # Lease of the worker sending the email
+    locked_until = models.DateTimeField(
+        verbose_name=_("Locked until"),
+        blank=True,
+        null=True,
+    )
+
+    last_error = models.TextField(
+        verbose_name=_("Last error"),
+        blank=True,
+        null=True,
+    )
+
+    created = models.DateTimeField(
+        verbose_name="Creation date",
+        auto_now_add=True,
+    )
+
+    sent_at = models.DateTimeField(
+        verbose_name=_("Sending date"),
+        blank=True,
+        null=True,
+    )
+
+    objects = OutboxEmailManager()
+
+    class Meta:
+        verbose_name = _("Outbox Email")
+        verbose_name_plural = _("Outbox Emails")
+        indexes = [
+            models.Index(fields=['status', 'next_try_at']),
+        ]
+
+    @classmethod
+    def from_message(cls, message, type_email):
+        html_message = None
+        for content, mimetype in getattr(message, 'alternatives', []):
+            if mimetype == 'text/html':
+                html_message = content
+
+        return cls(
+            type_email=type_email,
+            subject=message.subject,
+            body=message.body,
+            html_message=html_message,
+            from_email=message.from_email,
+            to=message.to,
+        )
+
+    def get_message(self, connection=None):
+        message = EmailMultiAlternatives(
+            self.subject,
+            self.body,
+            self.from_email,
+            self.to,
+            connection=connection,
+        )
+        if self.html_message:
+            message.attach_alternative(self.html_message, 'text/html')
+        return message
+
+
 class ActionLog(models.Model):
 
     user = models.ForeignKey(
@@ -2,9 +2,12 @@ from celery import shared_task
 import datetime
 import io
 import csv
+from django.conf import settings
 from django.core.files.base import ContentFile
 from django.contrib.auth import get_user_model
 
+from blitz_api.services import deliver_outbox_emails
+
 User = get_user_model()
 
 
@@ -73,3 +76,22 @@ def export_anonymous_chrono_data(admin_id, start_date=None, end_date=None, targe
         ContentFile(output_stream.getvalue().encode()),
     )
     new_export.send_confirmation_email()
+
+
+@shared_task()
+def send_outbox_emails():
+    """
+    Sends the emails of the outbox due, by batches of
+    EMAIL_OUTBOX['BATCH_SIZE'], until none is left.
+    Returns the number of emails sent.
+    """
+    from log_management.models import OutboxEmail
+
+    batch_size = settings.EMAIL_OUTBOX['BATCH_SIZE']
+    sent = 0
+    while True:
+        outbox_emails = OutboxEmail.objects.claim_due(batch_size)
+        if outbox_emails:
+            sent += deliver_outbox_emails(outbox_emails)
+        if len(outbox_emails) < batch_size:
+            return sent
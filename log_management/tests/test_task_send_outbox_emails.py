@@ -0,0 +1,172 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.core import mail
+from django.core.mail import EmailMessage, EmailMultiAlternatives
+from django.db import transaction
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from blitz_api.services import queue_email_messages
+from log_management.models import EmailLog, Log, OutboxEmail
+from log_management.tasks import send_outbox_emails
+
+
+def build_message(email):
+    message = EmailMultiAlternatives(
+        'Subject',
+        'Plain message',
+        'noreply@example.org',
+        [email],
+    )
+    message.attach_alternative('<p>HTML message</p>', 'text/html')
+    return message
+
+
+@override_settings(
+    EMAIL_OUTBOX={
+        'BATCH_SIZE': 2,
+        'MAX_TRIES': 2,
+        'RETRY_DELAY_SECONDS': 60,
+        'LEASE_SECONDS': 300,
+    }
+)
+class TestSendOutboxEmailsTask(TestCase):
+
+    @mock.patch('log_management.tasks.send_outbox_emails.delay')
+    def test_queue_email_messages(self, delay):
+        """
+        Ensure emails are stored in the outbox and a worker is started once
+        the transaction is committed
+        """
+        with self.captureOnCommitCallbacks(execute=True):
+            queue_email_messages(
+                [build_message('a@example.org')],
+                'test',
+            )
+            delay.assert_not_called()
+
+        delay.assert_called_once_with()
+        self.assertEqual(len(mail.outbox), 0)
+        outbox_email = OutboxEmail.objects.get()
+        self.assertEqual(outbox_email.status, OutboxEmail.STATUS_PENDING)
+        self.assertEqual(outbox_email.to, ['a@example.org'])
+        self.assertEqual(outbox_email.html_message, '<p>HTML message</p>')
+
+    def test_queue_email_messages_rollback(self):
+        """
+        Ensure emails of a rolled back transaction are never sent
+        """
+        with self.captureOnCommitCallbacks() as callbacks:
+            try:
+                with transaction.atomic():
+                    queue_email_messages(
+                        [build_message('a@example.org')],
+                        'test',
+                    )
+                    raise ValueError()
+            except ValueError:
+                pass
+
+        self.assertEqual(callbacks, [])
+        self.assertFalse(OutboxEmail.objects.exists())
+
+    def test_send_outbox_emails(self):
+        """
+        Ensure all emails due are sent by batches and logged
+        """
+        queue_email_messages(
+            [
+                build_message('a@example.org'),
+                build_message('b@example.org'),
+                build_message('c@example.org'),
+            ],
+            'test',
+        )
+        OutboxEmail.objects.create(
+            type_email='test',
+            subject='Later',
+            body='Later',
+            from_email='noreply@example.org',
+            to=['d@example.org'],
+            next_try_at=timezone.now() + timedelta(hours=1),
+        )
+
+        self.assertEqual(send_outbox_emails(), 3)
+
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(
+            mail.outbox[0].alternatives[0][0],
+            '<p>HTML message</p>',
+        )
+        self.assertEqual(
+            OutboxEmail.objects.filter(
+                status=OutboxEmail.STATUS_SENT,
+                sent_at__isnull=False,
+            ).count(),
+            3,
+        )
+        self.assertEqual(
+            EmailLog.objects.filter(type_email='test').count(),
+            3,
+        )
+        self.assertEqual(send_outbox_emails(), 0)
+
+    def test_send_outbox_emails_leased(self):
+        """
+        Ensure emails leased by another worker are not sent twice
+        """
+        outbox_email, = queue_email_messages(
+            [build_message('a@example.org')],
+            'test',
+        )
+        OutboxEmail.objects.filter(pk=outbox_email.pk).update(
+            locked_until=timezone.now() + timedelta(minutes=5),
+        )
+
+        self.assertEqual(send_outbox_emails(), 0)
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_send_outbox_emails_retry(self):
+        """
+        Ensure failed emails are retried later, then marked as failed
+        """
+        queue_email_messages(
+            [
+                build_message('a@example.org'),
+                build_message('b@example.org'),
+            ],
+            'test',
+        )
+        original_send = EmailMessage.send
+
+        def send(message, *args, **kwargs):
+            if 'b@example.org' in message.to:
+                raise Exception('Mail provider unavailable')
+            return original_send(message, *args, **kwargs)
+
+        with mock.patch.object(EmailMessage, 'send', send):
+            self.assertEqual(send_outbox_emails(), 1)
+
+        outbox_email = OutboxEmail.objects.get(to=['b@example.org'])
+        self.assertEqual(outbox_email.status, OutboxEmail.STATUS_PENDING)
+        self.assertEqual(outbox_email.tries, 1)
+        self.assertEqual(outbox_email.last_error, 'Mail provider unavailable')
+        self.assertIsNone(outbox_email.locked_until)
+        self.assertGreater(outbox_email.next_try_at, timezone.now())
+
+        OutboxEmail.objects.filter(pk=outbox_email.pk).update(
+            next_try_at=timezone.now(),
+        )
+        with mock.patch.object(EmailMessage, 'send', send):
+            self.assertEqual(send_outbox_emails(), 0)
+
+        outbox_email.refresh_from_db()
+        self.assertEqual(outbox_email.status, OutboxEmail.STATUS_FAILED)
+        self.assertEqual(outbox_email.tries, 2)
+        self.assertEqual(
+            Log.objects.filter(source='SENDING_BLUE_TEMPLATE').count(),
+            1,
+        )
+        self.assertEqual(len(mail.outbox), 1)
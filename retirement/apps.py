@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class RetirementConfig(AppConfig):
     name = 'retirement'
     verbose_name = 'retreat'
+
+    def ready(self):
+        # Register the signal receivers
+        from . import signals
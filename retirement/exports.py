@@ -1,11 +1,13 @@
 import csv
 import io
 import pytz
+import tempfile
 
 from celery import shared_task
+from collections import defaultdict
 from datetime import datetime
 
-from django.core.files.base import ContentFile
+from django.core.files.base import ContentFile, File
 from django.db.models import QuerySet, Sum
 from django.utils import timezone
 from django.conf import settings
@@ -58,112 +60,152 @@ def generate_retreat_sales(
     return new_export
 
 
-@shared_task()
-def generate_retreat_participation(
-        admin_id,
-        retreat_id
-):
+PARTICIPATION_HEADER = [
+    'Nom',
+    'Prénom',
+    'Email',
+    'Université actuelle',
+    'Niveau d\'étude actuel',
+    'Domaine d\'étude actuel',
+    "Date d'inscription",
+    'Restrictions personnelles',
+    'Ville',
+    'Téléphone',
+    'Genre',
+]
+
+ROOM_HEADER = [
+    'Option de chambre',
+    'Préférence de genre',
+    'Souhaite partager avec',
+    'Numéro de chambre',
+]
+
+
+def _generate_participation_rows(retreat):
     """
-    For given retreat, generate a csv file for user data.
-    If the retreat has room option, it will indicate the room distribution
-    and order users in consequence.
-    :params admin_id: id of admin doing the request
-    :params retreat_id: id of django retreat object
+    Yields the header and a row for each active participant of the retreat.
+    If the retreat has room option, rows are ordered by room and users
+    without room are added last.
+    Reservations, option quantities and room data are each loaded once for
+    the whole retreat.
     """
-    output_stream = io.StringIO()
-    writer = csv.writer(output_stream)
-    retreat = Retreat.objects.get(pk=retreat_id)
-    option_mapping = {}
-    room_export = retreat.has_room_option
-    rooms_data = {}
-    to_reorder_lines = []
-    no_room_lines = []
-    header = [
-        'Nom', 
-        'Prénom',
-        'Email', 
-        'Université actuelle',
-        'Niveau d\'étude actuel',
-        'Domaine d\'étude actuel',
-        "Date d'inscription",
-        'Restrictions personnelles',
-        'Ville', 
-        'Téléphone',
-        'Genre',
-    ]
+    reservations = list(
+        retreat.reservations.filter(is_active=True).select_related(
+            'user__university',
+            'user__academic_level',
+            'user__academic_field',
+            'order_line__order',
+        ).order_by('pk')
+    )
+
     options = retreat.options
-    for opt in options:
-        option_mapping[opt.id] = len(header)
-        room_header = [opt.name]
-        header += room_header
+    header = PARTICIPATION_HEADER + [opt.name for opt in options]
     room_index = len(header)
+    room_export = any(opt.is_room_option for opt in options)
+    rooms_data = {}
     if room_export:
-        room_header = [
-            'Option de chambre', 'Préférence de genre',
-            'Souhaite partager avec', 'Numéro de chambre'
-        ]
-        header += room_header
-        rooms_data = retreat.get_retreat_room_distribution()
-
-    writer.writerow(header)
+        header += ROOM_HEADER
+        rooms_data = retreat.get_retreat_room_distribution(reservations)
+
+    # Quantity of each option ordered with each orderline
+    quantities = defaultdict(int)
+    order_line_options = OrderLineBaseProduct.objects.filter(
+        order_line_id__in=[
+            reservation.order_line_id for reservation in reservations
+            if reservation.order_line_id is not None
+        ],
+        option_id__in=[opt.id for opt in options],
+    ).values_list('order_line_id', 'option_id', 'quantity')
+    for order_line_id, option_id, quantity in order_line_options:
+        quantities[order_line_id, option_id] += quantity
+
+    yield header
+
+    room_lines = []
+    no_room_lines = []
+    for reservation in reservations:
+        user = reservation.user
+        order_line = reservation.order_line
 
-    for reservation in retreat.reservations.filter(is_active=True):
         line_array = [None] * len(header)
-        line_array[0] = reservation.user.last_name
-        line_array[1] = reservation.user.first_name
-        line_array[2] = reservation.user.email
-        line_array[3] = reservation.user.university.name if reservation.user.university else ''
-        line_array[4] = reservation.user.academic_level.name if reservation.user.academic_level else ''
-        line_array[5] = reservation.user.academic_field.name if reservation.user.academic_field else ''
+        line_array[0] = user.last_name
+        line_array[1] = user.first_name
+        line_array[2] = user.email
+        line_array[3] = user.university.name if user.university else ''
+        line_array[4] = \
+            user.academic_level.name if user.academic_level else ''
+        line_array[5] = \
+            user.academic_field.name if user.academic_field else ''
         # Error using celery: celery tries to access something in membership
         # meaning the following line always raise AttributeError: 'NoneType'
         # object has no attribute 'name'
         # if reservation.user.membership:
         #     line_array[3] = reservation.user.membership.name
-        line_array[6] = reservation.order_line.order.transaction_date
-        line_array[7] = reservation.user.personnal_restrictions
-        line_array[8] = reservation.user.city
-        line_array[9] = reservation.user.phone
-        line_array[10] = reservation.user.gender
-
-        for opt in options:
-            try:
-                quantity = OrderLineBaseProduct.objects.get(
-                    order_line=reservation.order_line,
-                    option=opt
-                ).quantity
-            except OrderLineBaseProduct.DoesNotExist:
-                quantity = 0
-            line_array[option_mapping[opt.id]] = quantity
+        line_array[6] = order_line.order.transaction_date \
+            if order_line else ''
+        line_array[7] = user.personnal_restrictions
+        line_array[8] = user.city
+        line_array[9] = user.phone
+        line_array[10] = user.gender
+
+        for index, opt in enumerate(options):
+            line_array[len(PARTICIPATION_HEADER) + index] = \
+                quantities[reservation.order_line_id, opt.id]
 
         if room_export:
-            user_id = reservation.user.id
-            line_array[room_index] = rooms_data[user_id]['room_option']
-            line_array[room_index + 1] = rooms_data[
-                user_id]['gender_preference']
-            line_array[room_index + 2] = rooms_data[user_id]['share_with']
-            line_array[room_index + 3] = rooms_data[user_id]['room_number']
-            if line_array[room_index + 3] == 'NA':
-                no_room_lines.append(line_array)
+            room_data = rooms_data[user.id]
+            line_array[room_index] = room_data['room_option']
+            line_array[room_index + 1] = room_data['gender_preference']
+            line_array[room_index + 2] = room_data['share_with']
+            line_array[room_index + 3] = room_data['room_number']
+            if room_data['placed']:
+                room_lines.append(line_array)
             else:
-                to_reorder_lines.append(line_array)
+                no_room_lines.append(line_array)
         else:
-            writer.writerow(line_array)  # No ordering if no room
-    if room_export:
-        # We need to export in room order. User without data are added last
-        for ordered_data in sorted(to_reorder_lines, key=lambda x: x[11]):
-            writer.writerow(ordered_data)
-        for no_room_user_data in no_room_lines:
-            writer.writerow(no_room_user_data)
-    date_file = LOCAL_TIMEZONE.localize(datetime.now()) \
-        .strftime("%Y%m%d-%H%M%S")
-    filename = f'export-participation-{retreat.name}_{date_file}.csv'
-    new_export = ExportMedia.objects.create(
-        name=filename,
-        author_id=admin_id,
-        type=ExportMedia.EXPORT_RETREAT_PARTICIPATION
-    )
-    new_export.file.save(
-        filename,
-        ContentFile(output_stream.getvalue().encode()))
+            yield line_array  # No ordering if no room
+
+    # We need to export in room order. User without data are added last
+    yield from sorted(room_lines, key=lambda line: line[room_index + 3])
+    yield from no_room_lines
+
+
+@shared_task()
+def generate_retreat_participation(
+        admin_id,
+        retreat_id
+):
+    """
+    For given retreat, generate a csv file for user data.
+    If the retreat has room option, it will indicate the room distribution
+    and order users in consequence.
+    :params admin_id: id of admin doing the request
+    :params retreat_id: id of django retreat object
+    """
+    retreat = Retreat.objects.get(pk=retreat_id)
+
+    # The file is written on disk then streamed to the storage, instead of
+    # being built in memory.
+    with tempfile.TemporaryFile() as output_file:
+        output_stream = io.TextIOWrapper(
+            output_file,
+            encoding='utf-8',
+            newline='',
+        )
+        writer = csv.writer(output_stream)
+        writer.writerows(_generate_participation_rows(retreat))
+        output_stream.flush()
+        output_file.seek(0)
+
+        date_file = LOCAL_TIMEZONE.localize(datetime.now()) \
+            .strftime("%Y%m%d-%H%M%S")
+        filename = f'export-participation-{retreat.name}_{date_file}.csv'
+        new_export = ExportMedia.objects.create(
+            name=filename,
+            author_id=admin_id,
+            type=ExportMedia.EXPORT_RETREAT_PARTICIPATION
+        )
+        new_export.file.save(filename, File(output_file))
+        output_stream.detach()
     new_export.send_confirmation_email()
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.14 on 2026-10-17 05:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('retirement', '0075_alter_historicalpicture_options_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RetreatCapacity',
+            fields=[
+                ('retreat', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='capacity', serialize=False, to='retirement.retreat', verbose_name='Retreat')),
+                ('active_reservations', models.PositiveIntegerField(default=0, verbose_name='Active reservations')),
+                ('reserved_seats', models.PositiveIntegerField(default=0, verbose_name='Reserved seats')),
+                ('invitation_holds', models.IntegerField(default=0, verbose_name='Invitation holds')),
+            ],
+            options={
+                'verbose_name': 'Retreat capacity',
+                'verbose_name_plural': 'Retreat capacities',
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.14 on 2026-10-17 05:53
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('retirement', '0076_retreatcapacity'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='waitqueueplace',
+            name='next_notification_at',
+            field=models.DateTimeField(blank=True, default=django.utils.timezone.now, null=True, verbose_name='Next notification'),
+        ),
+        migrations.AddIndex(
+            model_name='waitqueueplace',
+            index=models.Index(condition=models.Q(('available', True)), fields=['next_notification_at'], name='wait_queue_place_due'),
+        ),
+    ]
@@ -7,38 +7,39 @@ from datetime import timedelta
 import requests
 from django.conf import settings
 from django.core.mail import mail_admins
-from django.core.mail import send_mail as django_send_mail
+from django.core.mail import EmailMultiAlternatives
 from django.template.loader import render_to_string
 from django.utils import timezone
 
 from rest_framework import serializers as rest_framework_serializers
 
-from blitz_api.services import send_mail as send_templated_email
+from blitz_api.services import (
+    invalidate_response_cache,
+    queue_email_messages,
+    send_mail as send_templated_email,
+)
 from blitz_api.cron_manager_api import CronManager
 from cron_manager.models import Task
 from blitz_api.models import Address
 from django.contrib.auth import get_user_model
 from django.db import models, transaction
+from django.db.models import F, Q, Sum
+from django.db.models.functions import Coalesce
 from django.utils.html import format_html
 from django.utils.translation import gettext_lazy as _
 from safedelete.models import SafeDeleteModel
 from simple_history.models import HistoricalRecords
 
-from log_management.models import (
-    Log,
-    EmailLog,
-)
 from store.models import (
     Membership,
     OrderLine,
     BaseProduct,
-    OrderLineBaseProduct,
-    OptionProduct,
     Coupon,
     Refund,
     CouponUser,
 )
 from store.services import refund_amount
+from retirement.room_distribution import get_retreat_room_distribution
 from store.exceptions import PaymentAPIError
 from store.services import PAYSAFE_EXCEPTION
 
@@ -227,7 +228,7 @@ class Retreat(Address, SafeDeleteModel, BaseProduct):
 
     @property
     def reserved_seats(self):
-        return self.wait_queue_places.filter(available=True).count()
+        return self.get_capacity().reserved_seats
 
     toilet_gendered = models.BooleanField(
         null=True,
@@ -501,42 +502,76 @@ class Retreat(Address, SafeDeleteModel, BaseProduct):
 
     @property
     def start_time(self):
-        dates = self.retreat_dates.all().order_by('start_time')
-        if dates.count():
-            return dates[0].start_time
-        else:
-            return None
+        # Use the annotation or the prefetched dates of list querysets
+        if 'min_start_date' in self.__dict__:
+            return self.min_start_date
+        if 'retreat_dates' in getattr(self, '_prefetched_objects_cache', {}):
+            return min(
+                (date.start_time for date in self.retreat_dates.all()),
+                default=None,
+            )
+
+        first_date = self.retreat_dates.order_by('start_time').first()
+        return first_date.start_time if first_date else None
 
     @property
     def end_time(self):
-        dates = self.retreat_dates.all().order_by('-end_time')
-        if dates.count():
-            return dates[0].end_time
-        else:
-            return None
+        # Use the annotation or the prefetched dates of list querysets
+        if 'max_end_date' in self.__dict__:
+            return self.max_end_date
+        if 'retreat_dates' in getattr(self, '_prefetched_objects_cache', {}):
+            return max(
+                (date.end_time for date in self.retreat_dates.all()),
+                default=None,
+            )
+
+        last_date = self.retreat_dates.order_by('-end_time').first()
+        return last_date.end_time if last_date else None
 
     @property
     def total_reservations(self):
-        return self.reservations.filter(is_active=True).count()
+        return self.get_capacity().active_reservations
 
     def free_places_for_reserve_invitations(self):
-        places_for_invitations = 0
-        for invitation in self.invitations.all():
-            if invitation.reserve_seat:
-                places_for_invitations += invitation.nb_places_free()
+        return self.get_capacity().invitation_holds
+
+    def get_capacity(self, lock=False):
+        """
+        Returns the RetreatCapacity of the retreat, it is created on first
+        use. When locked, the capacity can't be read with a lock by another
+        transaction until the end of the current one, so reservations of the
+        retreat are made one after the other.
+        """
+        # Use the capacity selected with the retreat on read paths
+        if not lock and Retreat.capacity.is_cached(self):
+            capacity = Retreat.capacity.related.get_cached_value(self)
+            if capacity is not None:
+                return capacity
+
+        capacities = RetreatCapacity.objects.filter(retreat_id=self.pk)
+        if lock:
+            capacities = capacities.select_for_update()
+        capacity = capacities.first()
 
-        return places_for_invitations
+        if capacity is None:
+            RetreatCapacity.objects.get_or_create(retreat_id=self.pk)
+            RetreatCapacity.refresh(self.pk)
+            capacity = capacities.get()
+
+        return capacity
 
     @property
     def places_remaining(self):
+        capacity = self.get_capacity()
+
         # Nb places available without invitations
         seat_remaining = \
-            self.seats - self.total_reservations - self.reserved_seats
+            self.seats - capacity.active_reservations - capacity.reserved_seats
 
         # We remove the free places of invitation to "block" those places
         # Because we already count all invitation we remove only
         # free places and not all places reserved for invitatioons
-        seat_remaining -= self.free_places_for_reserve_invitations()
+        seat_remaining -= capacity.invitation_holds
 
         return seat_remaining if seat_remaining > 0 else 0
 
@@ -568,6 +603,8 @@ class Retreat(Address, SafeDeleteModel, BaseProduct):
         
         list_of_users_notified = []
         for wait_queue_place in wait_queue_places:
+            # Share the retreat to not fetch it again for each place
+            wait_queue_place.retreat = self
             detail, stop = wait_queue_place.notify(force_notify_all=True, bypass_delay=True)
             
             list_of_users_notified.append(detail)
@@ -624,16 +661,18 @@ class Retreat(Address, SafeDeleteModel, BaseProduct):
                     traceback.format_exc()
                 )
 
-    def notify_reserved_seat(self, user):
+    def notify_reserved_seat(self, user, wait_queue=None):
         """
         This function sends an email to notify a
         user that he has a reserved seat
         to a retreat for 24h hours.
+        The WaitQueue of the user can be given if it is already loaded.
         """
-        wait_queue: WaitQueue = WaitQueue.objects.get(
-            user=user,
-            retreat=self,
-        )
+        if wait_queue is None:
+            wait_queue: WaitQueue = WaitQueue.objects.get(
+                user=user,
+                retreat=self,
+            )
 
         # Setup the url for the activation button in the email
         wait_queue_url = settings.LOCAL_SETTINGS[
@@ -697,6 +736,9 @@ class Retreat(Address, SafeDeleteModel, BaseProduct):
                 user_place_reserved.save()
 
     def can_order_the_retreat(self, user, invitation=None):
+        # Concurrent orders of the retreat wait until this one has created
+        # its reservation, so they can't take the same last place.
+        self.get_capacity(lock=True)
         has_remaining_place = self.has_places_remaining(invitation)
 
         wait_queue_place = self.get_wait_queue_place_reserved(user)
@@ -724,8 +766,10 @@ class Retreat(Address, SafeDeleteModel, BaseProduct):
 
             if execution_date:
                 try:
-                    task_url = cron_manager.get_retreat_target_url(self, email)
-                    task = Task.objects.get(url=task_url, active=True)
+                    task = cron_manager.get_email_tasks(
+                        self,
+                        email,
+                    ).get(active=True)
                     real_task_time = execution_date + timedelta(
                         minutes=email.minutes_delta)
                     if task.execution_datetime == real_task_time:
@@ -783,248 +827,16 @@ class Retreat(Address, SafeDeleteModel, BaseProduct):
             self.is_active = True
             self.save()
 
-    @staticmethod
-    def _set_participant_room(participant_data, room_number):
-        participant_data['room_number'] = room_number
-        participant_data['placed'] = True
-        return participant_data
-
-    def get_retreat_room_distribution(self):
+    def get_retreat_room_distribution(self, reservations=None):
         """
         Generate room distribution for a retreat, matching people with their
         friends or their preferred gender.
         Return a dict of dict with data and room number for each participant
         with participant id as key
+        :params reservations: active reservations already loaded with their
+        user
         """
-        active_reservations = self.reservations.filter(is_active=True)
-        room_pool = {}
-        single_pool = {}
-        friend_pool = {}
-        mixed_pool = {}
-
-        current_man_room = None
-        current_woman_room = None
-        current_non_binary_room = None
-        current_mixed_room = None
-
-        retreat_room_distribution = {}
-        room_number = 0
-
-        for reservation in active_reservations:
-            participant_data = {
-                'id': reservation.user.id,
-                'first_name': reservation.user.first_name,
-                'last_name': reservation.user.last_name,
-                'email': reservation.user.email,
-                'room_option': 'single',
-                'gender_preference': 'NA',
-                'share_with': 'NA',
-                'room_number': 0,
-                'placed': False
-            }
-            room_options = OptionProduct.objects.filter(is_room_option=True)
-            try:
-                participant_order_detail = OrderLineBaseProduct.objects.get(
-                    order_line=reservation.order_line,
-                    option__in=room_options
-                )
-            except OrderLineBaseProduct.DoesNotExist:
-                # User has no options for the retreat
-                participant_data['room_option'] = 'NA'
-                participant_data['room_number'] = 'NA'
-                retreat_room_distribution[reservation.user.id] = \
-                    participant_data
-                continue
-            current_option = OptionProduct.objects.get(
-                id=participant_order_detail.option_id,
-            )
-            if current_option.type == OptionProduct.METADATA_SHARED_ROOM:
-                participant_data['gender_preference'] = \
-                    participant_order_detail.metadata[
-                        'share_with_preferred_gender'
-                    ]
-                participant_data['room_option'] = 'shared'
-                if participant_order_detail.metadata['share_with_member']:
-                    participant_data['share_with'] = \
-                        participant_order_detail.metadata['share_with_member']
-                    friend_pool[reservation.user.email] = participant_data
-                    continue
-                elif participant_data['gender_preference'] == 'mixte':
-                    mixed_pool[reservation.user.email] = participant_data
-                    continue
-                room_pool[reservation.user.email] = participant_data
-            else:
-                single_pool[reservation.user.email] = participant_data
-
-        # Handling single pool
-        for key, value in single_pool.items():
-            if not value['placed']:
-                room_number += 1
-                retreat_room_distribution[value['id']] = \
-                    self._set_participant_room(value, room_number)
-
-        # Handling friend pool
-        for key, value in friend_pool.items():
-            if not value['placed']:
-                is_in_friend_pool = value['share_with'] in friend_pool
-                if is_in_friend_pool and value['share_with'] != key:
-                    if friend_pool[value['share_with']]['share_with'] == key:
-                        room_number += 1
-                        retreat_room_distribution[value['id']] = \
-                            self._set_participant_room(value, room_number)
-                        roommate_id = friend_pool[value['share_with']]['id']
-                        retreat_room_distribution[roommate_id] = \
-                            self._set_participant_room(
-                                friend_pool[value['share_with']],
-                                room_number)
-                        continue
-                # Pairing not found, putting in other pool
-                if value['gender_preference'] == 'mixte':
-                    mixed_pool[key] = value
-                else:
-                    room_pool[key] = value
-
-        # Handling main pool
-        for key, value in room_pool.items():
-            if not value['placed']:
-                if value['gender_preference'] == 'man':
-                    if current_man_room:
-                        room_number += 1
-                        retreat_room_distribution[value['id']] = \
-                            self._set_participant_room(value, room_number)
-                        roommate_id = room_pool[current_man_room]['id']
-                        retreat_room_distribution[roommate_id] = \
-                            self._set_participant_room(
-                                room_pool[current_man_room],
-                                room_number)
-                        current_man_room = None
-                    else:
-                        current_man_room = key
-                elif value['gender_preference'] == 'woman':
-                    if current_woman_room:
-                        room_number += 1
-                        retreat_room_distribution[value['id']] = \
-                            self._set_participant_room(value, room_number)
-                        roommate_id = room_pool[current_woman_room]['id']
-                        retreat_room_distribution[roommate_id] = \
-                            self._set_participant_room(
-                                room_pool[current_woman_room],
-                                room_number)
-                        current_woman_room = None
-                    else:
-                        current_woman_room = key
-                elif value['gender_preference'] == 'non-binary':
-                    if current_non_binary_room:
-                        room_number += 1
-                        retreat_room_distribution[value['id']] = \
-                            self._set_participant_room(value, room_number)
-                        roommate_id = room_pool[current_non_binary_room]['id']
-                        retreat_room_distribution[roommate_id] = \
-                            self._set_participant_room(
-                                room_pool[current_non_binary_room],
-                                room_number)
-                        current_non_binary_room = None
-                    else:
-                        current_non_binary_room = key
-
-        # Handling shared rooms for mixte
-        for key, value in mixed_pool.items():
-            # fill the rooms or create mixte room
-            if current_man_room:
-                room_number += 1
-                retreat_room_distribution[value['id']] = \
-                    self._set_participant_room(value, room_number)
-                roommate_id = room_pool[current_man_room]['id']
-                retreat_room_distribution[roommate_id] = \
-                    self._set_participant_room(
-                        room_pool[current_man_room],
-                        room_number)
-                current_man_room = None
-            elif current_woman_room:
-                room_number += 1
-                retreat_room_distribution[value['id']] = \
-                    self._set_participant_room(value, room_number)
-                roommate_id = room_pool[current_woman_room]['id']
-                retreat_room_distribution[roommate_id] = \
-                    self._set_participant_room(
-                        room_pool[current_woman_room],
-                        room_number)
-                current_woman_room = None
-            elif current_non_binary_room:
-                room_number += 1
-                retreat_room_distribution[value['id']] = \
-                    self._set_participant_room(value, room_number)
-                roommate_id = room_pool[current_non_binary_room]['id']
-                retreat_room_distribution[roommate_id] = \
-                    self._set_participant_room(
-                        room_pool[current_non_binary_room],
-                        room_number)
-                current_non_binary_room = None
-            elif current_mixed_room:
-                room_number += 1
-                retreat_room_distribution[value['id']] = \
-                    self._set_participant_room(value, room_number)
-                roommate_id = mixed_pool[current_mixed_room]['id']
-                retreat_room_distribution[roommate_id] = \
-                    self._set_participant_room(
-                        mixed_pool[current_mixed_room],
-                        room_number)
-                current_mixed_room = None
-            else:
-                current_mixed_room = key
-
-        # Handling unpaired participants
-        if current_mixed_room:
-            room_number += 1
-            roommate_id = mixed_pool[current_mixed_room]['id']
-            retreat_room_distribution[roommate_id] = \
-                self._set_participant_room(
-                    mixed_pool[current_mixed_room],
-                    room_number)
-        else:
-            if current_man_room and \
-                    current_woman_room and \
-                    current_non_binary_room:
-                room_number += 1
-                roommate_id = room_pool[current_man_room]['id']
-                retreat_room_distribution[roommate_id] = \
-                    self._set_participant_room(
-                        room_pool[current_man_room],
-                        room_number)
-                roommate_id = room_pool[current_woman_room]['id']
-                retreat_room_distribution[roommate_id] = \
-                    self._set_participant_room(
-                        room_pool[current_woman_room],
-                        room_number)
-                room_number += 1
-                roommate_id = room_pool[current_non_binary_room]['id']
-                retreat_room_distribution[roommate_id] = \
-                    self._set_participant_room(
-                        room_pool[current_non_binary_room],
-                        room_number)
-            elif current_man_room or \
-                    current_woman_room or \
-                    current_non_binary_room:
-                room_number += 1
-                if current_man_room:
-                    roommate_id = room_pool[current_man_room]['id']
-                    retreat_room_distribution[roommate_id] = \
-                        self._set_participant_room(
-                            room_pool[current_man_room],
-                            room_number)
-                if current_woman_room:
-                    roommate_id = room_pool[current_woman_room]['id']
-                    retreat_room_distribution[roommate_id] = \
-                        self._set_participant_room(
-                            room_pool[current_woman_room],
-                            room_number)
-                if current_non_binary_room:
-                    roommate_id = room_pool[current_non_binary_room]['id']
-                    retreat_room_distribution[roommate_id] = \
-                        self._set_participant_room(
-                            room_pool[current_non_binary_room],
-                            room_number)
-        return retreat_room_distribution
+        return get_retreat_room_distribution(self, reservations)
 
     def get_participants_emails(self):
         """
@@ -1071,22 +883,17 @@ class Retreat(Address, SafeDeleteModel, BaseProduct):
         :params refund_policy: Admin policy to apply to refund participants
         """
         active_reservations = self.reservations.filter(is_active=True)
-        refund_data = []
 
-        # Process the refund and gather data to be sent by email
+        # Process the refunds, the emails of participants having a refund are
+        # sent from the outbox once they are committed
         with transaction.atomic():
             for reservation in active_reservations:
-                refund_data.append(
-                    reservation.process_refund(
-                        Reservation.CANCELATION_REASON_RETREAT_DELETED,
-                        refund_policy)
+                refund_data = reservation.process_refund(
+                    Reservation.CANCELATION_REASON_RETREAT_DELETED,
+                    refund_policy,
                 )
-
-        # Send emails to each participant having a refund
-        with transaction.atomic():
-            for data in refund_data:
-                if data:
-                    Reservation.send_refund_confirmation_email(data)
+                if refund_data:
+                    Reservation.send_refund_confirmation_email(refund_data)
 
     def custom_delete(self, deletion_message=None, refund_policy=None):
         """
@@ -1382,30 +1189,15 @@ class Reservation(SafeDeleteModel):
         plain_msg = render_to_string("refund.txt", merge_data)
         msg_html = render_to_string("refund.html", merge_data)
 
-        try:
-            response_send_mail = django_send_mail(
-                "Confirmation de remboursement",
-                plain_msg,
-                settings.DEFAULT_FROM_EMAIL,
-                [user.email],
-                html_message=msg_html,
-            )
-
-            EmailLog.add(user.email, 'refund', response_send_mail)
-        except Exception as err:
-            additional_data = {
-                'title': "Confirmation de remboursement",
-                'default_from': settings.DEFAULT_FROM_EMAIL,
-                'user_email': user.email,
-                'merge_data': merge_data,
-                'template': 'refund.html'
-            }
-            Log.error(
-                source='SENDING_BLUE_TEMPLATE',
-                message=err,
-                additional_data=json.dumps(additional_data)
-            )
-            raise
+        # Sent from the outbox once the refund is committed
+        message = EmailMultiAlternatives(
+            "Confirmation de remboursement",
+            plain_msg,
+            settings.DEFAULT_FROM_EMAIL,
+            [user.email],
+        )
+        message.attach_alternative(msg_html, 'text/html')
+        queue_email_messages([message], 'refund')
 
     def process_refund(self, cancel_reason, refund_policy):
         """
@@ -1495,6 +1287,10 @@ class Reservation(SafeDeleteModel):
                         )
                         coupon_user.uses = coupon_user.uses - 1
                         coupon_user.save()
+                        Coupon.objects.filter(
+                            pk=order_line.coupon_id,
+                            total_uses__gt=0,
+                        ).update(total_uses=F('total_uses') - 1)
 
                 # Create WaitQueuePlace unless retreat is deleted
                 if cancel_reason != self.CANCELATION_REASON_RETREAT_DELETED:
@@ -1692,6 +1488,18 @@ class RetreatInvitation(SafeDeleteModel):
 
 
 class WaitQueuePlace(models.Model):
+    # Delay between the notifications of a wait queue place
+    NOTIFICATION_DELAY = timedelta(hours=23, minutes=55)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['next_notification_at'],
+                condition=Q(available=True),
+                name='wait_queue_place_due',
+            ),
+        ]
+
     retreat = models.ForeignKey(
         Retreat,
         on_delete=models.CASCADE,
@@ -1714,9 +1522,28 @@ class WaitQueuePlace(models.Model):
         default=True
     )
 
+    # Date from which the wait queue can be notified again, None while
+    # there is nobody to notify. See retirement.tasks.notify_wait_queue_place
+    next_notification_at = models.DateTimeField(
+        verbose_name=_("Next notification"),
+        null=True,
+        blank=True,
+        default=timezone.now,
+    )
+
     def __str__(self):
         return f'{self.retreat} {self.pk}'
 
+    def schedule_notification(self, next_notification_at):
+        """
+        Set the date of the next notification of the place. It is updated
+        without saving the place so its retreat isn't refreshed.
+        """
+        WaitQueuePlace.objects.filter(pk=self.pk).update(
+            next_notification_at=next_notification_at,
+        )
+        self.next_notification_at = next_notification_at
+
     def get_user_without_places_reserved(self):
         wait_queue_places_reserved_ids = \
             self.wait_queue_places_reserved.filter(
@@ -1733,55 +1560,168 @@ class WaitQueuePlace(models.Model):
 
         # Stop the notification process if place not available
         if not self.available:
+            self.schedule_notification(None)
             return 'Wait queue place not available', True
 
         # Stop the notification process if retreat already started
         stop = timezone.now() >= self.retreat.start_time
         if stop:
+            self.schedule_notification(None)
             return 'Retreat already started', stop
 
         # Stop the notification process if we are in the delay between notifications and the notification is not forced
         if not bypass_delay:
-            time_limit = timezone.now() - timedelta(hours=23, minutes=55)
-            already_done_in_delay = self.wait_queue_places_reserved.filter(create__gt=time_limit).exists()
+            time_limit = timezone.now() - self.NOTIFICATION_DELAY
+            last_reserved_in_delay = self.wait_queue_places_reserved.filter(
+                create__gt=time_limit,
+            ).order_by('-create').values_list('create', flat=True).first()
             
-            if already_done_in_delay:
+            if last_reserved_in_delay:
+                self.schedule_notification(
+                    last_reserved_in_delay + self.NOTIFICATION_DELAY)
                 # No users notified, do not stop retry
                 return [], False
 
         # Notification logic start here
+        from retirement.tasks import notify_wait_queue_places_reserved
+
         users_notified = []
 
         # Get all user that have no wait_queue_places_reserved
         # for this WaitQueuePlace
-        retreat_wait_queues = self.get_user_without_places_reserved()
+        retreat_wait_queues = self.get_user_without_places_reserved() \
+            .select_related('user')
 
         # if we are after the refund delay, we notify every waiting user
         less_than_min_day_refund = \
             timezone.now() >= self.retreat.get_datetime_refund()
 
-        for wait_queue in retreat_wait_queues:
-            # check if the user is already notified for this retreat
-            user_already_notified = WaitQueuePlaceReserved.objects.filter(
-                user=wait_queue.user,
+        # Users already notified for this retreat are not notified again
+        already_notified_user_ids = set(
+            WaitQueuePlaceReserved.objects.filter(
                 notified__isnull=False,
                 used=None,
                 wait_queue_place__available=True,
-                wait_queue_place__retreat=self.retreat
-            ).exists()
+                wait_queue_place__retreat_id=self.retreat_id,
+            ).values_list('user_id', flat=True)
+        )
 
-            wait_queue_reserved = WaitQueuePlaceReserved.objects.create(
-                wait_queue_place=self,
-                user=wait_queue.user
+        places_reserved = []
+        for wait_queue in retreat_wait_queues:
+            user_already_notified = \
+                wait_queue.user_id in already_notified_user_ids
+
+            places_reserved.append(
+                WaitQueuePlaceReserved(
+                    wait_queue_place=self,
+                    user=wait_queue.user,
+                    notified=None if user_already_notified else
+                    timezone.now(),
+                )
             )
             if not user_already_notified:
-                users_notified.append(wait_queue_reserved.notify())
+                already_notified_user_ids.add(wait_queue.user_id)
+                users_notified.append(wait_queue.user.email)
                 if not less_than_min_day_refund and not force_notify_all:
                     break
 
+        places_reserved = WaitQueuePlaceReserved.objects.bulk_create(
+            places_reserved,
+        )
+
+        # The emails are sent by Celery tasks
+        notify_wait_queue_places_reserved([
+            place_reserved.id for place_reserved in places_reserved
+            if place_reserved.notified
+        ])
+
+        # Wait for the delay before notifying the next user, or for a new
+        # user in the wait queue if everybody has been notified.
+        if users_notified:
+            last_reserved = max(
+                place_reserved.create for place_reserved in places_reserved
+            )
+            self.schedule_notification(
+                last_reserved + self.NOTIFICATION_DELAY)
+        else:
+            self.schedule_notification(None)
+
         return users_notified, False
 
 
+class RetreatCapacity(models.Model):
+    """
+    Counters used to compute the places remaining in a retreat. They are
+    refreshed each time a reservation, an invitation or a wait queue place of
+    the retreat is saved or deleted, see retirement.signals.
+    """
+
+    class Meta:
+        verbose_name = _("Retreat capacity")
+        verbose_name_plural = _("Retreat capacities")
+
+    retreat = models.OneToOneField(
+        Retreat,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        verbose_name=_("Retreat"),
+        related_name='capacity',
+    )
+
+    active_reservations = models.PositiveIntegerField(
+        verbose_name=_("Active reservations"),
+        default=0,
+    )
+
+    # Wait queue places still available
+    reserved_seats = models.PositiveIntegerField(
+        verbose_name=_("Reserved seats"),
+        default=0,
+    )
+
+    # Places of invitations reserving seats that are not used yet. It can be
+    # negative if invitations are used more than their number of places.
+    invitation_holds = models.IntegerField(
+        verbose_name=_("Invitation holds"),
+        default=0,
+    )
+
+    def __str__(self):
+        return str(self.retreat_id)
+
+    @classmethod
+    def refresh(cls, retreat_id):
+        """
+        Counts again the places used in the retreat. The capacity is only
+        updated if it exists, it is created by Retreat.get_capacity.
+        """
+        invitations = RetreatInvitation.objects.filter(
+            retreat_id=retreat_id,
+            reserve_seat=True,
+        )
+        nb_invitation_places = invitations.aggregate(
+            total=Coalesce(Sum('nb_places'), 0),
+        )['total']
+        nb_invitation_places_used = Reservation.objects.filter(
+            invitation__in=invitations,
+            is_active=True,
+        ).count()
+
+        cls.objects.filter(retreat_id=retreat_id).update(
+            active_reservations=Reservation.objects.filter(
+                retreat_id=retreat_id,
+                is_active=True,
+            ).count(),
+            reserved_seats=WaitQueuePlace.objects.filter(
+                retreat_id=retreat_id,
+                available=True,
+            ).count(),
+            invitation_holds=nb_invitation_places - nb_invitation_places_used,
+        )
+        # The remaining places of the retreat are part of the cached catalog
+        invalidate_response_cache('retreat')
+
+
 class WaitQueuePlaceReserved(models.Model):
     user = models.ForeignKey(
         User,
@@ -0,0 +1,385 @@
+"""
+Room distribution of the participants of a retreat.
+
+Participants are loaded in a constant number of queries, then roommates are
+paired by solving a maximum matching on a compatibility graph:
+
+- mutual friend requests are always paired together;
+- the other participants of shared rooms are compatible when they have the
+  same gender preference or when one of them accepts a mixed room.
+
+The matching is seeded with a greedy pairing following the order in which
+participants reserved, then completed with augmenting paths (Edmonds'
+blossom algorithm) so no compatible pair is left unmatched.
+"""
+from collections import deque
+
+from store.models import OptionProduct, OrderLineBaseProduct
+
+ROOM_OPTION_SINGLE = 'single'
+ROOM_OPTION_SHARED = 'shared'
+NOT_APPLICABLE = 'NA'
+
+GENDER_PREFERENCE_MIXED = 'mixte'
+# Order in which leftover participants of each preference are handled
+GENDER_PREFERENCES = ['man', 'woman', 'non-binary']
+
+
+def get_retreat_room_distribution(retreat, reservations=None):
+    """
+    Generate room distribution for a retreat, matching people with their
+    friends or their preferred gender.
+    Return a dict of dict with data and room number for each participant
+    with participant id as key
+    """
+    return distribute_rooms(load_participants(retreat, reservations))
+
+
+def load_participants(retreat, reservations=None):
+    """
+    Return the room data of the active participants of a retreat, in the
+    order they reserved, using three queries.
+    Active reservations already loaded with their user can be given to save
+    a query.
+    """
+    if reservations is None:
+        reservations = list(
+            retreat.reservations.filter(is_active=True).order_by('pk').values(
+                'order_line_id',
+                'user_id',
+                'user__first_name',
+                'user__last_name',
+                'user__email',
+            )
+        )
+    else:
+        reservations = [
+            {
+                'order_line_id': reservation.order_line_id,
+                'user_id': reservation.user_id,
+                'user__first_name': reservation.user.first_name,
+                'user__last_name': reservation.user.last_name,
+                'user__email': reservation.user.email,
+            }
+            for reservation in reservations
+        ]
+    room_option_types = dict(
+        OptionProduct.objects.filter(
+            is_room_option=True,
+        ).values_list('id', 'type')
+    )
+    order_line_ids = {
+        reservation['order_line_id'] for reservation in reservations
+        if reservation['order_line_id'] is not None
+    }
+    room_options = {}
+    order_line_options = OrderLineBaseProduct.objects.filter(
+        order_line_id__in=order_line_ids,
+        option_id__in=room_option_types.keys(),
+    ).order_by('pk').values_list('order_line_id', 'option_id', 'metadata')
+    for order_line_id, option_id, metadata in order_line_options:
+        room_options.setdefault(order_line_id, (option_id, metadata))
+
+    participants = []
+    for reservation in reservations:
+        participant_data = {
+            'id': reservation['user_id'],
+            'first_name': reservation['user__first_name'],
+            'last_name': reservation['user__last_name'],
+            'email': reservation['user__email'],
+            'room_option': ROOM_OPTION_SINGLE,
+            'gender_preference': NOT_APPLICABLE,
+            'share_with': NOT_APPLICABLE,
+            'room_number': 0,
+            'placed': False
+        }
+        room_option = room_options.get(reservation['order_line_id'])
+        if room_option is None:
+            # User has no options for the retreat
+            participant_data['room_option'] = NOT_APPLICABLE
+            participant_data['room_number'] = NOT_APPLICABLE
+        else:
+            option_id, metadata = room_option
+            option_type = room_option_types[option_id]
+            if option_type == OptionProduct.METADATA_SHARED_ROOM:
+                metadata = metadata or {}
+                participant_data['room_option'] = ROOM_OPTION_SHARED
+                participant_data['gender_preference'] = metadata.get(
+                    'share_with_preferred_gender',
+                    NOT_APPLICABLE,
+                )
+                if metadata.get('share_with_member'):
+                    participant_data['share_with'] = \
+                        metadata['share_with_member']
+        participants.append(participant_data)
+
+    return participants
+
+
+def distribute_rooms(participants):
+    """
+    Assign a room number to participants given in the order they reserved.
+    Single rooms are numbered first, then the rooms of mutual friends, then
+    the other shared rooms.
+    Return a dict of dict with data and room number for each participant
+    with participant id as key
+    """
+    retreat_room_distribution = {}
+    room_number = 0
+
+    singles = []
+    shared = []
+    for participant in participants:
+        retreat_room_distribution[participant['id']] = participant
+        if participant['room_option'] == ROOM_OPTION_SINGLE:
+            singles.append(participant)
+        elif participant['room_option'] == ROOM_OPTION_SHARED:
+            shared.append(participant)
+
+    for participant in singles:
+        room_number += 1
+        _set_participant_room(participant, room_number)
+
+    friends_by_email = {}
+    for participant in shared:
+        if participant['share_with'] != NOT_APPLICABLE:
+            friends_by_email[_normalize_email(participant['email'])] = \
+                participant
+
+    # Mutual friend requests are paired before anything else
+    unpaired_friends = []
+    for participant in friends_by_email.values():
+        if participant['placed']:
+            continue
+        email = _normalize_email(participant['email'])
+        friend = friends_by_email.get(
+            _normalize_email(participant['share_with'])
+        )
+        is_mutual = friend is not None and friend is not participant and \
+            _normalize_email(friend['share_with']) == email
+        if is_mutual:
+            room_number += 1
+            _set_participant_room(participant, room_number)
+            _set_participant_room(friend, room_number)
+        else:
+            unpaired_friends.append(participant)
+
+    # Participants whose friend request failed come after the others
+    pool = [
+        participant for participant in shared
+        if participant['share_with'] == NOT_APPLICABLE
+    ] + unpaired_friends
+    pool = [
+        participant for participant in pool
+        if participant['gender_preference'] != GENDER_PREFERENCE_MIXED
+    ] + [
+        participant for participant in pool
+        if participant['gender_preference'] == GENDER_PREFERENCE_MIXED
+    ]
+
+    neighbours = [
+        [
+            index for index, other in enumerate(pool)
+            if other is not participant and _are_compatible(
+                participant,
+                other,
+            )
+        ]
+        for participant in pool
+    ]
+    seed_pairs = _greedy_pairs(pool)
+    matching = [None] * len(pool)
+    for first, second in seed_pairs:
+        matching[first] = second
+        matching[second] = first
+    matching = maximum_matching(neighbours, matching)
+
+    # Rooms found by the greedy pairing keep their order, rooms created by
+    # augmenting paths follow
+    pairs = [
+        (first, second) for first, second in seed_pairs
+        if matching[first] == second
+    ]
+    paired = {index for pair in pairs for index in pair}
+    for index, mate in enumerate(matching):
+        if mate is not None and index not in paired:
+            pairs.append((index, mate))
+            paired.update((index, mate))
+
+    for pair in pairs:
+        room_number += 1
+        for index in pair:
+            _set_participant_room(pool[index], room_number)
+
+    # Leftovers can't be paired with anybody left, they share rooms two by
+    # two so that nobody is left without a room.
+    leftovers = sorted(
+        (index for index, mate in enumerate(matching) if mate is None),
+        key=lambda index: _preference_rank(pool[index]),
+    )
+    for position, index in enumerate(leftovers):
+        if position % 2 == 0:
+            room_number += 1
+        _set_participant_room(pool[index], room_number)
+
+    return retreat_room_distribution
+
+
+def maximum_matching(neighbours, matching=None):
+    """
+    Return a maximum matching of a general graph given as adjacency lists,
+    as a list holding the index of the mate of each vertex (None when
+    unmatched).
+    An initial matching can be given; matched vertices stay matched.
+    """
+    if matching is None:
+        matching = [None] * len(neighbours)
+    matching = list(matching)
+    for root in range(len(neighbours)):
+        if matching[root] is None:
+            _BlossomSearch(neighbours, matching).augment_from(root)
+    return matching
+
+
+class _BlossomSearch:
+    """
+    Search of an augmenting path from a single root with Edmonds' blossom
+    algorithm.
+    """
+
+    def __init__(self, neighbours, matching):
+        self.neighbours = neighbours
+        self.matching = matching
+        size = len(neighbours)
+        self.parent = [None] * size
+        self.base = list(range(size))
+        self.used = [False] * size
+
+    def augment_from(self, root):
+        path_end = self._find_augmenting_path(root)
+        while path_end is not None:
+            parent = self.parent[path_end]
+            next_end = self.matching[parent]
+            self.matching[path_end] = parent
+            self.matching[parent] = path_end
+            path_end = next_end
+
+    def _find_augmenting_path(self, root):
+        self.used[root] = True
+        queue = deque([root])
+        while queue:
+            vertex = queue.popleft()
+            for neighbour in self.neighbours[vertex]:
+                if self.base[vertex] == self.base[neighbour] or \
+                        self.matching[vertex] == neighbour:
+                    continue
+                mate = self.matching[neighbour]
+                if neighbour == root or \
+                        (mate is not None and self.parent[mate] is not None):
+                    self._contract_blossom(vertex, neighbour, queue)
+                elif self.parent[neighbour] is None:
+                    self.parent[neighbour] = vertex
+                    if mate is None:
+                        return neighbour
+                    self.used[mate] = True
+                    queue.append(mate)
+        return None
+
+    def _contract_blossom(self, vertex, neighbour, queue):
+        common_base = self._lowest_common_ancestor(vertex, neighbour)
+        in_blossom = [False] * len(self.neighbours)
+        self._mark_path(vertex, common_base, neighbour, in_blossom)
+        self._mark_path(neighbour, common_base, vertex, in_blossom)
+        for index in range(len(self.neighbours)):
+            if in_blossom[self.base[index]]:
+                self.base[index] = common_base
+                if not self.used[index]:
+                    self.used[index] = True
+                    queue.append(index)
+
+    def _lowest_common_ancestor(self, first, second):
+        seen = [False] * len(self.neighbours)
+        while True:
+            first = self.base[first]
+            seen[first] = True
+            if self.matching[first] is None:
+                break
+            first = self.parent[self.matching[first]]
+        while True:
+            second = self.base[second]
+            if seen[second]:
+                return second
+            second = self.parent[self.matching[second]]
+
+    def _mark_path(self, vertex, common_base, child, in_blossom):
+        while self.base[vertex] != common_base:
+            mate = self.matching[vertex]
+            in_blossom[self.base[vertex]] = True
+            in_blossom[self.base[mate]] = True
+            self.parent[vertex] = child
+            child = mate
+            vertex = self.parent[mate]
+
+
+def _greedy_pairs(pool):
+    """
+    Pair participants of the same preference in the order they reserved,
+    then pair participants accepting a mixed room with the remaining ones.
+    Return the list of pairs of indexes in the order they were formed.
+    """
+    pairs = []
+    waiting = {}
+    for index, participant in enumerate(pool):
+        preference = participant['gender_preference']
+        if preference == GENDER_PREFERENCE_MIXED:
+            waiting_preference = next(
+                (
+                    candidate for candidate in _ordered_preferences(waiting)
+                    if waiting[candidate] is not None
+                ),
+                None,
+            )
+        else:
+            waiting_preference = preference
+        if waiting.get(waiting_preference) is not None:
+            pairs.append((waiting[waiting_preference], index))
+            waiting[waiting_preference] = None
+        else:
+            waiting[preference] = index
+    return pairs
+
+
+def _ordered_preferences(preferences):
+    return sorted(
+        preferences,
+        key=lambda preference: _preference_rank(
+            {'gender_preference': preference}
+        ),
+    )
+
+
+def _preference_rank(participant):
+    preference = participant['gender_preference']
+    if preference in GENDER_PREFERENCES:
+        return GENDER_PREFERENCES.index(preference)
+    if preference == GENDER_PREFERENCE_MIXED:
+        return len(GENDER_PREFERENCES) + 1
+    return len(GENDER_PREFERENCES)
+
+
+def _are_compatible(participant, other):
+    preferences = {
+        participant['gender_preference'],
+        other['gender_preference'],
+    }
+    return len(preferences) == 1 or GENDER_PREFERENCE_MIXED in preferences
+
+
+def _normalize_email(email):
+    return email.strip().lower()
+
+
+def _set_participant_room(participant_data, room_number):
+    participant_data['room_number'] = room_number
+    participant_data['placed'] = True
+    return participant_data
@@ -6,7 +6,7 @@ from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.models import ContentType
 from django.core.mail import send_mail
-from django.db import transaction
+from django.db import models, transaction
 from django.template.loader import render_to_string
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
@@ -162,6 +162,25 @@ class AutomaticEmailSerializer(serializers.HyperlinkedModelSerializer):
         }
 
 
+class RetreatListSerializer(serializers.ListSerializer):
+    """
+    Gets the options available on all retreats once for the whole list,
+    instead of retreat by retreat.
+    """
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.Manager) else data
+        retreats = list(iterable)
+        if retreats:
+            product_type_options = list(
+                ContentType.objects.get_for_model(Retreat)
+                .products.select_subclasses()
+            )
+            for retreat in retreats:
+                retreat.product_type_options = product_type_options
+        return super(RetreatListSerializer, self).to_representation(retreats)
+
+
 class RetreatSerializer(BaseProductSerializer):
     start_time = serializers.ReadOnlyField()
     end_time = serializers.ReadOnlyField()
@@ -253,6 +272,7 @@ class RetreatSerializer(BaseProductSerializer):
     class Meta:
         model = Retreat
         exclude = ('deleted', 'deleted_by_cascade', 'users')
+        list_serializer_class = RetreatListSerializer
         extra_kwargs = {
             'details': {
                 'help_text': _("Description of the retreat.")
@@ -437,15 +457,18 @@ class ReservationSerializer(serializers.HyperlinkedModelSerializer):
         validated_data['exchangeable'] = False
         validated_data['is_active'] = True
 
-        if validated_data['retreat'].places_remaining <= 0:
-            raise serializers.ValidationError({
-                'non_field_errors': [_(
-                    "This retreat doesn't have available places. Please "
-                    "check number of seats available and reserved seats."
-                )]
-            })
+        with transaction.atomic():
+            retreat = validated_data['retreat']
+            retreat.get_capacity(lock=True)
+            if retreat.places_remaining <= 0:
+                raise serializers.ValidationError({
+                    'non_field_errors': [_(
+                        "This retreat doesn't have available places. Please "
+                        "check number of seats available and reserved seats."
+                    )]
+                })
 
-        return super().create(validated_data)
+            return super().create(validated_data)
 
     def update(self, instance, validated_data):
 
@@ -761,10 +784,16 @@ class WaitQueueSerializer(serializers.HyperlinkedModelSerializer):
             },
         }
 
+    # The values are annotated by WaitQueueViewSet.get_queryset for lists
+
     def get_list_size(self, obj):
+        if 'list_size' in obj.__dict__:
+            return obj.list_size
         return WaitQueue.objects.filter(retreat=obj.retreat).count()
 
     def get_notified(self, obj):
+        if 'notified' in obj.__dict__:
+            return obj.notified
         return WaitQueuePlaceReserved.objects.filter(
             user=obj.user,
             wait_queue_place__retreat=obj.retreat,
@@ -772,6 +801,8 @@ class WaitQueueSerializer(serializers.HyperlinkedModelSerializer):
         ).exists()
         
     def get_first_notify(self, obj):
+        if 'first_notify' in obj.__dict__:
+            return obj.first_notify
         first_notify = WaitQueuePlaceReserved.objects.filter(
             user=obj.user,
             wait_queue_place__retreat=obj.retreat,
@@ -3,12 +3,14 @@ import pytz
 from babel.dates import format_date
 from decimal import Decimal
 from django.conf import settings
+from blitz_api.exceptions import MailServiceError
 from blitz_api.services import (
     send_mail as send_templated_email,
     send_email_from_template_id,
+    queue_email_from_template_id,
 )
 from django.utils import timezone
-from retirement.models import WaitQueue
+from retirement.models import AutomaticEmailLog, WaitQueue
 from store.models import Refund
 from store.services import refund_amount
 
@@ -107,10 +109,10 @@ def send_retreat_confirmation_email(user, retreat):
         return []
 
 
-def send_automatic_email(user, retreat, email):
+def get_automatic_email_context(retreat, email):
     """
-    This function sends an automatic email to notify a user that has an
-    active reservation on a retreat.
+    Returns the context of an automatic email shared by all the users of a
+    retreat.
     """
 
     start_time = retreat.start_time
@@ -119,11 +121,8 @@ def send_automatic_email(user, retreat, email):
     end_time = retreat.end_time
     end_time = end_time.astimezone(pytz.timezone('US/Eastern'))
 
-    context = {
+    return {
         'CUSTOM': json.loads(email.context),
-        'USER_FIRST_NAME': user.first_name,
-        'USER_LAST_NAME': user.last_name,
-        'USER_EMAIL': user.email,
         'RETREAT_NAME': retreat.name_fr,
         'RETREAT_START_DATE': format_date(
             start_time,
@@ -145,6 +144,26 @@ def send_automatic_email(user, retreat, email):
             'FRONTEND_INTEGRATION']['PROFILE_URL'],
     }
 
+
+def get_automatic_email_user_context(user):
+    """
+    Returns the context of an automatic email specific to a user.
+    """
+    return {
+        'USER_FIRST_NAME': user.first_name,
+        'USER_LAST_NAME': user.last_name,
+        'USER_EMAIL': user.email,
+    }
+
+
+def send_automatic_email(user, retreat, email):
+    """
+    This function sends an automatic email to notify a user that has an
+    active reservation on a retreat.
+    """
+    context = get_automatic_email_context(retreat, email)
+    context.update(get_automatic_email_user_context(user))
+
     response_send_mail = send_email_from_template_id(
         [user],
         context,
@@ -153,11 +172,62 @@ def send_automatic_email(user, retreat, email):
     return response_send_mail
 
 
+def send_retreat_automatic_email(retreat, email):
+    """
+    This function sends an automatic email to every user with an active
+    reservation on a retreat who didn't receive it yet, with batch sends,
+    and returns their emails.
+    Raises MailServiceError if some emails failed to be delivered, once the
+    others are logged, so the caller tries again for the failed ones only.
+    """
+    reservations = list(
+        retreat.reservations.filter(
+            is_active=True,
+        ).exclude(
+            automatic_email_logs__email=email,
+        ).select_related('user')
+    )
+    if not reservations:
+        return []
+
+    users = [reservation.user for reservation in reservations]
+    failed_emails = send_email_from_template_id(
+        users,
+        get_automatic_email_context(retreat, email),
+        email.template_id,
+        {
+            user.email: get_automatic_email_user_context(user)
+            for user in users
+        },
+        batch=True,
+    )
+
+    # Failed emails are not logged so a retry only sends them
+    reservations = [
+        reservation for reservation in reservations
+        if reservation.user.email not in failed_emails
+    ]
+    AutomaticEmailLog.objects.bulk_create([
+        AutomaticEmailLog(
+            reservation=reservation,
+            email=email
+        )
+        for reservation in reservations
+    ])
+
+    if failed_emails:
+        raise MailServiceError(
+            f'{len(failed_emails)} automatic email(s) failed to be '
+            f'delivered: {", ".join(failed_emails)}'
+        )
+    return [reservation.user.email for reservation in reservations]
+
+
 def send_updated_retreat_email(retreat, users, reason, reason_message):
     """
     This function sends an automatic email to notify all registered users
     of a retreat that it has been updated. For example dates have changed or
-    retreat is deleted
+    retreat is deleted. Emails are sent once the transaction is committed.
     """
     reason_template = {
         'deletion': 'RETREAT_DELETED',
@@ -169,9 +239,9 @@ def send_updated_retreat_email(retreat, users, reason, reason_message):
         'MESSAGE': reason_message,
     }
 
-    response_send_mail = send_templated_email(
+    # Sent by a Celery worker, the retreat may have many participants
+    queue_email_from_template_id(
         users,
         context,
-        reason_template[reason]
+        settings.ANYMAIL['TEMPLATES'].get(reason_template[reason]),
     )
-    return response_send_mail
@@ -0,0 +1,118 @@
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_init,
+    post_save,
+)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from blitz_api.services import invalidate_response_cache
+from store.models import BaseProduct, OptionProduct
+
+from .models import (
+    Picture,
+    Reservation,
+    Retreat,
+    RetreatCapacity,
+    RetreatDate,
+    RetreatInvitation,
+    RetreatType,
+    WaitQueue,
+    WaitQueuePlace,
+)
+
+
+@receiver(post_save, sender=Retreat)
+def create_retreat_capacity(sender, instance, created, **kwargs):
+    if created:
+        RetreatCapacity.objects.get_or_create(retreat_id=instance.pk)
+
+
+@receiver(post_init, sender=Reservation)
+@receiver(post_init, sender=RetreatInvitation)
+@receiver(post_init, sender=WaitQueuePlace)
+def track_capacity_retreat(sender, instance, **kwargs):
+    """
+    Remember the retreat of the instance, if it is moved to another retreat
+    the capacity of both retreats has to be refreshed.
+    """
+    # Read from __dict__ to not load the field if it is deferred
+    instance._capacity_retreat_id = instance.__dict__.get('retreat_id')
+
+
+@receiver(post_save, sender=Reservation)
+@receiver(post_save, sender=RetreatInvitation)
+@receiver(post_save, sender=WaitQueuePlace)
+@receiver(post_delete, sender=Reservation)
+@receiver(post_delete, sender=RetreatInvitation)
+@receiver(post_delete, sender=WaitQueuePlace)
+def refresh_retreat_capacity(sender, instance, **kwargs):
+    """
+    Refresh the capacity of the retreats of the instance, in the same
+    transaction as the change.
+    """
+    retreat_ids = {
+        getattr(instance, '_capacity_retreat_id', None),
+        instance.retreat_id,
+    }
+    for retreat_id in retreat_ids - {None}:
+        RetreatCapacity.refresh(retreat_id)
+
+    instance._capacity_retreat_id = instance.retreat_id
+
+
+@receiver(post_save, sender=Retreat)
+@receiver(post_save, sender=RetreatDate)
+@receiver(post_save, sender=Picture)
+@receiver(post_save, sender=RetreatType)
+@receiver(post_delete, sender=Retreat)
+@receiver(post_delete, sender=RetreatDate)
+@receiver(post_delete, sender=Picture)
+@receiver(post_delete, sender=RetreatType)
+@receiver(post_save, sender=OptionProduct)
+@receiver(post_delete, sender=OptionProduct)
+def invalidate_retreat_responses(sender, instance, **kwargs):
+    """
+    Invalidate the cached responses of the retreat catalog.
+    """
+    invalidate_response_cache('retreat')
+
+
+@receiver(m2m_changed, sender=BaseProduct.available_on_products.through)
+@receiver(m2m_changed, sender=BaseProduct.available_on_product_types.through)
+@receiver(m2m_changed, sender=BaseProduct.available_on_retreat_types.through)
+def invalidate_retreat_option_responses(sender, action, **kwargs):
+    """
+    Invalidate the cached responses of the retreat catalog when the products
+    an option is available on change, retreats include their options.
+    """
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate_response_cache('retreat')
+
+
+@receiver(post_save, sender=WaitQueue)
+def schedule_new_wait_queue_notification(sender, instance, created,
+                                         **kwargs):
+    """
+    Notify the new user of the wait queue if all the other users have
+    already been notified of the places of the retreat.
+    """
+    if created:
+        WaitQueuePlace.objects.filter(
+            retreat_id=instance.retreat_id,
+            available=True,
+            next_notification_at__isnull=True,
+        ).update(next_notification_at=timezone.now())
+
+
+@receiver(post_delete, sender=WaitQueue)
+def schedule_left_wait_queue_notification(sender, instance, **kwargs):
+    """
+    The user may have left with a reserved place, the next user can be
+    notified right away.
+    """
+    WaitQueuePlace.objects.filter(
+        retreat_id=instance.retreat_id,
+        available=True,
+    ).update(next_notification_at=timezone.now())
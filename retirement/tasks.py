@@ -5,7 +5,20 @@ from django.utils import timezone
 from django.conf import settings
 import requests
 
-from retirement.models import WaitQueuePlace
+from retirement.models import (
+    AutomaticEmail,
+    Retreat,
+    WaitQueue,
+    WaitQueuePlace,
+    WaitQueuePlaceReserved,
+)
+from retirement.services import send_retreat_automatic_email
+
+# Number of wait queue notifications sent by each task
+WAIT_QUEUE_NOTIFICATION_BATCH_SIZE = 100
+
+# Number of times automatic emails that failed are sent again
+AUTOMATIC_EMAIL_MAX_RETRIES = 5
 
 
 @shared_task
@@ -50,9 +63,120 @@ def assign_retreat_tomatoes():
 @shared_task
 def notify_wait_queue_place():
     """
-    Check all wait queue places still available and process the notification system for them.
+    Start the notification of the retreats with wait queue places due,
+    in one task per retreat.
+    """
+    retreat_ids = WaitQueuePlace.objects.filter(
+        available=True,
+        next_notification_at__lte=timezone.now(),
+    ).order_by().values_list('retreat_id', flat=True).distinct()
+
+    for retreat_id in retreat_ids:
+        notify_retreat_wait_queue_places.delay(retreat_id)
+
+
+@shared_task
+def notify_retreat_wait_queue_places(retreat_id):
+    """
+    Process the notification system for the wait queue places due of the
+    retreat.
     """
-    available_wait_queue_places = WaitQueuePlace.objects.filter(available=True)
-    
-    for place in available_wait_queue_places:
+    due_wait_queue_places = WaitQueuePlace.objects.filter(
+        retreat_id=retreat_id,
+        available=True,
+        next_notification_at__lte=timezone.now(),
+    ).select_related('retreat').order_by('create')
+
+    retreat = None
+    for place in due_wait_queue_places:
+        # Share the retreat to not fetch its dates again for each place
+        retreat = retreat or place.retreat
+        place.retreat = retreat
         place.notify()
+
+
+def notify_wait_queue_places_reserved(wait_queue_place_reserved_ids):
+    """
+    Send the notifications of the wait queue places reserved by batches in
+    Celery tasks, once the current transaction is committed.
+    """
+    def send_notifications():
+        for index in range(
+                0,
+                len(wait_queue_place_reserved_ids),
+                WAIT_QUEUE_NOTIFICATION_BATCH_SIZE):
+            send_wait_queue_notifications.delay(
+                wait_queue_place_reserved_ids[
+                    index:index + WAIT_QUEUE_NOTIFICATION_BATCH_SIZE
+                ]
+            )
+
+    if wait_queue_place_reserved_ids:
+        transaction.on_commit(send_notifications)
+
+
+@shared_task
+def send_wait_queue_notifications(wait_queue_place_reserved_ids):
+    """
+    Notify the users of the wait queue places reserved that they have a
+    reserved seat. Returns the emails of the users that couldn't be notified.
+    """
+    places_reserved = list(
+        WaitQueuePlaceReserved.objects.filter(
+            id__in=wait_queue_place_reserved_ids,
+        ).select_related('user', 'wait_queue_place__retreat')
+    )
+
+    wait_queues = WaitQueue.objects.filter(
+        user_id__in=[
+            place_reserved.user_id for place_reserved in places_reserved
+        ],
+        retreat_id__in=[
+            place_reserved.wait_queue_place.retreat_id
+            for place_reserved in places_reserved
+        ],
+    )
+    wait_queues = {
+        (wait_queue.user_id, wait_queue.retreat_id): wait_queue
+        for wait_queue in wait_queues
+    }
+
+    failed_emails = []
+    for place_reserved in places_reserved:
+        retreat = place_reserved.wait_queue_place.retreat
+        wait_queue = wait_queues.get(
+            (place_reserved.user_id, retreat.id),
+        )
+        if wait_queue is None:
+            # The user left the wait queue in the meantime
+            continue
+        try:
+            retreat.notify_reserved_seat(place_reserved.user, wait_queue)
+        except Exception:
+            # The error is logged when sending the email, we don't want
+            # to block the other notifications
+            failed_emails.append(place_reserved.user.email)
+
+    return failed_emails
+
+
+@shared_task(
+    autoretry_for=(Exception,),
+    retry_backoff=60,
+    retry_kwargs={'max_retries': AUTOMATIC_EMAIL_MAX_RETRIES},
+)
+def execute_automatic_email(retreat_id, email_id):
+    """
+    Send an automatic email to the users who will attend a retreat. Tasks
+    of cron_manager dispatch it once when the email is due, so it is retried
+    with an exponential backoff while some emails fail to be delivered.
+    Returns the emails of the notified users.
+    """
+    try:
+        retreat = Retreat.objects.get(pk=retreat_id)
+        email = AutomaticEmail.objects.get(pk=email_id)
+    except (Retreat.DoesNotExist, AutomaticEmail.DoesNotExist):
+        # No need to retry if the retreat or the email were deleted
+        return []
+
+    return send_retreat_automatic_email(retreat, email)
@@ -1,5 +1,9 @@
+import csv
+import io
 from unittest import mock
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from datetime import datetime
 
 from django.contrib.contenttypes.models import ContentType
@@ -13,7 +17,16 @@ from retirement.models import (
 )
 from retirement.exports import generate_retreat_participation
 from blitz_api.models import ExportMedia
-from blitz_api.factories import AdminFactory
+from blitz_api.factories import (
+    AdminFactory,
+    OptionProductFactory,
+    OrderFactory,
+    OrderLineBaseProductFactory,
+    OrderLineFactory,
+    ReservationFactory,
+    UserFactory,
+)
+from store.models import OptionProduct
 
 LOCAL_TIMEZONE = pytz.timezone(settings.TIME_ZONE)
 
@@ -139,3 +152,135 @@ class TestExportAnonymousChronoDataTask(TestCase):
         self.assertEqual(
             export.type,
             ExportMedia.EXPORT_RETREAT_PARTICIPATION)
+
+    def create_participant(self, email, room_option=None, metadata=None,
+                           quantity=0):
+        user = UserFactory(email=email)
+        order_line = OrderLineFactory(
+            content_type=self.retreat_type,
+            object_id=self.retreat.id,
+            order=OrderFactory(user=user),
+        )
+        ReservationFactory(
+            user=user,
+            retreat=self.retreat,
+            order_line=order_line,
+        )
+        if room_option:
+            OrderLineBaseProductFactory(
+                order_line=order_line,
+                option=room_option,
+                metadata=metadata,
+            )
+        if quantity:
+            OrderLineBaseProductFactory(
+                order_line=order_line,
+                option=self.option,
+                quantity=quantity,
+            )
+        return user
+
+    @mock.patch('blitz_api.models.ExportMedia.send_confirmation_email')
+    def test_export_retreat_participation(self, mock_email):
+        """
+        Ensure participants are exported in room order with the quantity of
+        each option, with a number of queries not growing with participants
+        """
+        shared_room_option = OptionProductFactory(
+            is_room_option=True,
+            type=OptionProduct.METADATA_SHARED_ROOM,
+        )
+        single_room_option = OptionProductFactory(
+            is_room_option=True,
+            type=OptionProduct.METADATA_NONE,
+        )
+        self.option = OptionProductFactory(name='Breakfast')
+        for option in [shared_room_option, single_room_option, self.option]:
+            option.available_on_products.add(self.retreat)
+
+        self.create_participant('1@test.ca', quantity=2)
+        self.create_participant(
+            '2@test.ca',
+            shared_room_option,
+            {
+                'share_with_member': '',
+                'share_with_preferred_gender': 'woman',
+            },
+        )
+        self.create_participant('3@test.ca', single_room_option, quantity=1)
+        self.create_participant(
+            '4@test.ca',
+            shared_room_option,
+            {
+                'share_with_member': '',
+                'share_with_preferred_gender': 'woman',
+            },
+            quantity=3,
+        )
+
+        with CaptureQueriesContext(connection) as queries:
+            generate_retreat_participation(self.admin.id, self.retreat.id)
+
+        export = ExportMedia.objects.get()
+        rows = list(csv.reader(io.StringIO(export.file.read().decode())))
+        header = rows[0]
+        self.assertEqual(header[-4:], [
+            'Option de chambre',
+            'Préférence de genre',
+            'Souhaite partager avec',
+            'Numéro de chambre',
+        ])
+        option_index = header.index('Breakfast')
+        self.assertEqual(
+            [(row[2], row[option_index], row[-1]) for row in rows[1:]],
+            [
+                ('3@test.ca', '1', '1'),
+                ('2@test.ca', '0', '2'),
+                ('4@test.ca', '3', '2'),
+                ('1@test.ca', '2', 'NA'),
+            ],
+        )
+
+        for index in range(5, 10):
+            self.create_participant(
+                f'{index}@test.ca',
+                shared_room_option,
+                {
+                    'share_with_member': '',
+                    'share_with_preferred_gender': 'man',
+                },
+                quantity=1,
+            )
+
+        with self.assertNumQueries(len(queries)):
+            generate_retreat_participation(self.admin.id, self.retreat.id)
+
+    @mock.patch('blitz_api.models.ExportMedia.send_confirmation_email')
+    def test_export_retreat_participation_without_room_option(
+            self,
+            mock_email
+    ):
+        """
+        Ensure participants of a retreat without room option are exported in
+        order of reservation, without the room columns
+        """
+        self.option = OptionProductFactory(name='Breakfast')
+        self.option.available_on_products.add(self.retreat)
+
+        self.create_participant('2@test.ca', quantity=1)
+        self.create_participant('1@test.ca')
+
+        generate_retreat_participation(self.admin.id, self.retreat.id)
+
+        export = ExportMedia.objects.get()
+        rows = list(csv.reader(io.StringIO(export.file.read().decode())))
+        header = rows[0]
+        self.assertEqual(header[-1], 'Breakfast')
+        self.assertNotIn('Numéro de chambre', header)
+        self.assertEqual(
+            [(row[2], row[-1]) for row in rows[1:]],
+            [
+                ('2@test.ca', '1'),
+                ('1@test.ca', '0'),
+            ],
+        )
@@ -18,8 +18,10 @@ from blitz_api.factories import (
 from retirement.models import (
     Retreat,
     RetreatDate,
+    RetreatInvitation,
     RetreatType,
     Reservation,
+    WaitQueuePlace,
 )
 from store.models import (
     OptionProduct
@@ -531,7 +533,8 @@ class RetreatTests(APITestCase):
             option=self.single_room_option,
         )
 
-        distribution = self.retreat.get_retreat_room_distribution()
+        with self.assertNumQueries(3):
+            distribution = self.retreat.get_retreat_room_distribution()
         expected_distribution = [
             {
                 'id': user_16.id,
@@ -777,3 +780,59 @@ class RetreatTests(APITestCase):
         self.assertEqual(2, len(users))
         self.assertTrue(user in users)
         self.assertTrue(user2 in users)
+
+    def test_places_remaining(self):
+        """
+        Ensure the capacity of the retreat follows its reservations, wait
+        queue places and invitations, and is read with a single query.
+        """
+        self.retreat.seats = 10
+        self.retreat.save()
+        user = UserFactory()
+
+        reservation = Reservation.objects.create(
+            user=user,
+            retreat=self.retreat,
+            is_active=True,
+        )
+        wait_queue_place = WaitQueuePlace.objects.create(
+            retreat=self.retreat,
+            cancel_by=user,
+        )
+        invitation = RetreatInvitation.objects.create(
+            retreat=self.retreat,
+            nb_places=3,
+            reserve_seat=True,
+        )
+        Reservation.objects.create(
+            user=UserFactory(),
+            retreat=self.retreat,
+            invitation=invitation,
+            is_active=True,
+        )
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.retreat.places_remaining, 10 - 2 - 1 - 2)
+        self.assertEqual(self.retreat.total_reservations, 2)
+        self.assertEqual(self.retreat.reserved_seats, 1)
+        self.assertEqual(
+            self.retreat.free_places_for_reserve_invitations(), 2)
+
+        reservation.is_active = False
+        reservation.save()
+        wait_queue_place.available = False
+        wait_queue_place.save()
+        invitation.delete()
+
+        self.assertEqual(self.retreat.places_remaining, 10 - 1)
+
+        other_retreat = Retreat.objects.get(pk=self.retreat.pk)
+        other_retreat.pk = None
+        other_retreat.id = None
+        other_retreat.save()
+        reservation = Reservation.objects.get(invitation=invitation)
+        reservation.retreat = other_retreat
+        reservation.save()
+
+        self.assertEqual(self.retreat.places_remaining, 10)
+        self.assertEqual(other_retreat.total_reservations, 1)
@@ -0,0 +1,153 @@
+import random
+from collections import defaultdict
+
+from django.test import SimpleTestCase
+
+from blitz_api.management.commands.benchmark_room_distribution import (
+    generate_participants,
+)
+from retirement.room_distribution import (
+    GENDER_PREFERENCE_MIXED,
+    distribute_rooms,
+    maximum_matching,
+)
+
+
+def participant(id, room_option='shared', gender_preference='NA',
+                share_with='NA'):
+    return {
+        'id': id,
+        'first_name': 'x',
+        'last_name': 'y',
+        'email': f'{id}@test.ca',
+        'room_option': room_option,
+        'gender_preference': gender_preference,
+        'share_with': share_with,
+        'room_number': 0,
+        'placed': False,
+    }
+
+
+def brute_force_matching_size(edges, vertices):
+    if not vertices:
+        return 0
+    first, *others = vertices
+    best = brute_force_matching_size(edges, others)
+    for other in others:
+        if (first, other) in edges:
+            remaining = [vertex for vertex in others if vertex != other]
+            best = max(
+                best,
+                1 + brute_force_matching_size(edges, remaining),
+            )
+    return best
+
+
+class RoomDistributionTests(SimpleTestCase):
+
+    def test_maximum_matching(self):
+        """
+        Ensure the matching is maximum, whatever the initial matching
+        """
+        generator = random.Random(42)
+        for _ in range(200):
+            size = generator.randint(2, 8)
+            edges = set()
+            for first in range(size):
+                for second in range(first + 1, size):
+                    if generator.random() < 0.4:
+                        edges.update({(first, second), (second, first)})
+            neighbours = [
+                [other for other in range(size) if (vertex, other) in edges]
+                for vertex in range(size)
+            ]
+            seed = [None] * size
+            for first, second in sorted(edges):
+                if seed[first] is None and seed[second] is None \
+                        and generator.random() < 0.5:
+                    seed[first] = second
+                    seed[second] = first
+
+            matching = maximum_matching(neighbours, seed)
+
+            for vertex, mate in enumerate(matching):
+                if mate is not None:
+                    self.assertIn((vertex, mate), edges)
+                    self.assertEqual(matching[mate], vertex)
+            self.assertEqual(
+                sum(mate is not None for mate in matching) // 2,
+                brute_force_matching_size(edges, list(range(size))),
+            )
+
+    def test_distribute_rooms_friend_email_case(self):
+        """
+        Ensure mutual friend requests are matched whatever the case of the
+        email typed by participants
+        """
+        participants = [
+            participant(1, gender_preference='man', share_with=' 2@Test.ca'),
+            participant(2, gender_preference='woman', share_with='1@test.ca'),
+        ]
+
+        distribution = distribute_rooms(participants)
+
+        self.assertEqual(distribution[1]['room_number'], 1)
+        self.assertEqual(distribution[2]['room_number'], 1)
+
+    def test_distribute_rooms_unknown_preference(self):
+        """
+        Ensure participants with an unknown gender preference still get a
+        room
+        """
+        participants = [
+            participant(1, gender_preference=''),
+            participant(2, gender_preference='man'),
+            participant(3, room_option='NA'),
+        ]
+
+        distribution = distribute_rooms(participants)
+
+        self.assertTrue(distribution[1]['placed'])
+        self.assertTrue(distribution[2]['placed'])
+        self.assertFalse(distribution[3]['placed'])
+
+    def test_distribute_rooms_synthetic_retreat(self):
+        """
+        Ensure every participant of a large retreat gets a room respecting
+        their preferences
+        """
+        for seed in range(5):
+            participants = generate_participants(200, seed)
+            emails = {value['email']: value for value in participants}
+
+            distribution = distribute_rooms(participants)
+
+            rooms = defaultdict(list)
+            for value in distribution.values():
+                self.assertTrue(value['placed'])
+                rooms[value['room_number']].append(value)
+
+            incompatible_rooms = 0
+            for roommates in rooms.values():
+                if roommates[0]['room_option'] == 'single':
+                    self.assertEqual(len(roommates), 1)
+                    continue
+                self.assertLessEqual(len(roommates), 2)
+                if roommates[0]['share_with'] == roommates[-1]['email']:
+                    # Mutual friends share a room whatever their preference
+                    continue
+                preferences = {
+                    value['gender_preference'] for value in roommates
+                }
+                if len(preferences) > 1 and \
+                        GENDER_PREFERENCE_MIXED not in preferences:
+                    incompatible_rooms += 1
+            self.assertLessEqual(incompatible_rooms, 1)
+
+            for value in distribution.values():
+                friend = emails.get(value['share_with'])
+                if friend and friend['share_with'] == value['email']:
+                    self.assertEqual(
+                        value['room_number'],
+                        friend['room_number'],
+                    )
@@ -38,6 +38,7 @@ from retirement.models import (
     Retreat,
     Reservation, RetreatType, RetreatDate,
 )
+from log_management.tasks import send_outbox_emails
 
 User = get_user_model()
 
@@ -1021,6 +1022,7 @@ class ReservationTests(CustomAPITestCase):
         self.reservation.cancelation_date = None
         self.reservation.cancelation_reason = None
 
+        send_outbox_emails()
         self.assertEqual(len(mail.outbox), 1)
 
     @responses.activate
@@ -1092,6 +1094,7 @@ class ReservationTests(CustomAPITestCase):
         free_reservation.cancelation_date = None
         free_reservation.cancelation_reason = None
 
+        send_outbox_emails()
         self.assertEqual(len(mail.outbox), 0)
 
     @responses.activate
@@ -1138,6 +1141,7 @@ class ReservationTests(CustomAPITestCase):
         self.reservation.cancelation_date = None
         self.reservation.cancelation_reason = None
 
+        send_outbox_emails()
         self.assertEqual(len(mail.outbox), 0)
 
     @responses.activate
@@ -1187,6 +1191,7 @@ class ReservationTests(CustomAPITestCase):
         self.reservation.cancelation_date = None
         self.reservation.cancelation_reason = None
 
+        send_outbox_emails()
         self.assertEqual(len(mail.outbox), 0)
 
         self.reservation.refundable = True
@@ -1242,6 +1247,7 @@ class ReservationTests(CustomAPITestCase):
         self.reservation2.cancelation_date = None
         self.reservation2.cancelation_reason = None
 
+        send_outbox_emails()
         self.assertEqual(len(mail.outbox), 0)
 
     @responses.activate
@@ -1299,6 +1305,7 @@ class ReservationTests(CustomAPITestCase):
         self.reservation2.cancelation_date = None
         self.reservation2.cancelation_reason = None
 
+        send_outbox_emails()
         self.assertEqual(len(mail.outbox), 0)
 
     @responses.activate
@@ -1421,6 +1428,7 @@ class ReservationTests(CustomAPITestCase):
         self.reservation.cancelation_date = None
         self.reservation.cancelation_reason = None
 
+        send_outbox_emails()
         self.assertEqual(len(mail.outbox), 0)
 
         self.reservation.refundable = True
@@ -1499,6 +1507,7 @@ class ReservationTests(CustomAPITestCase):
         self.reservation.cancelation_date = None
         self.reservation.cancelation_reason = None
 
+        send_outbox_emails()
         self.assertEqual(len(mail.outbox), 1)
 
     @responses.activate
@@ -1543,4 +1552,5 @@ class ReservationTests(CustomAPITestCase):
         self.assertEqual(self.reservation.cancelation_action, "R")
         self.assertEqual(self.reservation.cancelation_date, FIXED_TIME)
 
+        send_outbox_emails()
         self.assertEqual(len(mail.outbox), 1)
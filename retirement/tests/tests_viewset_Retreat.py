@@ -12,7 +12,9 @@ from unittest import mock
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core import mail
-from django.test.utils import override_settings
+from django.db import connection
+from django.utils.dateparse import parse_datetime
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APIClient
@@ -23,9 +25,10 @@ from blitz_api.factories import (
 )
 from blitz_api.models import AcademicLevel
 from blitz_api.testing_tools import CustomAPITestCase
-from store.models import Membership
+from store.models import Membership, OptionProduct
 
 from retirement.models import (
+    Picture,
     Retreat,
     RetreatType,
     RetreatDate,
@@ -1146,6 +1149,175 @@ class RetreatTests(CustomAPITestCase):
         for item in content['results']:
             self.check_attributes(item)
 
+    def create_listed_retreats(self, nb_retreats):
+        for index in range(nb_retreats):
+            retreat = Retreat.objects.get(pk=self.retreat.pk)
+            retreat.pk = None
+            retreat.id = None
+            retreat.name = f'{retreat.name} {Retreat.objects.count()}'
+            retreat.save()
+            for day in [15, 16]:
+                RetreatDate.objects.create(
+                    start_time=LOCAL_TIMEZONE.localize(
+                        datetime(2130, 1, day, 8)),
+                    end_time=LOCAL_TIMEZONE.localize(
+                        datetime(2130, 1, day, 12)),
+                    retreat=retreat,
+                )
+            Picture.objects.create(
+                name='picture',
+                retreat=retreat,
+                picture='retreats/picture.jpg',
+            )
+            Reservation.objects.create(
+                user=self.user,
+                retreat=retreat,
+                is_active=True,
+            )
+
+    def test_list_num_queries(self):
+        """
+        Ensure the number of queries to list retreats doesn't depend on the
+        number of retreats.
+        """
+        self.client.force_authenticate(user=self.admin)
+        self.create_listed_retreats(1)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse('retreat:retreat-list'),
+                format='json',
+            )
+        nb_queries = len(queries)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.create_listed_retreats(3)
+
+        with self.assertNumQueries(nb_queries):
+            response = self.client.get(
+                reverse('retreat:retreat-list'),
+                format='json',
+            )
+
+        content = json.loads(response.content)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        listed_retreats = Retreat.objects.filter(
+            hide_from_client_admin_panel=False,
+        )
+        self.assertEqual(content['count'], listed_retreats.count())
+
+        retreats = {
+            retreat['id']: retreat for retreat in content['results']
+        }
+        for retreat in listed_retreats:
+            data = retreats[retreat.id]
+            self.assertEqual(
+                parse_datetime(data['start_time']), retreat.start_time)
+            self.assertEqual(
+                parse_datetime(data['end_time']), retreat.end_time)
+            self.assertEqual(
+                data['places_remaining'], retreat.places_remaining)
+            self.assertEqual(
+                data['total_reservations'], retreat.total_reservations)
+            self.assertEqual(len(data['pictures']), retreat.pictures.count())
+
+    @override_settings(RESPONSE_CACHE_TIMEOUT=300)
+    def test_list_cached(self):
+        """
+        Ensure the list of retreats is cached, answered with a 304 while it
+        doesn't change and built again when a retreat changes.
+        """
+        response = self.client.get(
+            reverse('retreat:retreat-list'),
+            format='json',
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                reverse('retreat:retreat-list'),
+                format='json',
+                HTTP_IF_NONE_MATCH=etag,
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+        self.retreat.name = 'new_name'
+        self.retreat.save()
+
+        response = self.client.get(
+            reverse('retreat:retreat-list'),
+            format='json',
+            HTTP_IF_NONE_MATCH=etag,
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        names = [
+            retreat['name'] for retreat in
+            json.loads(response.content)['results']
+        ]
+        self.assertIn('new_name', names)
+
+    @override_settings(RESPONSE_CACHE_TIMEOUT=300)
+    def test_list_cached_option_changed(self):
+        """
+        Ensure the cached list of retreats is built again when an option is
+        made available on a retreat.
+        """
+        option = OptionProduct.objects.create(
+            name="option_cached",
+            details="option_cached",
+            available=True,
+            price=50.00,
+            max_quantity=10,
+        )
+
+        response = self.client.get(
+            reverse('retreat:retreat-list'),
+            format='json',
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+
+        option.available_on_products.add(self.retreat)
+
+        response = self.client.get(
+            reverse('retreat:retreat-list'),
+            format='json',
+            HTTP_IF_NONE_MATCH=etag,
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        retreat = next(
+            retreat for retreat in json.loads(response.content)['results']
+            if retreat['id'] == self.retreat.id
+        )
+        self.assertIn(
+            option.id,
+            [retreat_option['id'] for retreat_option in retreat['options']],
+        )
+
+    @override_settings(RESPONSE_CACHE_TIMEOUT=0)
+    def test_list_not_cached(self):
+        """
+        Ensure the list of retreats is not cached when the response cache is
+        disabled.
+        """
+        response = self.client.get(
+            reverse('retreat:retreat-list'),
+            format='json',
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.has_header('ETag'))
+
     def test_list_with_search(self):
         """
         Ensure we can list retreats with a search by name
@@ -1,4 +1,5 @@
 import pytz
+from celery.exceptions import Retry
 from unittest.mock import patch
 from datetime import datetime
 
@@ -8,8 +9,8 @@ from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APIClient
 
-from cron_manager.models import Task
 from blitz_api.cron_manager_api import CronManager
+from blitz_api.exceptions import MailServiceError
 from blitz_api.factories import (
     AdminFactory,
     UserFactory,
@@ -17,6 +18,7 @@ from blitz_api.factories import (
 from blitz_api.testing_tools import (
     CustomAPITestCase,
 )
+from cron_manager.models import Task
 
 
 from retirement.models import (
@@ -26,6 +28,7 @@ from retirement.models import (
     AutomaticEmail,
     Reservation,
 )
+from retirement.tasks import execute_automatic_email
 
 User = get_user_model()
 
@@ -103,13 +106,11 @@ class RetreatDateTests(CustomAPITestCase):
         self.retreat.activate()
         self.cron_manager = CronManager()
 
-        task_url = self.cron_manager.get_retreat_target_url(
-            self.retreat, self.auto_email_before_start)
-        self.task_before = Task.objects.get(url=task_url, active=True)
+        self.task_before = self.cron_manager.get_email_tasks(
+            self.retreat, self.auto_email_before_start).get(active=True)
 
-        task_url = self.cron_manager.get_retreat_target_url(
-            self.retreat, self.auto_email_after_start)
-        self.task_after = Task.objects.get(url=task_url, active=True)
+        self.task_after = self.cron_manager.get_email_tasks(
+            self.retreat, self.auto_email_after_start).get(active=True)
 
     def test_update_as_user(self):
         """
@@ -212,13 +213,11 @@ class RetreatDateTests(CustomAPITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
-        task_url = self.cron_manager.get_retreat_target_url(
-            self.retreat, self.auto_email_before_start)
-        task_before = Task.objects.get(url=task_url, active=True)
+        task_before = self.cron_manager.get_email_tasks(
+            self.retreat, self.auto_email_before_start).get(active=True)
 
-        task_url = self.cron_manager.get_retreat_target_url(
-            self.retreat, self.auto_email_after_start)
-        task_after = Task.objects.get(url=task_url, active=True)
+        task_after = self.cron_manager.get_email_tasks(
+            self.retreat, self.auto_email_after_start).get(active=True)
 
         self.assertEqual(self.task_after, task_after)
         self.assertEqual(self.task_before, task_before)
@@ -262,13 +261,11 @@ class RetreatDateTests(CustomAPITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
-        task_url = self.cron_manager.get_retreat_target_url(
-            self.retreat, self.auto_email_before_start)
-        task_before = Task.objects.get(url=task_url, active=True)
+        task_before = self.cron_manager.get_email_tasks(
+            self.retreat, self.auto_email_before_start).get(active=True)
 
-        task_url = self.cron_manager.get_retreat_target_url(
-            self.retreat, self.auto_email_after_start)
-        task_after = Task.objects.get(url=task_url, active=True)
+        task_after = self.cron_manager.get_email_tasks(
+            self.retreat, self.auto_email_after_start).get(active=True)
 
         self.assertNotEqual(self.task_after, task_after)
         self.assertEqual(self.task_before, task_before)
@@ -312,13 +309,11 @@ class RetreatDateTests(CustomAPITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
-        task_url = self.cron_manager.get_retreat_target_url(
-            self.retreat, self.auto_email_before_start)
-        task_before = Task.objects.get(url=task_url, active=True)
+        task_before = self.cron_manager.get_email_tasks(
+            self.retreat, self.auto_email_before_start).get(active=True)
 
-        task_url = self.cron_manager.get_retreat_target_url(
-            self.retreat, self.auto_email_after_start)
-        task_after = Task.objects.get(url=task_url, active=True)
+        task_after = self.cron_manager.get_email_tasks(
+            self.retreat, self.auto_email_after_start).get(active=True)
 
         self.assertEqual(self.task_after, task_after)
         self.assertNotEqual(self.task_before, task_before)
@@ -382,13 +377,11 @@ class RetreatDateTests(CustomAPITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
 
-        task_url = self.cron_manager.get_retreat_target_url(
-            self.retreat, self.auto_email_before_start)
-        task_before = Task.objects.get(url=task_url, active=True)
+        task_before = self.cron_manager.get_email_tasks(
+            self.retreat, self.auto_email_before_start).get(active=True)
 
-        task_url = self.cron_manager.get_retreat_target_url(
-            self.retreat, self.auto_email_after_start)
-        task_after = Task.objects.get(url=task_url, active=True)
+        task_after = self.cron_manager.get_email_tasks(
+            self.retreat, self.auto_email_after_start).get(active=True)
 
         self.assertEqual(self.task_after, task_after)
         self.assertEqual(self.task_before, task_before)
@@ -430,13 +423,11 @@ class RetreatDateTests(CustomAPITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
 
-        task_url = self.cron_manager.get_retreat_target_url(
-            self.retreat, self.auto_email_before_start)
-        task_before = Task.objects.get(url=task_url, active=True)
+        task_before = self.cron_manager.get_email_tasks(
+            self.retreat, self.auto_email_before_start).get(active=True)
 
-        task_url = self.cron_manager.get_retreat_target_url(
-            self.retreat, self.auto_email_after_start)
-        task_after = Task.objects.get(url=task_url, active=True)
+        task_after = self.cron_manager.get_email_tasks(
+            self.retreat, self.auto_email_after_start).get(active=True)
 
         self.assertNotEqual(self.task_after, task_after)
         self.assertEqual(self.task_before, task_before)
@@ -478,13 +469,11 @@ class RetreatDateTests(CustomAPITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
 
-        task_url = self.cron_manager.get_retreat_target_url(
-            self.retreat, self.auto_email_before_start)
-        task_before = Task.objects.get(url=task_url, active=True)
+        task_before = self.cron_manager.get_email_tasks(
+            self.retreat, self.auto_email_before_start).get(active=True)
 
-        task_url = self.cron_manager.get_retreat_target_url(
-            self.retreat, self.auto_email_after_start)
-        task_after = Task.objects.get(url=task_url, active=True)
+        task_after = self.cron_manager.get_email_tasks(
+            self.retreat, self.auto_email_after_start).get(active=True)
 
         self.assertEqual(self.task_after, task_after)
         self.assertNotEqual(self.task_before, task_before)
@@ -531,3 +520,110 @@ class RetreatDateTests(CustomAPITestCase):
             format='json',
         )
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @patch('retirement.services.send_email_from_template_id')
+    def test_execute_automatic_email(self, mock_email):
+        """
+        Ensure automatic emails are sent by a Celery task dispatched by
+        cron_manager, once to each participant with a single batch send
+        """
+        mock_email.return_value = []
+        kwargs = {
+            'retreat_id': self.retreat.id,
+            'email_id': self.auto_email_before_start.id,
+        }
+        self.assertEqual(self.task_before.task_type, Task.TYPE_CELERY)
+        self.assertEqual(self.task_before.celery_kwargs, kwargs)
+
+        with patch('cron_manager.models.current_app.send_task') as mock_task:
+            execution = self.task_before.execute()
+
+        mock_task.assert_called_once_with(
+            CronManager.EMAIL_CELERY_TASK,
+            kwargs=kwargs,
+        )
+        self.assertTrue(execution.success)
+
+        Reservation.objects.create(
+            user=self.user,
+            retreat=self.retreat,
+            is_active=True,
+        )
+        self.assertEqual(execute_automatic_email(**kwargs), [self.user.email])
+
+        user = UserFactory()
+        Reservation.objects.create(
+            user=user,
+            retreat=self.retreat,
+            is_active=True,
+        )
+        self.assertEqual(execute_automatic_email(**kwargs), [user.email])
+        self.assertEqual(execute_automatic_email(**kwargs), [])
+
+        self.assertEqual(mock_email.call_count, 2)
+        users, context, template, merge_data = mock_email.call_args[0]
+        self.assertEqual(users, [user])
+        self.assertEqual(
+            str(template),
+            str(self.auto_email_before_start.template_id),
+        )
+        self.assertEqual(context['RETREAT_NAME'], self.retreat.name_fr)
+        self.assertEqual(
+            merge_data[user.email]['USER_FIRST_NAME'],
+            user.first_name,
+        )
+
+    @patch('retirement.services.send_email_from_template_id')
+    def test_execute_automatic_email_failed(self, mock_email):
+        """
+        Ensure automatic emails that failed raise an error so they are sent
+        again by a retry, without sending again the delivered ones
+        """
+        user = UserFactory()
+        Reservation.objects.create(
+            user=self.user,
+            retreat=self.retreat,
+            is_active=True,
+        )
+        Reservation.objects.create(
+            user=user,
+            retreat=self.retreat,
+            is_active=True,
+        )
+        kwargs = {
+            'retreat_id': self.retreat.id,
+            'email_id': self.auto_email_before_start.id,
+        }
+
+        mock_email.return_value = [self.user.email]
+        with self.assertRaises(MailServiceError):
+            execute_automatic_email(**kwargs)
+
+        mock_email.return_value = []
+        self.assertEqual(execute_automatic_email(**kwargs), [self.user.email])
+        self.assertEqual(mock_email.call_args[0][0], [self.user])
+
+    @patch('retirement.tasks.execute_automatic_email.retry')
+    @patch('retirement.services.send_email_from_template_id')
+    def test_execute_automatic_email_retry(self, mock_email, mock_retry):
+        """
+        Ensure the task is retried by the worker when emails failed
+        """
+        Reservation.objects.create(
+            user=self.user,
+            retreat=self.retreat,
+            is_active=True,
+        )
+        mock_email.return_value = [self.user.email]
+        mock_retry.side_effect = Retry()
+
+        with self.assertRaises(Retry):
+            execute_automatic_email(
+                retreat_id=self.retreat.id,
+                email_id=self.auto_email_before_start.id,
+            )
+
+        self.assertIsInstance(
+            mock_retry.call_args[1]['exc'],
+            MailServiceError,
+        )
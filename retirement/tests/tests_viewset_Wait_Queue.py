@@ -4,14 +4,26 @@ from datetime import datetime, timedelta
 import pytz
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from rest_framework import status
-from rest_framework.test import APIClient, APITestCase
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory, APITestCase
 
 from blitz_api.factories import AdminFactory, UserFactory
 
-from ..models import Retreat, WaitQueue, RetreatType, RetreatDate
+from ..models import (
+    Retreat,
+    WaitQueue,
+    RetreatType,
+    RetreatDate,
+    WaitQueuePlace,
+    WaitQueuePlaceReserved,
+)
+from ..serializers import WaitQueueSerializer
 
 User = get_user_model()
 
@@ -452,6 +464,66 @@ class WaitQueueTests(APITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_list_num_queries(self):
+        """
+        Ensure the number of queries to list subscriptions to retreat
+        waitqueues doesn't depend on the number of subscriptions.
+        """
+        self.client.force_authenticate(user=self.admin)
+        wait_queue_place = WaitQueuePlace.objects.create(
+            retreat=self.retreat,
+            cancel_by=self.admin,
+        )
+        WaitQueuePlaceReserved.objects.create(
+            wait_queue_place=wait_queue_place,
+            user=self.user2,
+            notified=timezone.now(),
+        )
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(
+                reverse('retreat:waitqueue-list'),
+                format='json',
+            )
+        nb_queries = len(queries)
+
+        for index in range(5):
+            user = UserFactory()
+            WaitQueue.objects.create(user=user, retreat=self.retreat)
+            WaitQueuePlaceReserved.objects.create(
+                wait_queue_place=wait_queue_place,
+                user=user,
+                notified=timezone.now() if index % 2 else None,
+            )
+
+        with self.assertNumQueries(nb_queries):
+            response = self.client.get(
+                reverse('retreat:waitqueue-list'),
+                format='json',
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response_data = json.loads(response.content)
+        self.assertEqual(response_data['count'], 6)
+
+        request = Request(APIRequestFactory().get('/'))
+        request.user = self.admin
+        for result in response_data['results']:
+            # Values of the serializer without the annotations
+            data = WaitQueueSerializer(
+                WaitQueue.objects.get(id=result['id']),
+                context={'request': request},
+            ).data
+            self.assertEqual(result['list_size'], 6)
+            self.assertEqual(result['list_size'], data['list_size'])
+            self.assertEqual(result['notified'], data['notified'])
+            self.assertEqual(
+                parse_datetime(result['first_notify'])
+                if result['first_notify'] else None,
+                data['first_notify'],
+            )
+            self.assertEqual(result['user']['id'], data['user']['id'])
+
     def test_list_not_authenticated(self):
         """
         Ensure we can't list subscriptions to retreat waitqueues as an
@@ -4,7 +4,9 @@ from unittest import mock
 
 import pytz
 from django.conf import settings
+from django.core import mail
 from django.urls import reverse
+from django.utils import timezone
 from django.test import override_settings
 from rest_framework import status
 from rest_framework.test import APITestCase
@@ -12,6 +14,11 @@ from rest_framework.test import APITestCase
 from blitz_api.factories import RetreatFactory, UserFactory, AdminFactory
 from ..models import WaitQueuePlace, WaitQueue, WaitQueuePlaceReserved, \
     Retreat, RetreatDate, RetreatType
+from ..tasks import (
+    notify_retreat_wait_queue_places,
+    notify_wait_queue_place,
+    send_wait_queue_notifications,
+)
 
 LOCAL_TIMEZONE = pytz.timezone(settings.TIME_ZONE)
 
@@ -147,6 +154,136 @@ class WaitQueuePlaceTests(APITestCase):
             ).used is not None
         )
 
+    def test_notify_wait_queue_place_bulk(self):
+        """
+        Ensure the whole wait queue is notified with a constant number of
+        queries and the emails are sent by batches in Celery tasks.
+        """
+        for index in range(30):
+            WaitQueue.objects.create(
+                retreat=self.retreat,
+                user=UserFactory(),
+            )
+
+        with mock.patch(
+                'retirement.tasks.send_wait_queue_notifications.delay'
+        ) as send_notifications, \
+                self.captureOnCommitCallbacks(execute=True), \
+                self.assertNumQueries(6):
+            users_notified, stop = self.wait_queue_place.notify(
+                force_notify_all=True,
+                bypass_delay=True,
+            )
+
+        self.assertFalse(stop)
+        self.assertEqual(len(users_notified), 36)
+        self.check_count_wait_queue_place(self.wait_queue_place, 36)
+        self.assertFalse(
+            self.wait_queue_place.wait_queue_places_reserved.filter(
+                notified=None,
+            ).exists()
+        )
+
+        send_notifications.assert_called_once()
+        places_reserved_ids = send_notifications.call_args[0][0]
+        self.assertEqual(len(places_reserved_ids), 36)
+
+        failed_emails = send_wait_queue_notifications(places_reserved_ids)
+
+        self.assertEqual(failed_emails, [])
+        self.assertEqual(
+            sorted(message.to[0] for message in mail.outbox),
+            sorted(users_notified),
+        )
+
+    def test_notify_wait_queue_place_schedule(self):
+        """
+        Ensure the next notification of a place is scheduled after the delay
+        between notifications, and when a user joins an empty wait queue.
+        """
+        self.assertIsNotNone(self.wait_queue_place.next_notification_at)
+
+        self.wait_queue_place.notify()
+
+        self.wait_queue_place.refresh_from_db()
+        next_notification_at = self.wait_queue_place.next_notification_at
+        self.assertGreater(
+            next_notification_at,
+            timezone.now() + timedelta(hours=23),
+        )
+
+        # Notifying in the delay keeps the schedule
+        self.wait_queue_place.notify()
+
+        self.wait_queue_place.refresh_from_db()
+        self.assertEqual(
+            self.wait_queue_place.next_notification_at,
+            next_notification_at,
+        )
+        self.check_count_wait_queue_place(self.wait_queue_place, 1)
+
+        # Nobody left to notify
+        self.wait_queue_place.notify(force_notify_all=True, bypass_delay=True)
+        self.wait_queue_place.notify(bypass_delay=True)
+
+        self.wait_queue_place.refresh_from_db()
+        self.assertIsNone(self.wait_queue_place.next_notification_at)
+
+        WaitQueue.objects.create(
+            retreat=self.retreat,
+            user=UserFactory(),
+        )
+
+        self.wait_queue_place.refresh_from_db()
+        self.assertLessEqual(
+            self.wait_queue_place.next_notification_at,
+            timezone.now(),
+        )
+
+    def test_notify_wait_queue_place_task(self):
+        """
+        Ensure the periodic task only notifies the places due, with a task
+        per retreat.
+        """
+        other_retreat = Retreat.objects.get(pk=self.retreat.pk)
+        other_retreat.pk = None
+        other_retreat.id = None
+        other_retreat.name = 'other_retreat'
+        other_retreat.save()
+        WaitQueuePlace.objects.create(
+            retreat=other_retreat,
+            cancel_by=self.user_cancel,
+            next_notification_at=timezone.now() + timedelta(hours=1),
+        )
+        WaitQueuePlace.objects.create(
+            retreat=self.retreat,
+            cancel_by=self.user_cancel,
+        )
+
+        with mock.patch(
+                'retirement.tasks.notify_retreat_wait_queue_places.delay'
+        ) as notify_retreat, self.assertNumQueries(1):
+            notify_wait_queue_place()
+
+        notify_retreat.assert_called_once_with(self.retreat.id)
+
+        notify_retreat_wait_queue_places(self.retreat.id)
+
+        self.check_user_has_reserved_place_notify(
+            self.user1, self.wait_queue_place)
+        self.assertFalse(
+            WaitQueuePlace.objects.filter(
+                next_notification_at__lte=timezone.now(),
+            ).exists()
+        )
+
+        with mock.patch(
+                'retirement.tasks.notify_retreat_wait_queue_places.delay'
+        ) as notify_retreat, self.assertNumQueries(1):
+            notify_wait_queue_place()
+
+        notify_retreat.assert_not_called()
+
     def test_notify_wait_queue_place(self):
         self.wait_queue_place.notify()
 
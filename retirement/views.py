@@ -4,8 +4,13 @@ import pytz
 from dateutil.rrule import rrule, DAILY
 from django.core.files.base import ContentFile
 from django.db.models import (
+    Count,
+    Exists,
     Max,
     Min,
+    OuterRef,
+    Prefetch,
+    Subquery,
 )
 from django_filters import (
     FilterSet,
@@ -14,7 +19,7 @@ from django_filters import (
     BooleanFilter,
 )
 
-from blitz_api.mixins import ExportMixin
+from blitz_api.mixins import CachedResponseMixin, ExportMixin
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.db import transaction
@@ -36,7 +41,7 @@ from rest_framework.response import Response
 from blitz_api.models import ExportMedia
 from blitz_api.serializers import ExportMediaSerializer
 
-from store.models import OrderLineBaseProduct
+from store.models import BaseProduct, OrderLineBaseProduct
 
 from . import (
     permissions,
@@ -52,7 +57,6 @@ from .models import (
     WaitQueuePlaceReserved,
     RetreatType,
     AutomaticEmail,
-    AutomaticEmailLog,
     RetreatDate,
     RetreatUsageLog,
 )
@@ -71,7 +75,7 @@ from .serializers import (
     BatchActivateRetreatSerializer,
 )
 from .services import (
-    send_automatic_email,
+    send_retreat_automatic_email,
 )
 from .exports import (
     generate_retreat_participation,
@@ -144,7 +148,8 @@ class RetreatReservationFilter(FilterSet):
         fields = '__all__'
 
 
-class RetreatViewSet(ExportMixin, viewsets.ModelViewSet):
+class RetreatViewSet(CachedResponseMixin, ExportMixin,
+                     viewsets.ModelViewSet):
     """
     retrieve:
     Return the given retreat.
@@ -170,6 +175,7 @@ class RetreatViewSet(ExportMixin, viewsets.ModelViewSet):
     filterset_class = RetreatFilter
     search_fields = ('name',)
     export_resource = RetreatResource()
+    response_cache_namespace = 'retreat'
 
     def get_queryset(self):
         """
@@ -191,6 +197,30 @@ class RetreatViewSet(ExportMixin, viewsets.ModelViewSet):
             min_start_date=Min('retreat_dates__start_time'),
         )
 
+        if self.action in ['list', 'retrieve']:
+            queryset = queryset.select_related(
+                'type',
+                'capacity',
+            ).prefetch_related(
+                'retreat_dates',
+                'pictures',
+                'available_on_product_types',
+                'available_on_retreat_types',
+                'exclusive_memberships',
+                Prefetch(
+                    'available_on_products',
+                    queryset=BaseProduct.objects.select_subclasses(),
+                ),
+                Prefetch(
+                    'option_products',
+                    queryset=BaseProduct.objects.select_subclasses(),
+                ),
+                Prefetch(
+                    'type__option_retreat_types',
+                    queryset=BaseProduct.objects.select_subclasses(),
+                ),
+            )
+
         # Filter by display_start_time lower than
         display_start_time_lte = self.request.query_params.get(
             'display_start_time_lte',
@@ -406,17 +436,7 @@ class RetreatViewSet(ExportMixin, viewsets.ModelViewSet):
             return Response(response_data, status=status.HTTP_400_BAD_REQUEST)
 
         # Notify a user for every reserved seat
-        emails = []
-        for reservation in retreat.reservations.filter(is_active=True):
-            if reservation.automatic_email_logs.filter(email=email):
-                pass
-            else:
-                send_automatic_email(reservation.user, retreat, email)
-                AutomaticEmailLog.objects.create(
-                    reservation=reservation,
-                    email=email
-                )
-                emails.append(reservation.user.email)
+        emails = send_retreat_automatic_email(retreat, email)
 
         response_data = {
             'stop': True,
@@ -634,8 +654,35 @@ class WaitQueueViewSet(ExportMixin, viewsets.ModelViewSet):
         the currently authenticated user is an admin (is_staff).
         """
         if self.request.user.is_staff:
-            return WaitQueue.objects.all()
-        return WaitQueue.objects.filter(user=self.request.user)
+            queryset = WaitQueue.objects.all()
+        else:
+            queryset = WaitQueue.objects.filter(user=self.request.user)
+
+        if self.action in ['list', 'retrieve']:
+            # Values of the serializer, counted for the whole retreat even
+            # if the queryset is filtered
+            retreat_wait_queues = WaitQueue.objects.filter(
+                retreat=OuterRef('retreat'),
+            ).order_by().values('retreat').annotate(
+                count=Count('id'),
+            ).values('count')
+            places_reserved_notified = WaitQueuePlaceReserved.objects.filter(
+                user=OuterRef('user'),
+                wait_queue_place__retreat=OuterRef('retreat'),
+                notified__isnull=False,
+            )
+            queryset = queryset.annotate(
+                list_size=Subquery(retreat_wait_queues),
+                notified=Exists(places_reserved_notified),
+                first_notify=Subquery(
+                    places_reserved_notified.order_by('create')
+                    .values('create')[:1]
+                ),
+            )
+            if self.request.user.is_staff:
+                queryset = queryset.select_related('user')
+
+        return queryset
 
     def update(self, request, *args, **kwargs):
         return Response(status=status.HTTP_405_METHOD_NOT_ALLOWED)
@@ -756,7 +803,7 @@ class RetreatDateViewSet(viewsets.ModelViewSet):
             return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class RetreatTypeViewSet(viewsets.ModelViewSet):
+class RetreatTypeViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     serializer_class = RetreatTypeSerializer
     queryset = RetreatType.objects.all()
     permission_classes = [permissions.IsAdminOrReadOnly]
@@ -765,6 +812,7 @@ class RetreatTypeViewSet(viewsets.ModelViewSet):
         'is_visible',
     ]
     search_fields = ('name',)
+    response_cache_namespace = 'retreat'
 
     def get_queryset(self):
         if self.request.user.is_staff:
@@ -151,6 +151,7 @@ class RefundTransactionAdmin(SimpleHistoryAdmin):
         'transaction_date',
         'transaction_id',
         'is_successful',
+        'error_code',
     )
     
     list_filter = (
@@ -224,10 +225,12 @@ class OrderAdmin(SimpleHistoryAdmin, ExportActionModelAdmin):
         'settlement_id',
         'transaction_date',
         'user',
+        'status',
     )
     list_filter = (
         UserFilter,
         'transaction_date',
+        'status',
     )
     search_fields = (
         'user__email',
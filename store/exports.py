@@ -1,12 +1,14 @@
 import csv
 import io
 import pytz
+import tempfile
 
 from celery import shared_task
-from datetime import datetime
+from datetime import datetime, timedelta
 
-from django.core.files.base import ContentFile
+from django.core.files.base import ContentFile, File
 from django.conf import settings
+from django.db.models import Count
 
 from blitz_api.models import ExportMedia
 from store.models import (
@@ -14,50 +16,34 @@ from store.models import (
     OrderLine,
     Refund,
 )
-from retirement.models import (
-    Reservation as RetreatReservation,
-)
+from store.services import get_coupon_usages
 
 
 LOCAL_TIMEZONE = pytz.timezone(settings.TIME_ZONE)
 
 
 def _get_coupon_export_usage(coupon):
-    usages_per_order = {}
-    for line in OrderLine.objects.filter(coupon=coupon):
-        
-        # We want to exclude the orderlines that have been refunded, since the coupon has not been used in the end
-        if Refund.objects.filter(orderline=line).exists():
-            continue
-        
-        # Sometimes, we have a cancellation, but since the price was 0 (due to the coupon) we don't have a refund
-        # This allow to not display these lines
-        cancellations = RetreatReservation.objects.filter(order_line=line, is_active=False)
-        if line.content_type.model == 'retreat':
-            if cancellations.exists():
-                continue
-        
-        if line.order.id not in usages_per_order:
-            usages_per_order[line.order.id] = {
-                'date': line.order.transaction_date.
-                          astimezone(LOCAL_TIMEZONE).
-                          strftime("%Y-%m-%d %H:%M:%S"),
-                'user': line.order.user,
-                'amount_used': line.coupon_real_value,
-                'product_name': set(),
-            }
-            usages_per_order[line.order.id]['product_name'].add(
-                line.content_object.name)
-        else:
-            usages_per_order[line.order.id]['amount_used'] += \
-                line.coupon_real_value
-            usages_per_order[line.order.id]['product_name'].add(
-                line.content_object.name
-            )
     display_usages = []
-    for key, value in usages_per_order.items():
-        value['product_name'] = ', '.join(list(value['product_name']))
-        display_usages.append(value)
+    for usage in get_coupon_usages([coupon])[coupon.id]:
+        # We want to exclude the orderlines that have been refunded, since the
+        # coupon has not been used in the end
+        order_lines = [
+            order_line for order_line in usage['orderlines']
+            if not order_line['is_refunded']
+        ]
+        if not order_lines:
+            continue
+
+        transaction_date = usage['order'].transaction_date
+        display_usages.append({
+            'date': transaction_date.astimezone(LOCAL_TIMEZONE).strftime(
+                "%Y-%m-%d %H:%M:%S"),
+            'user': usage['user'],
+            'amount_used': usage['amount_used'],
+            'product_name': ', '.join(sorted(set(
+                order_line['product_name'] for order_line in order_lines
+            ))),
+        })
     return display_usages
 
 
@@ -130,50 +116,88 @@ def generate_coupon_usage(admin_id, coupon_id):
     new_export.send_confirmation_email()
 
 
-@shared_task()
-def export_orderlines_sales(admin_id, year, month):
+SALES_HEADER = [
+    'Numéro membre',  # django ID
+    'Université',
+    'Sexe',
+    'Ville',
+    'Age',
+    'Date de transaction',
+    'Fait par un admin',
+    'Numéro de commande',
+    'Type d\'élément',
+    'Élément associé',
+    'Quantité',
+    'Coupon',
+    'Valeur du coupon',
+    'Prix total',
+    'Metadata',
+    'Nombre d\'options',
+    'Montant remboursé',
+    'Détails du remboursement',
+    'Date de remboursement',
+]
+
+# Number of orderlines fetched at once by the sales export
+SALES_EXPORT_CHUNK_SIZE = 2000
+
+
+def _get_sales_date_range(year=None, month=None, start_date=None,
+                          end_date=None):
     """
-    Export the orderlines sales data to a csv file. Including refund
+    Returns the start (included) and the end (excluded) of the exported
+    period, either a month or a range of dates in ISO format with both dates
+    included.
     """
-    output_stream = io.StringIO()
-    writer = csv.writer(output_stream)
-    header = [
-        'Numéro membre',  # django ID
-        'Université',
-        'Sexe',
-        'Ville',
-        'Age',
-        'Date de transaction',
-        'Fait par un admin',
-        'Numéro de commande',
-        'Type d\'élément',
-        'Élément associé',
-        'Quantité',
-        'Coupon',
-        'Valeur du coupon',
-        'Prix total',
-        'Metadata',
-        'Nombre d\'options',
-        'Montant remboursé',
-        'Détails du remboursement',
-        'Date de remboursement',
-    ]
-    writer.writerow(header)
+    if start_date and end_date:
+        start = datetime.fromisoformat(start_date)
+        end = datetime.fromisoformat(end_date) + timedelta(days=1)
+    else:
+        start = datetime(int(year), int(month), 1)
+        end = datetime(
+            start.year + start.month // 12,
+            start.month % 12 + 1,
+            1,
+        )
+    return LOCAL_TIMEZONE.localize(start), LOCAL_TIMEZONE.localize(end)
+
+
+def _generate_sales_rows(start, end):
+    """
+    Yields the header and a row for each orderline sold in the period,
+    fetching the orderlines by chunks so the memory doesn't grow with the
+    length of the period.
+    """
+    refunds = {
+        refund.orderline_id: refund
+        for refund in Refund.objects.filter(
+            orderline__order__transaction_date__gte=start,
+            orderline__order__transaction_date__lt=end,
+        ).order_by('refund_date')
+    }
 
-    for line in OrderLine.objects.filter(
-            order__transaction_date__year=year,
-            order__transaction_date__month=month
-    ):
-        try:
-            refund = Refund.objects.get(orderline=line)
-        except Refund.DoesNotExist:
-            refund = None
+    order_lines = OrderLine.objects.filter(
+        order__transaction_date__gte=start,
+        order__transaction_date__lt=end,
+    ).select_related(
+        'order__user__university',
+        'content_type',
+        'coupon',
+    ).prefetch_related(
+        'content_object',
+    ).annotate(
+        nb_options=Count('options'),
+    ).order_by('id')
+
+    yield SALES_HEADER
+
+    for line in order_lines.iterator(chunk_size=SALES_EXPORT_CHUNK_SIZE):
+        refund = refunds.get(line.id)
         order = line.order
         user = order.user
         coupon = line.coupon
 
-
-        line_array = [None] * len(header)
+        line_array = [None] * len(SALES_HEADER)
         # User information
         line_array[0] = user.id
         line_array[1] = user.university
@@ -198,24 +222,52 @@ def export_orderlines_sales(admin_id, year, month):
         # Additional information
         line_array[13] = line.total_cost
         line_array[14] = line.metadata
-        line_array[15] = line.options.count()
+        line_array[15] = line.nb_options
 
         # Refund information
         line_array[16] = refund.amount if refund else ''
         line_array[17] = refund.details if refund else ''
-        line_array[18] = refund.refund_date.strftime('%Y-%m-%dT%H:%M:%SZ') if refund else ''
+        line_array[18] = refund.refund_date.strftime(
+            '%Y-%m-%dT%H:%M:%SZ') if refund else ''
 
-        writer.writerow(line_array)
+        yield line_array
 
-    date_file = LOCAL_TIMEZONE.localize(datetime.now()) \
-        .strftime("%Y%m%d")
-    filename = f'sales-refund-{date_file}.csv'
-    new_export = ExportMedia.objects.create(
-        name=filename,
-        author_id=admin_id,
-        type=ExportMedia.EXPORT_SALES_AND_REFUND
-    )
-    new_export.file.save(
-        filename,
-        ContentFile(output_stream.getvalue().encode()))
+
+@shared_task()
+def export_orderlines_sales(admin_id, year=None, month=None,
+                            start_date=None, end_date=None):
+    """
+    Export the orderlines sales data to a csv file. Including refund
+    The export covers the given month, or the given range of dates.
+    :params admin_id: id of admin doing the request
+    :params year: year of the exported month
+    :params month: exported month
+    :params start_date: first exported day, in ISO format
+    :params end_date: last exported day, in ISO format
+    """
+    start, end = _get_sales_date_range(year, month, start_date, end_date)
+
+    # The file is written on disk then streamed to the storage, instead of
+    # being built in memory.
+    with tempfile.TemporaryFile() as output_file:
+        output_stream = io.TextIOWrapper(
+            output_file,
+            encoding='utf-8',
+            newline='',
+        )
+        writer = csv.writer(output_stream)
+        writer.writerows(_generate_sales_rows(start, end))
+        output_stream.flush()
+        output_file.seek(0)
+
+        date_file = LOCAL_TIMEZONE.localize(datetime.now()) \
+            .strftime("%Y%m%d")
+        filename = f'sales-refund-{date_file}.csv'
+        new_export = ExportMedia.objects.create(
+            name=filename,
+            author_id=admin_id,
+            type=ExportMedia.EXPORT_SALES_AND_REFUND
+        )
+        new_export.file.save(filename, File(output_file))
+        output_stream.detach()
     new_export.send_confirmation_email()
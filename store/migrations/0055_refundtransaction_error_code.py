@@ -0,0 +1,18 @@
+# Generated by Django 5.2.14 on 2026-10-17 04:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0054_remove_historicalrefund_refund_id_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='refundtransaction',
+            name='error_code',
+            field=models.CharField(blank=True, max_length=253, null=True, verbose_name='Error code'),
+        ),
+    ]
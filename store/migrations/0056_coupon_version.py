@@ -0,0 +1,23 @@
+# Generated by Django 5.2.14 on 2026-10-17 04:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0055_refundtransaction_error_code'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='coupon',
+            name='version',
+            field=models.PositiveIntegerField(default=0, verbose_name='Version'),
+        ),
+        migrations.AddField(
+            model_name='historicalcoupon',
+            name='version',
+            field=models.PositiveIntegerField(default=0, verbose_name='Version'),
+        ),
+    ]
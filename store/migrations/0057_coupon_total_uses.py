@@ -0,0 +1,47 @@
+# Generated by Django 5.2.14 on 2026-10-17 04:42
+
+from django.db import migrations, models
+from django.db.models import Q, Sum
+from django.db.models.functions import Coalesce
+
+
+def compute_total_uses(apps, schema_editor):
+    # We can't import the model directly as it may be a newer
+    # version than this migration expects. We use the historical version.
+    Coupon = apps.get_model('store', 'Coupon')
+
+    coupons = Coupon.objects.annotate(
+        uses=Coalesce(
+            Sum(
+                'coupon_users__uses',
+                filter=Q(coupon_users__deleted__isnull=True),
+            ),
+            0,
+        ),
+    ).filter(uses__gt=0)
+    for coupon in coupons:
+        Coupon.objects.filter(pk=coupon.pk).update(total_uses=coupon.uses)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0056_coupon_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='coupon',
+            name='total_uses',
+            field=models.PositiveIntegerField(default=0, verbose_name='Total uses'),
+        ),
+        migrations.AddField(
+            model_name='historicalcoupon',
+            name='total_uses',
+            field=models.PositiveIntegerField(default=0, verbose_name='Total uses'),
+        ),
+        migrations.RunPython(
+            compute_total_uses,
+            migrations.RunPython.noop,
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.14 on 2026-10-17 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0057_coupon_total_uses'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='status',
+            field=models.CharField(choices=[('PENDING', 'Pending'), ('PAID', 'Paid')], default='PAID', max_length=100, verbose_name='Status'),
+        ),
+        migrations.AddField(
+            model_name='historicalorder',
+            name='status',
+            field=models.CharField(choices=[('PENDING', 'Pending'), ('PAID', 'Paid')], default='PAID', max_length=100, verbose_name='Status'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='pending_checkout',
+            field=models.JSONField(blank=True, null=True, verbose_name='Pending checkout'),
+        ),
+        migrations.AddField(
+            model_name='historicalorder',
+            name='pending_checkout',
+            field=models.JSONField(blank=True, null=True, verbose_name='Pending checkout'),
+        ),
+    ]
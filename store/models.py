@@ -3,13 +3,16 @@ import random
 import string
 from datetime import datetime
 from decimal import Decimal
-from blitz_api.services import send_email_from_template_id
+from blitz_api.services import (
+    queue_email_messages,
+    send_email_from_template_id,
+)
 from babel.dates import format_date
 import pytz
 from itertools import chain
 
 from django.db import models
-from django.db.models import Sum
+from django.db.models import F, Sum
 from django.utils.translation import gettext_lazy as _
 from django.conf import settings
 from django.contrib.auth import get_user_model
@@ -17,7 +20,7 @@ from django.contrib.contenttypes.fields import (
     GenericForeignKey,
     GenericRelation,
 )
-from django.core.mail import send_mail
+from django.core.mail import EmailMultiAlternatives
 from django.contrib.contenttypes.models import ContentType
 from django.template.loader import render_to_string
 from safedelete.models import SafeDeleteModel
@@ -25,7 +28,6 @@ from simple_history.models import HistoricalRecords
 from blitz_api.models import AcademicLevel, Organization, Affiliation
 from modeltranslation.manager import MultilingualManager
 from model_utils.managers import InheritanceManagerMixin
-from log_management.models import Log, EmailLog
 
 User = get_user_model()
 
@@ -46,6 +48,14 @@ class TranslatedInheritanceManager(InheritanceManagerMixin, MultilingualManager)
 class Order(models.Model):
     """Represents a transaction."""
 
+    STATUS_PENDING = 'PENDING'
+    STATUS_PAID = 'PAID'
+
+    STATUS_CHOICES = (
+        (STATUS_PENDING, _('Pending')),
+        (STATUS_PAID, _('Paid')),
+    )
+
     class Meta:
         verbose_name = _("Order")
         verbose_name_plural = _("Orders")
@@ -83,6 +93,23 @@ class Order(models.Model):
         default=False
     )
 
+    # An order is pending while its charge is sent to Paysafe. What it
+    # grants to the user is only given once it is paid.
+    status = models.CharField(
+        max_length=100,
+        choices=STATUS_CHOICES,
+        default=STATUS_PAID,
+        verbose_name=_("Status"),
+    )
+
+    # Ids of what the checkout reserved and of what the order grants once
+    # paid, cleared when the order is completed.
+    pending_checkout = models.JSONField(
+        verbose_name=_("Pending checkout"),
+        null=True,
+        blank=True,
+    )
+
     history = HistoricalRecords()
 
     @property
@@ -129,38 +156,37 @@ class Order(models.Model):
         plain_msg = render_to_string("invoice.txt", merge_data)
         msg_html = render_to_string("invoice.html", merge_data)
 
-        try:
-            response_send_mail = send_mail(
-                "Confirmation d'achat",
-                plain_msg,
-                settings.DEFAULT_FROM_EMAIL,
-                to,
-                html_message=msg_html,
-            )
-
-            EmailLog.add(to, 'INVOICE', response_send_mail)
-        except Exception as err:
-            additional_data = {
-                'title': "Confirmation d'achat",
-                'default_from': settings.DEFAULT_FROM_EMAIL,
-                'user_email': to,
-                'merge_data': merge_data,
-                'template': 'invoice'
-            }
-            Log.error(
-                source='SENDING_BLUE_TEMPLATE',
-                message=err,
-                additional_data=json.dumps(additional_data)
-            )
-            raise
+        # Sent from the outbox once the order is committed
+        message = EmailMultiAlternatives(
+            "Confirmation d'achat",
+            plain_msg,
+            settings.DEFAULT_FROM_EMAIL,
+            to,
+        )
+        message.attach_alternative(msg_html, 'text/html')
+        queue_email_messages([message], 'INVOICE')
 
     def applying_coupon(self, coupon, user):
         from store.services import validate_coupon_for_order
         coupon_info = validate_coupon_for_order(coupon, self)
         if coupon_info['valid_use']:
-            coupon_user = CouponUser.objects.get(
+            # The counter is only incremented if the coupon still has uses
+            # left, concurrent checkouts can't exceed its maximum use.
+            coupons = Coupon.objects.filter(pk=coupon.pk)
+            if coupon.max_use:
+                coupons = coupons.filter(total_uses__lt=F('max_use'))
+            if not coupons.update(total_uses=F('total_uses') + 1):
+                error = {
+                    'non_field_errors': [_(
+                        "Maximum number of uses exceeded for this coupon."
+                    )]
+                }
+                return False, error, None
+
+            coupon_user, created = CouponUser.objects.get_or_create(
                 user=user,
                 coupon=coupon,
+                defaults={'uses': 0},
             )
             coupon_user.uses = coupon_user.uses + 1
             coupon_user.save()
@@ -390,47 +416,9 @@ class Refund(SafeDeleteModel):
             return self.REFUND_STATE_NOT_REFUNDED
 
     def process_automatic_refund(self):
-        amount_to_process = self.remaining_amount_to_refund()
+        from store.services import process_automatic_refunds
+        process_automatic_refunds([self])
 
-        try:
-            refund_response = refund_amount(
-                self.orderline.order.settlement_id,
-                amount_to_process
-            )
-            refund_res_content = refund_response.json()
-
-            RefundTransaction.objects.create(
-                refund=self,
-                amount=amount_to_process,
-                transaction_date=timezone.now(),
-                transaction_id=refund_res_content['id'],
-                is_successful=True,
-            )
-        except PaymentAPIError as err:
-            error_message = str(err.detail)
-
-            if str(err) == PAYSAFE_EXCEPTION['3406']:
-                error_message = "The order has not been charged yet. Try again later." + str(err.detail)
-
-            if str(err) == PAYSAFE_EXCEPTION['3404']:
-                error_message = "The order has already been refunded by Paysafe." + str(err.detail)
-                
-            RefundTransaction.objects.create(
-                refund=self,
-                amount=amount_to_process,
-                transaction_date=timezone.now(),
-                transaction_id=None,
-                is_successful=False,
-                details=error_message
-            )
-        except Exception:
-            RefundTransaction.objects.create(
-                refund=self,
-                amount=amount_to_process,
-                transaction_date=timezone.now(),
-                transaction_id=None,
-                is_successful=False,
-            )
 
 class RefundTransaction(SafeDeleteModel):
     
@@ -471,6 +459,13 @@ class RefundTransaction(SafeDeleteModel):
         verbose_name=_("Is successful"),
     )
 
+    error_code = models.CharField(
+        verbose_name=_("Error code"),
+        max_length=253,
+        null=True,
+        blank=True,
+    )
+
 class BaseProduct(models.Model, ProductDisplayMixin):
     objects = TranslatedInheritanceManager()
 
@@ -537,17 +532,38 @@ class BaseProduct(models.Model, ProductDisplayMixin):
 
     @property
     def options(self):
+        # List serializers give the options of the product type once for
+        # the whole page and list querysets prefetch the other options with
+        # select_subclasses().
+        if hasattr(self, 'product_type_options'):
+            product_types_options = [
+                option for option in self.product_type_options
+                if option.id != self.id
+            ]
+        else:
+            product_types_options = ContentType.objects. \
+                get_for_model(self) \
+                .products.exclude(id=self.id).select_subclasses()
 
-        product_types_options = ContentType.objects. \
-            get_for_model(self) \
-            .products.exclude(id=self.id).select_subclasses()
-        products_options = self.option_products.all().select_subclasses()
+        prefetched_objects = getattr(self, '_prefetched_objects_cache', {})
+        if 'option_products' in prefetched_objects:
+            products_options = self.option_products.all()
+        else:
+            products_options = self.option_products.all().select_subclasses()
         options = chain(product_types_options, products_options)
         if self.__class__.__name__ == 'Retreat':
             retreat_type = self.type
-            retreat_type_options = OptionProduct.objects.filter(
-                available_on_retreat_types=retreat_type,
-            )
+            if 'option_retreat_types' in getattr(
+                    retreat_type, '_prefetched_objects_cache', {}):
+                retreat_type_options = [
+                    option for option in
+                    retreat_type.option_retreat_types.all()
+                    if isinstance(option, OptionProduct)
+                ]
+            else:
+                retreat_type_options = OptionProduct.objects.filter(
+                    available_on_retreat_types=retreat_type,
+                )
             options = chain(options, retreat_type_options)
         return list(options)
 
@@ -997,11 +1013,38 @@ class Coupon(AbstractCoupon):
         through='CouponUser',
     )
 
+    # Incremented each time the products to which the coupon applies change,
+    # see store.signals. It is used to cache the coupon applicability.
+    version = models.PositiveIntegerField(
+        verbose_name=_("Version"),
+        default=0,
+    )
+
+    # Sum of the uses of all CouponUser of the coupon. It is kept up to date
+    # with atomic increments so the maximum number of uses can be checked
+    # without scanning the uses, see the reconcile_coupon_uses command.
+    total_uses = models.PositiveIntegerField(
+        verbose_name=_("Total uses"),
+        default=0,
+    )
+
     history = HistoricalRecords()
 
     def __str__(self):
         return self.code
 
+    def save(self, *args, **kwargs):
+        # total_uses and version are only changed with atomic updates, saving
+        # an instance loaded before a checkout or a change of the applicable
+        # products must not overwrite the new values.
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in ('total_uses', 'version')
+            ]
+        return super(Coupon, self).save(*args, **kwargs)
+
     def generate_code(self):
         self.code = ''.join(random.choices(
             string.ascii_uppercase.replace("O", "") +
@@ -219,8 +219,7 @@ class CouponResource(resources.ModelResource):
     total_use = fields.Field()
 
     def dehydrate_total_use(self, coupon):
-        uses = CouponUser.objects.filter(coupon=coupon)
-        return sum(uses.values_list('uses', flat=True))
+        return coupon.total_uses
 
     class Meta:
         model = Coupon
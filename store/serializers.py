@@ -33,7 +33,6 @@ from blitz_api.services import (
     getMessageTranslate,
 )
 from log_management.models import Log, EmailLog
-from retirement.services import send_retreat_confirmation_email
 from workplace.models import Reservation
 from retirement.models import (
     Reservation as RetreatReservation,
@@ -57,16 +56,19 @@ from store.models import (
     CouponUser, 
     Refund,
     RefundTransaction,
-    MembershipCoupon, 
     OptionProduct, 
     OrderLineBaseProduct
 )
 
 from store.services import (
     charge_payment,
+    complete_pending_order,
     create_external_payment_profile,
     create_external_card,
     get_external_cards,
+    get_coupon_usages,
+    release_pending_order,
+    send_order_emails,
     PAYSAFE_CARD_TYPE, 
 )
 
@@ -82,7 +84,8 @@ class BaseProductManagerSerializer(serializers.HyperlinkedModelSerializer):
 
     def to_representation(self, instance):
 
-        instance = BaseProduct.objects.get_subclass(id=instance.id)
+        if type(instance) is BaseProduct:
+            instance = BaseProduct.objects.get_subclass(id=instance.id)
 
         if isinstance(instance, Retreat):
             from retirement.serializers import RetreatSerializer
@@ -137,8 +140,9 @@ class SimpleBaseProductSerializer(serializers.HyperlinkedModelSerializer):
     product_type = serializers.SerializerMethodField()
 
     def get_product_type(self, obj):
-        return BaseProduct.objects.get_subclass(id=obj.id). \
-            __class__.__name__.lower()
+        if type(obj) is BaseProduct:
+            obj = BaseProduct.objects.get_subclass(id=obj.id)
+        return obj.__class__.__name__.lower()
 
     class Meta:
         model = BaseProduct
@@ -198,8 +202,7 @@ class BaseProductSerializer(serializers.HyperlinkedModelSerializer):
         data = super(BaseProductSerializer, self).to_representation(instance)
         if not user.is_staff:
             data = remove_translation_fields(data)
-        products = BaseProduct.objects.filter(
-            pk__in=data['available_on_products'])
+        products = instance.available_on_products.all()
         data['available_on_products'] = SimpleBaseProductSerializer(
             products,
             many=True).data
@@ -615,7 +618,6 @@ class OrderSerializer(serializers.HyperlinkedModelSerializer):
         validated_data['user'] = user
         profile = PaymentProfile.objects.filter(owner=user).first()
 
-        retreat_reservations = list()
         new_membership = None
 
         if single_use_token and not profile:
@@ -640,6 +642,27 @@ class OrderSerializer(serializers.HyperlinkedModelSerializer):
                 )
             )
 
+        # What the checkout reserves and what the order grants once paid.
+        # It is kept on the order until then, so the order can be completed
+        # or released even if the outcome of the charge is unknown.
+        checkout = {
+            'tickets': 0,
+            'membership': None,
+            'membership_end': None,
+            'coupon': None,
+            'discount': '0',
+            'timeslot_reservations': list(),
+            'retreat_reservations': list(),
+            'reserved_retreats': list(),
+            'send_invoice': False,
+        }
+        initial_tickets = user.tickets
+
+        # Phase 1: reserve the inventory and record a pending order.
+        # This transaction only contains local work so that no lock is held
+        # while waiting for the payment API. The user is only modified in
+        # memory: the membership and the tickets bought are granted once the
+        # order is paid, see phase 3.
         with transaction.atomic():
             coupon = validated_data.pop('coupon', None)
             order = Order.objects.create(**validated_data)
@@ -656,9 +679,10 @@ class OrderSerializer(serializers.HyperlinkedModelSerializer):
                     order.applying_coupon(coupon, user)
                 if not coupon_valid_use:
                     raise serializers.ValidationError(error)
+                checkout['coupon'] = coupon.pk
+                checkout['discount'] = str(discount_amount)
 
             amount = order.total_cost_with_taxes
-            tax = order.taxes
 
             membership_orderlines = order.order_lines.filter(
                 content_type__model="membership"
@@ -698,47 +722,9 @@ class OrderSerializer(serializers.HyperlinkedModelSerializer):
                     user.membership_end = (
                             today + user.membership.duration
                     )
-                user.save()
 
                 new_membership = user.membership
 
-                membership_coupons = MembershipCoupon.objects.filter(
-                    membership__pk=membership_orderlines[0].content_object.pk,
-                ).exclude(
-                    limit_date__lte=timezone.now()
-                )
-
-                for membership_coupon in membership_coupons:
-                    coupon = Coupon.objects.create(
-                        value=membership_coupon.value,
-                        percent_off=membership_coupon.percent_off,
-                        max_use=membership_coupon.max_use,
-                        max_use_per_user=membership_coupon.max_use_per_user,
-                        details=membership_coupon.details,
-                        start_time=timezone.now(),
-                        end_time=timezone.now() + membership_orderlines[
-                            0].content_object.duration,
-                        owner=user,
-                        is_applicable_to_physical_retreat=membership_coupon
-                        .is_applicable_to_physical_retreat,
-                        is_applicable_to_virtual_retreat=membership_coupon
-                        .is_applicable_to_virtual_retreat,
-                    )
-                    coupon.applicable_retreats.set(
-                        membership_coupon.applicable_retreats.all())
-                    coupon.applicable_retreat_types.set(
-                        membership_coupon.applicable_retreat_types.all())
-                    coupon.applicable_timeslots.set(
-                        membership_coupon.applicable_timeslots.all())
-                    coupon.applicable_packages.set(
-                        membership_coupon.applicable_packages.all())
-                    coupon.applicable_memberships.set(
-                        membership_coupon.applicable_memberships.all())
-                    coupon.applicable_product_types.set(
-                        membership_coupon.applicable_product_types.all())
-                    coupon.generate_code()
-                    coupon.save()
-
             if package_orderlines:
                 need_transaction = True
                 for package_orderline in package_orderlines:
@@ -761,7 +747,6 @@ class OrderSerializer(serializers.HyperlinkedModelSerializer):
                                 package_orderline.content_object.reservations *
                                 package_orderline.quantity
                         )
-                        user.save()
             if reservation_orderlines:
                 for reservation_orderline in reservation_orderlines:
                     timeslot = reservation_orderline.content_object
@@ -784,10 +769,12 @@ class OrderSerializer(serializers.HyperlinkedModelSerializer):
                         })
                     if (timeslot.period.workplace and
                             timeslot.period.workplace.seats - reserved > 0):
-                        Reservation.objects.create(
-                            user=user,
-                            timeslot=timeslot,
-                            is_active=True
+                        checkout['timeslot_reservations'].append(
+                            Reservation.objects.create(
+                                user=user,
+                                timeslot=timeslot,
+                                is_active=True
+                            ).pk
                         )
                         # Decrement user tickets for each reservation.
                         # OrderLine's quantity and TimeSlot's price will be
@@ -795,7 +782,6 @@ class OrderSerializer(serializers.HyperlinkedModelSerializer):
                         # reservations of the same timeslot.
                         if not bypass_payment:
                             user.tickets -= 1
-                            user.save()
                     else:
                         raise serializers.ValidationError({
                             'non_field_errors': [_(
@@ -830,7 +816,6 @@ class OrderSerializer(serializers.HyperlinkedModelSerializer):
                             ],
                         })
 
-                    user_waiting = retreat.wait_queue.filter(user=user)
                     reservations = retreat.reservations.filter(
                         is_active=True
                     )
@@ -882,11 +867,13 @@ class OrderSerializer(serializers.HyperlinkedModelSerializer):
                             new_retreat_reservation.invitation = invitation
                             new_retreat_reservation.save()
 
-                        retreat_reservations.append(
-                            new_retreat_reservation
+                        checkout['retreat_reservations'].append(
+                            new_retreat_reservation.pk
                         )
 
-                        retreat.check_and_use_reserved_place(user)
+                        # The reserved wait queue place is only consumed
+                        # once the order is paid, see phase 3.
+                        checkout['reserved_retreats'].append(retreat.pk)
 
                     else:
                         raise serializers.ValidationError({
@@ -895,45 +882,16 @@ class OrderSerializer(serializers.HyperlinkedModelSerializer):
                                 "retreat."
                             )]
                         })
-                    if user_waiting:
-                        user_waiting.delete()
 
             # Overwrite transaction depending on bypass_payment
             need_transaction = need_transaction and not bypass_payment
-            if need_transaction and payment_token and int(amount):
-                # Charge the order with the external payment API
-                try:
-                    charge_response = charge_payment(
-                        int(round(amount)),
-                        payment_token,
-                        str(order.id)
-                    )
-                except PaymentAPIError as err:
-                    raise serializers.ValidationError({
-                        'non_field_errors': [err],
-                        'detail': err.detail
-                    })
-
-            elif need_transaction and single_use_token and int(amount):
-                # Add card to the external profile & charge user
-                try:
-                    card_create_response = create_external_card(
-                        profile.external_api_id,
-                        single_use_token
-                    )
-                    charge_response = charge_payment(
-                        int(round(amount)),
-                        card_create_response.json()['paymentToken'],
-                        str(order.id)
-                    )
-                except PaymentAPIError as err:
-                    raise serializers.ValidationError({
-                        'non_field_errors': [err],
-                        'detail': err.detail
-                    })
-            elif (membership_orderlines
-                  or package_orderlines
-                  or retreat_orderlines) and int(amount) and need_transaction:
+            need_charge = need_transaction and int(amount) and (
+                payment_token or single_use_token
+            )
+            if (membership_orderlines
+                    or package_orderlines
+                    or retreat_orderlines) and int(amount) and \
+                    need_transaction and not need_charge:
                 raise serializers.ValidationError({
                     'non_field_errors': [_(
                         "A payment_token or single_use_token is required to "
@@ -941,97 +899,81 @@ class OrderSerializer(serializers.HyperlinkedModelSerializer):
                     )]
                 })
 
-            if need_transaction:
-                if charge_response:
-                    charge_res_content = charge_response.json()
-                    order.authorization_id = charge_res_content['id']
-                    order.settlement_id = charge_res_content['settlements'][0][
-                        'id'
-                    ]
-                    order.reference_number = charge_res_content[
-                        'merchantRefNum'
-                    ]
-                else:
-                    charge_res_content = {
-                        'card': {
-                            'lastDigits': None,
-                            'type': "NONE"
-                        }
-                    }
-                    order.authorization_id = 0
-                    order.settlement_id = 0
-                    order.reference_number = "charge-" + str(uuid.uuid4())
-                order.save()
+            checkout['tickets'] = (user.tickets or 0) - (initial_tickets or 0)
+            if new_membership:
+                checkout['membership'] = new_membership.pk
+                checkout['membership_end'] = user.membership_end.isoformat()
+            checkout['send_invoice'] = need_transaction
+
+            # The tickets spent are taken now, the tickets bought are only
+            # given once the order is paid.
+            if checkout['tickets'] < 0:
+                User.objects.filter(pk=user.pk).update(
+                    tickets=models.F('tickets') + checkout['tickets'],
+                )
 
-        if need_transaction:
-            # Send order email
-            orderlines = order.order_lines.filter(
-                models.Q(content_type__model='membership') |
-                models.Q(content_type__model='package') |
-                models.Q(content_type__model='retreat')
-            )
+            order.pending_checkout = checkout
+            if need_charge:
+                order.status = Order.STATUS_PENDING
+                # The merchant reference is the idempotency key of the
+                # order: the payment API refuses a second charge using it.
+                order.reference_number = "charge-" + str(uuid.uuid4())
+            order.save()
 
-            # Here, the 'details' key is used to provide details of the
-            #  item to the email template.
-            # As of now, only 'retreat' objects have the 'email_content'
-            #  key that is used here. There is surely a better way
-            #  to handle that logic that will be more generic.
-            items = [
-                {
-                    'price': order_line.content_object.price,
-                    'name': "{0}: {1}".format(
-                        order_line.content_object.get_product_display_type,
-                        order_line.content_object.name
-                    ),
-                    'options': [
-                        {
-                            'price': opt.option.price * opt.quantity,
-                            'name': f'{opt.option.name} (x{opt.quantity})',
-                        } for opt in OrderLineBaseProduct.objects.filter(
-                            order_line=order_line)
+        # Phase 2: charge the order outside of any database transaction.
+        if need_charge:
+            try:
+                if payment_token:
+                    charge_token = payment_token
+                else:
+                    # Add card to the external profile
+                    card_create_response = create_external_card(
+                        profile.external_api_id,
+                        single_use_token
+                    )
+                    charge_token = card_create_response.json()[
+                        'paymentToken'
                     ]
+                # Charge the order with the external payment API
+                charge_response = charge_payment(
+                    int(round(amount)),
+                    charge_token,
+                    str(order.id),
+                    merchant_ref_num=order.reference_number,
+                )
+            except PaymentAPIError as err:
+                release_pending_order(order)
+                raise serializers.ValidationError({
+                    'non_field_errors': [err],
+                    'detail': err.detail
+                })
+            except Exception as err:
+                # The outcome of the charge is unknown: the order stays
+                # pending, without granting anything, until the
+                # reconcile_pending_orders task finds its charge with its
+                # merchant reference and completes it, or releases it.
+                Log.error(
+                    source='CHECKOUT',
+                    message=err,
+                    additional_data=json.dumps({
+                        'order_id': order.id,
+                        'reference_number': order.reference_number,
+                    })
+                )
+                raise
 
-                    # Removed details section because it was only used
-                    # for retreats. Retreats instead have another
-                    # unique email containing details of the event.
-                    # 'details':
-                    #    order_line.content_object.email_content if hasattr(
-                    #         order_line.content_object, 'email_content'
-                    #     ) else ""
-                } for order_line in orderlines
-            ]
-
-            # Send order confirmation email
-            merge_data = {
-                'STATUS': "APPROUVÉE",
-                'CARD_NUMBER': charge_res_content['card']['lastDigits'],
-                'CARD_TYPE': PAYSAFE_CARD_TYPE[
-                    charge_res_content['card']['type']
-                ],
-                'DATETIME': timezone.localtime().strftime("%x %X"),
-                'ORDER_ID': order.id,
-                'CUSTOMER_NAME': user.first_name + " " + user.last_name,
-                'CUSTOMER_EMAIL': user.email,
-                'CUSTOMER_NUMBER': user.id,
-                'AUTHORIZATION': order.authorization_id,
-                'TYPE': "Achat",
-                'ITEM_LIST': items,
-                'TAX': tax,
-                'DISCOUNT': discount_amount,
-                'COUPON': coupon,
-                'SUBTOTAL': round(amount / 100 - tax, 2),
-                'COST': round(amount / 100, 2),
-            }
-
-            Order.send_invoice([order.user.email], merge_data)
-
-        # Send retreat informations emails
-        for retreat_reservation in retreat_reservations:
-            send_retreat_confirmation_email(user, retreat_reservation.retreat)
+        # Phase 3: complete the paid order.
+        charge = None
+        if charge_response:
+            charge = charge_response.json()
+        elif need_transaction:
+            order.authorization_id = 0
+            order.settlement_id = 0
+            order.reference_number = "charge-" + str(uuid.uuid4())
 
-        # Send welcome email membership
-        if new_membership:
-            new_membership.send_welcome_email(user)
+        checkout = complete_pending_order(order, charge)
+        if checkout:
+            send_order_emails(order, checkout, charge)
 
         return order
 
@@ -1072,6 +1014,20 @@ class OrderSerializer(serializers.HyperlinkedModelSerializer):
         return data
 
 
+class CouponListSerializer(serializers.ListSerializer):
+    """
+    Gathers the usages of all the coupons of the list at once, instead of
+    coupon by coupon.
+    """
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.Manager) else data
+        coupons = list(iterable)
+        if self.child.display_usages():
+            self.context['coupon_usages'] = get_coupon_usages(coupons)
+        return super(CouponListSerializer, self).to_representation(coupons)
+
+
 class CouponSerializer(serializers.HyperlinkedModelSerializer):
     id = serializers.ReadOnlyField()
     applicable_product_types = serializers.SlugRelatedField(
@@ -1204,6 +1160,18 @@ class CouponSerializer(serializers.HyperlinkedModelSerializer):
 
         return super(CouponSerializer, self).update(instance, validated_data)
 
+    def display_usages(self):
+        """
+        Usages are always displayed on a single coupon, but they are only
+        displayed on a list of coupons if asked with include_usages=true.
+        """
+        action = self.context['view'].action
+        if action == 'list':
+            include_usages = self.context['request'].query_params.get(
+                'include_usages', '')
+            return include_usages.lower() in ['true', '1']
+        return action == 'retrieve'
+
     def get_coupon_usage(self, instance):
         """
         Get coupon usage per order, listing elements for frontend
@@ -1212,73 +1180,48 @@ class CouponSerializer(serializers.HyperlinkedModelSerializer):
             OrganizationSerializer,
             ReservationUserSerializer,
         )
-        usages_per_order = {}
-        for line in OrderLine.objects.filter(coupon=instance):
-            refunds = Refund.objects.filter(orderline=line)
-            is_refunded = refunds.exists()
-            
-            # Sometimes, we have a cancellation, but since the price was 0 (due to the coupon) we don't have a refund
-            # This allow to not display these lines
-            is_canceled = False
-            cancellations = RetreatReservation.objects.filter(order_line=line, is_active=False)
-            if line.content_type.model == 'retreat':
-                is_canceled = cancellations.exists()
-    
-            cancellation_reason = []
-            for refund in refunds:
-                if refund.details:
-                    cancellation_reason.append(refund.details)
-            for cancellation in cancellations:
-                if cancellation.cancelation_reason:
-                    cancellation_reason.append(cancellation.cancelation_reason)
-            cancellation_reason = ', '.join(cancellation_reason)
-                
-            amount_used = line.coupon_real_value if not (is_refunded or is_canceled) else 0
-            
-            if line.order.id not in usages_per_order:
-                usages_per_order[line.order.id] = {
-                    'date': line.order.transaction_date,
-                    'user': ReservationUserSerializer(
-                        line.order.user,
-                        context={
-                            'request': self.context['request'],
-                            'view': self.context['view'],
-                        },
-                    ).data,
-                    'amount_used': amount_used,
-                    'user_university': OrganizationSerializer(
-                        line.order.user.university,
-                        context={
-                            'request': self.context['request'],
-                            'view': self.context['view'],
-                        },
-                    ).data,
-                    'product_name': set(),
-                    'orderlines': [
-                        {
-                            'amount_used': line.coupon_real_value,
-                            'is_refunded': is_refunded or is_canceled,
-                            'cancellation_reason': cancellation_reason,
-                        }
-                    ]
-                }
-                usages_per_order[line.order.id]['product_name'].add(
-                    line.content_object.name)
-            else:
-                usages_per_order[line.order.id]['amount_used'] += amount_used
-                usages_per_order[line.order.id]['product_name'].add(
-                        line.content_object.name
-                    )
-                usages_per_order[line.order.id]['orderlines'].append({
-                    'amount_used': line.coupon_real_value,
-                    'is_refunded': is_refunded or is_canceled,
-                    'cancellation_reason': cancellation_reason,
-                })
+        coupon_usages = self.context.get('coupon_usages')
+        if coupon_usages is None or instance.id not in coupon_usages:
+            coupon_usages = get_coupon_usages([instance])
 
+        # A user often uses a coupon in many orders, we serialize it once
+        users = {}
+        universities = {}
         display_usages = []
-        for key, value in usages_per_order.items():
-            value['product_name'] = ', '.join(list(sorted(value['product_name'])))
-            display_usages.append(value)
+        for usage in coupon_usages[instance.id]:
+            user = usage['user']
+            if user.id not in users:
+                users[user.id] = ReservationUserSerializer(
+                    user,
+                    context={
+                        'request': self.context['request'],
+                        'view': self.context['view'],
+                    },
+                ).data
+            if user.university_id not in universities:
+                universities[user.university_id] = OrganizationSerializer(
+                    user.university,
+                    context={
+                        'request': self.context['request'],
+                        'view': self.context['view'],
+                    },
+                ).data
+
+            display_usages.append({
+                'date': usage['order'].transaction_date,
+                'user': users[user.id],
+                'amount_used': usage['amount_used'],
+                'user_university': universities[user.university_id],
+                'product_name': ', '.join(sorted(usage['product_name'])),
+                'orderlines': [
+                    {
+                        'amount_used': order_line['amount_used'],
+                        'is_refunded': order_line['is_refunded'],
+                        'cancellation_reason':
+                            order_line['cancellation_reason'],
+                    } for order_line in usage['orderlines']
+                ],
+            })
         return display_usages
 
     def to_representation(self, instance):
@@ -1293,8 +1236,9 @@ class CouponSerializer(serializers.HyperlinkedModelSerializer):
             RetreatTypeSerializer,
         )
         action = self.context['view'].action
-        if action == 'retrieve' or action == 'list':
+        if self.display_usages():
             data['usages'] = self.get_coupon_usage(instance)
+        if action == 'retrieve' or action == 'list':
             data['applicable_retreats'] = RetreatSerializer(
                 instance.applicable_retreats,
                 many=True,
@@ -1355,7 +1299,9 @@ class CouponSerializer(serializers.HyperlinkedModelSerializer):
 
     class Meta:
         model = Coupon
-        exclude = ('deleted', 'deleted_by_cascade')
+        list_serializer_class = CouponListSerializer
+        exclude = ('deleted', 'deleted_by_cascade', 'version',
+                   'total_uses')
         extra_kwargs = {
             'applicable_retreats': {
                 'required': False,
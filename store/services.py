@@ -1,23 +1,46 @@
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
 from decimal import Decimal
+import hashlib
 import json
+import logging
 import random
 import requests
+import time
 import uuid
 
 from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 from django.core.mail import send_mail
-from django.db.models import Q
+from django.db import connection, transaction
+from django.db.models import Count, F, Max, Q, Sum, Value
+from django.db.models.functions import Coalesce
 from django.template.loader import render_to_string
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
+from safedelete.config import HARD_DELETE
 
 from log_management.models import Log, EmailLog
 from .exceptions import PaymentAPIError
 from .models import (
+    Coupon,
     CouponUser,
+    Membership,
+    MembershipCoupon,
+    Order,
     OrderLine,
+    OrderLineBaseProduct,
+    Refund,
+    RefundTransaction,
 )
 
+User = get_user_model()
+
+logger = logging.getLogger(__name__)
+
 
 ###############################################################################
 #                         PAYSAFE RELATED SERVICES                            #
@@ -100,6 +123,99 @@ PAYSAFE_CARD_TYPE = {
 }
 
 
+# Transient answers of Paysafe after which an idempotent call can be retried
+PAYSAFE_RETRY_STATUS = (502, 503, 504)
+PAYSAFE_IDEMPOTENT_METHODS = ('GET', 'PUT', 'DELETE')
+
+
+class PaysafeClient:
+    """
+    HTTP client shared by every call made to Paysafe.
+
+    It keeps a pool of keep-alive connections, applies the configured
+    connect/read timeouts, retries idempotent calls with an exponential
+    backoff and jitter when Paysafe is unreachable or temporarily
+    unavailable, and logs the latency of each call.
+
+    The configuration is read from settings.PAYSAFE on each call so it
+    follows settings overrides.
+    """
+
+    def __init__(self):
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=settings.PAYSAFE.get('POOL_SIZE', 10),
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def request(self, method, url, operation, **kwargs):
+        config = settings.PAYSAFE
+        timeout = (
+            config.get('CONNECT_TIMEOUT', 5),
+            config.get('READ_TIMEOUT', 30),
+        )
+        max_retries = 0
+        if method in PAYSAFE_IDEMPOTENT_METHODS:
+            max_retries = config.get('MAX_RETRIES', 2)
+
+        attempt = 0
+        while True:
+            start = time.monotonic()
+            try:
+                response = self.session.request(
+                    method,
+                    url,
+                    auth=(config['USER'], config['PASSWORD']),
+                    timeout=timeout,
+                    **kwargs
+                )
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout) as err:
+                self.record_call(operation, start, attempt, repr(err))
+                if attempt >= max_retries:
+                    raise
+            else:
+                self.record_call(
+                    operation, start, attempt, response.status_code)
+                if response.status_code not in PAYSAFE_RETRY_STATUS \
+                        or attempt >= max_retries:
+                    return response
+
+            # Full jitter: wait a random time up to the exponential backoff
+            time.sleep(random.uniform(
+                0,
+                config.get('RETRY_BACKOFF', 0.5) * 2 ** attempt,
+            ))
+            attempt += 1
+
+    def get(self, url, operation, **kwargs):
+        return self.request('GET', url, operation, **kwargs)
+
+    def post(self, url, operation, **kwargs):
+        return self.request('POST', url, operation, **kwargs)
+
+    def put(self, url, operation, **kwargs):
+        return self.request('PUT', url, operation, **kwargs)
+
+    def delete(self, url, operation, **kwargs):
+        return self.request('DELETE', url, operation, **kwargs)
+
+    @staticmethod
+    def record_call(operation, start, attempt, result):
+        logger.info(
+            "Paysafe call %s (attempt %s): %s in %.1f ms",
+            operation,
+            attempt + 1,
+            result,
+            (time.monotonic() - start) * 1000,
+        )
+
+
+paysafe_client = PaysafeClient()
+
+
 def manage_paysafe_error(err, additional_data):
     content_dict = json.loads(err.response.content)
     try:
@@ -132,15 +248,18 @@ def manage_paysafe_error(err, additional_data):
     )
 
 
-def charge_payment(amount, payment_token, reference_number):
+def charge_payment(amount, payment_token, reference_number,
+                   merchant_ref_num=None):
     """
     This method is used to charge an amount to a card represented by the
     payment token.
     This is tigthly coupled with Paysafe for now, but this should be made
     generic in the future to ease migrations to another payment patform.
 
-    order:              Django Order model instance
-    payment_profile:    Django PaymentProfile model instance
+    amount:             Amount to charge, in cents
+    payment_token:      Payment token of the card to charge
+    reference_number:   ID of the order being charged
+    merchant_ref_num:   Idempotency key of the charge, generated if omitted
     """
     auth_url = '{0}{1}{2}{3}'.format(
         settings.PAYSAFE['BASE_URL'],
@@ -149,8 +268,11 @@ def charge_payment(amount, payment_token, reference_number):
         "/auths/",
     )
 
+    if merchant_ref_num is None:
+        merchant_ref_num = "charge-" + str(uuid.uuid4())
+
     data = {
-        "merchantRefNum": "charge-" + str(uuid.uuid4()),
+        "merchantRefNum": merchant_ref_num,
         "amount": amount,
         "settleWithAuth": True,
         "card": {
@@ -159,12 +281,9 @@ def charge_payment(amount, payment_token, reference_number):
     }
 
     try:
-        r = requests.post(
+        r = paysafe_client.post(
             auth_url,
-            auth=(
-                settings.PAYSAFE['USER'],
-                settings.PAYSAFE['PASSWORD'],
-            ),
+            operation='charge_payment',
             json=data,
         )
         r.raise_for_status()
@@ -201,12 +320,9 @@ def refund_amount(settlement_id, amount):
     }
 
     try:
-        r = requests.post(
+        r = paysafe_client.post(
             refund_url,
-            auth=(
-                settings.PAYSAFE['USER'],
-                settings.PAYSAFE['PASSWORD'],
-            ),
+            operation='refund_amount',
             json=data,
         )
         r.raise_for_status()
@@ -243,12 +359,9 @@ def create_external_payment_profile(user):
     }
 
     try:
-        r = requests.post(
+        r = paysafe_client.post(
             create_profile_url,
-            auth=(
-                settings.PAYSAFE['USER'],
-                settings.PAYSAFE['PASSWORD']
-            ),
+            operation='create_external_payment_profile',
             json=data,
         )
         r.raise_for_status()
@@ -276,9 +389,9 @@ def get_external_payment_profile(profile_id):
     )
 
     try:
-        r = requests.get(
+        r = paysafe_client.get(
             get_profile_url,
-            auth=(settings.PAYSAFE['USER'], settings.PAYSAFE['PASSWORD']),
+            operation='get_external_payment_profile',
         )
         r.raise_for_status()
     except requests.exceptions.HTTPError as err:
@@ -311,9 +424,9 @@ def update_external_card(profile_id, card_id, single_use_token):
     }
 
     try:
-        r = requests.put(
+        r = paysafe_client.put(
             put_cards_url,
-            auth=(settings.PAYSAFE['USER'], settings.PAYSAFE['PASSWORD']),
+            operation='update_external_card',
             json=data,
         )
         r.raise_for_status()
@@ -348,9 +461,9 @@ def create_external_card(profile_id, single_use_token):
     }
 
     try:
-        r = requests.post(
+        r = paysafe_client.post(
             post_cards_url,
-            auth=(settings.PAYSAFE['USER'], settings.PAYSAFE['PASSWORD']),
+            operation='create_external_card',
             json=data,
         )
         r.raise_for_status()
@@ -364,12 +477,9 @@ def create_external_card(profile_id, single_use_token):
                 )
                 card_data = json.loads(r.content)
                 delete_external_card(profile_id, card_data['id'])
-                r = requests.post(
+                r = paysafe_client.post(
                     post_cards_url,
-                    auth=(
-                        settings.PAYSAFE['USER'],
-                        settings.PAYSAFE['PASSWORD']
-                    ),
+                    operation='create_external_card',
                     json=data,
                 )
                 r.raise_for_status()
@@ -432,9 +542,9 @@ def get_external_card(card_id):
     )
 
     try:
-        r = requests.get(
+        r = paysafe_client.get(
             get_card_url,
-            auth=(settings.PAYSAFE['USER'], settings.PAYSAFE['PASSWORD']),
+            operation='get_external_card',
         )
         r.raise_for_status()
     except requests.exceptions.HTTPError as err:
@@ -462,9 +572,9 @@ def delete_external_card(profile_id, card_id):
     )
 
     try:
-        r = requests.delete(
+        r = paysafe_client.delete(
             delete_card_url,
-            auth=(settings.PAYSAFE['USER'], settings.PAYSAFE['PASSWORD']),
+            operation='delete_external_card',
         )
         r.raise_for_status()
     except requests.exceptions.HTTPError as err:
@@ -476,15 +586,612 @@ def delete_external_card(profile_id, card_id):
     return r
 
 
+def lookup_card_payments(resource, merchant_ref_num):
+    """
+    This method is used to find the authorizations or the settlements sent
+    to Paysafe with a merchant reference number.
+    This is tigthly coupled with Paysafe for now, but this should be made
+    generic in the future to ease migrations to another payment patform.
+
+    resource:           'auths' or 'settlements'
+    merchant_ref_num:   Merchant reference number of the payment
+    """
+    lookup_url = '{0}{1}{2}{3}'.format(
+        settings.PAYSAFE['BASE_URL'],
+        settings.PAYSAFE['CARD_URL'],
+        "accounts/" + settings.PAYSAFE['ACCOUNT_NUMBER'],
+        "/" + resource,
+    )
+
+    try:
+        r = paysafe_client.get(
+            lookup_url,
+            operation='lookup_' + resource,
+            params={'merchantRefNum': merchant_ref_num},
+        )
+        # Paysafe answers a 404 when nothing uses this reference
+        if r.status_code == 404:
+            return []
+        r.raise_for_status()
+    except requests.exceptions.HTTPError as err:
+        manage_paysafe_error(err, {
+            'resource': resource,
+            'merchant_ref_num': merchant_ref_num,
+        })
+
+    return r.json().get(resource, [])
+
+
+###############################################################################
+#                           ORDER CHECKOUT SERVICES                           #
+###############################################################################
+
+# Paysafe status of the authorizations that will never be charged
+PAYSAFE_UNCHARGED_STATUS = ('FAILED', 'CANCELLED')
+
+
+def create_membership_coupons(user, membership):
+    """
+    Gives the user a copy of each coupon offered with the membership.
+    """
+    membership_coupons = MembershipCoupon.objects.filter(
+        membership__pk=membership.pk,
+    ).exclude(
+        limit_date__lte=timezone.now()
+    )
+
+    for membership_coupon in membership_coupons:
+        new_coupon = Coupon.objects.create(
+            value=membership_coupon.value,
+            percent_off=membership_coupon.percent_off,
+            max_use=membership_coupon.max_use,
+            max_use_per_user=membership_coupon.max_use_per_user,
+            details=membership_coupon.details,
+            start_time=timezone.now(),
+            end_time=timezone.now() + membership.duration,
+            owner=user,
+            is_applicable_to_physical_retreat=membership_coupon
+            .is_applicable_to_physical_retreat,
+            is_applicable_to_virtual_retreat=membership_coupon
+            .is_applicable_to_virtual_retreat,
+        )
+        new_coupon.applicable_retreats.set(
+            membership_coupon.applicable_retreats.all())
+        new_coupon.applicable_retreat_types.set(
+            membership_coupon.applicable_retreat_types.all())
+        new_coupon.applicable_timeslots.set(
+            membership_coupon.applicable_timeslots.all())
+        new_coupon.applicable_packages.set(
+            membership_coupon.applicable_packages.all())
+        new_coupon.applicable_memberships.set(
+            membership_coupon.applicable_memberships.all())
+        new_coupon.applicable_product_types.set(
+            membership_coupon.applicable_product_types.all())
+        new_coupon.generate_code()
+        new_coupon.save()
+
+
+def get_locked_pending_checkout(order):
+    """
+    Locks the order until the end of the transaction and returns its pending
+    checkout, or None if the order was already completed or released.
+    """
+    return Order.objects.select_for_update().filter(
+        pk=order.pk,
+    ).values_list('pending_checkout', flat=True).first()
+
+
+def complete_pending_order(order, charge=None):
+    """
+    Gives the user what the order grants once paid: the membership and its
+    coupons, the tickets bought and the wait queue places reserved for its
+    retreats. Records the charge of the order when given.
+
+    Returns the checkout of the order, or None if it was already completed
+    or released.
+
+    order:  Order reserved by the checkout
+    charge: Content of the Paysafe authorization that paid the order
+    """
+    from retirement.models import Retreat
+
+    with transaction.atomic():
+        checkout = get_locked_pending_checkout(order)
+        if checkout is None:
+            return None
+
+        user = order.user
+        if checkout['tickets'] > 0:
+            User.objects.filter(pk=user.pk).update(
+                tickets=F('tickets') + checkout['tickets'],
+            )
+        if checkout['membership']:
+            membership = Membership.objects.get(pk=checkout['membership'])
+            User.objects.filter(pk=user.pk).update(
+                membership=membership,
+                membership_end=date.fromisoformat(
+                    checkout['membership_end']
+                ),
+            )
+            create_membership_coupons(user, membership)
+        user.refresh_from_db(
+            fields=['tickets', 'membership', 'membership_end']
+        )
+
+        retreats = Retreat.objects.filter(
+            pk__in=checkout['reserved_retreats'],
+        )
+        for retreat in retreats:
+            retreat.check_and_use_reserved_place(user)
+            retreat.wait_queue.filter(user=user).delete()
+
+        if charge:
+            order.authorization_id = charge['id']
+            order.settlement_id = charge['settlements'][0]['id']
+            order.reference_number = charge['merchantRefNum']
+        order.status = Order.STATUS_PAID
+        order.pending_checkout = None
+        order.save()
+
+    return checkout
+
+
+def release_pending_order(order):
+    """
+    Compensates the reservation made for an order that was not paid: frees
+    the reserved places, gives back the coupon use and the tickets spent,
+    then deletes the order.
+
+    Returns False if the order was already completed or released.
+    """
+    from retirement.models import Reservation as RetreatReservation
+    from workplace.models import Reservation
+
+    with transaction.atomic():
+        checkout = get_locked_pending_checkout(order)
+        if checkout is None:
+            return False
+
+        reservations = Reservation.all_objects.filter(
+            pk__in=checkout['timeslot_reservations'],
+        )
+        for reservation in reservations:
+            reservation.delete(force_policy=HARD_DELETE)
+        retreat_reservations = RetreatReservation.all_objects.filter(
+            pk__in=checkout['retreat_reservations'],
+        )
+        for reservation in retreat_reservations:
+            reservation.delete(force_policy=HARD_DELETE)
+
+        if checkout['coupon']:
+            CouponUser.objects.filter(
+                coupon_id=checkout['coupon'],
+                user_id=order.user_id,
+            ).update(uses=F('uses') - 1)
+            Coupon.objects.filter(
+                pk=checkout['coupon'],
+                total_uses__gt=0,
+            ).update(total_uses=F('total_uses') - 1)
+
+        if checkout['tickets'] < 0:
+            User.objects.filter(pk=order.user_id).update(
+                tickets=F('tickets') - checkout['tickets'],
+            )
+
+        order.delete()
+
+    return True
+
+
+def send_order_emails(order, checkout, charge=None):
+    """
+    Sends the invoice of a completed order, the confirmation of its retreat
+    reservations and the welcome email of its membership.
+
+    order:      Order completed by complete_pending_order()
+    checkout:   Checkout returned by complete_pending_order()
+    charge:     Content of the Paysafe authorization that paid the order
+    """
+    from retirement.models import Reservation as RetreatReservation
+    from retirement.services import send_retreat_confirmation_email
+
+    user = order.user
+
+    if checkout['send_invoice']:
+        if charge is None:
+            charge = {
+                'card': {
+                    'lastDigits': None,
+                    'type': "NONE"
+                }
+            }
+
+        orderlines = order.order_lines.filter(
+            Q(content_type__model='membership') |
+            Q(content_type__model='package') |
+            Q(content_type__model='retreat')
+        )
+
+        # Here, the 'details' key is used to provide details of the
+        #  item to the email template.
+        # As of now, only 'retreat' objects have the 'email_content'
+        #  key that is used here. There is surely a better way
+        #  to handle that logic that will be more generic.
+        items = [
+            {
+                'price': order_line.content_object.price,
+                'name': "{0}: {1}".format(
+                    order_line.content_object.get_product_display_type,
+                    order_line.content_object.name
+                ),
+                'options': [
+                    {
+                        'price': opt.option.price * opt.quantity,
+                        'name': f'{opt.option.name} (x{opt.quantity})',
+                    } for opt in OrderLineBaseProduct.objects.filter(
+                        order_line=order_line)
+                ]
+
+                # Removed details section because it was only used
+                # for retreats. Retreats instead have another
+                # unique email containing details of the event.
+                # 'details':
+                #    order_line.content_object.email_content if hasattr(
+                #         order_line.content_object, 'email_content'
+                #     ) else ""
+            } for order_line in orderlines
+        ]
+
+        amount = order.total_cost_with_taxes
+        tax = order.taxes
+
+        # Send order confirmation email
+        merge_data = {
+            'STATUS': "APPROUVÉE",
+            'CARD_NUMBER': charge['card']['lastDigits'],
+            'CARD_TYPE': PAYSAFE_CARD_TYPE[
+                charge['card']['type']
+            ],
+            'DATETIME': timezone.localtime().strftime("%x %X"),
+            'ORDER_ID': order.id,
+            'CUSTOMER_NAME': user.first_name + " " + user.last_name,
+            'CUSTOMER_EMAIL': user.email,
+            'CUSTOMER_NUMBER': user.id,
+            'AUTHORIZATION': order.authorization_id,
+            'TYPE': "Achat",
+            'ITEM_LIST': items,
+            'TAX': tax,
+            'DISCOUNT': Decimal(checkout['discount']),
+            'COUPON': Coupon.objects.filter(pk=checkout['coupon']).first(),
+            'SUBTOTAL': round(amount / 100 - tax, 2),
+            'COST': round(amount / 100, 2),
+        }
+
+        Order.send_invoice([user.email], merge_data)
+
+    # Send retreat informations emails
+    retreat_reservations = RetreatReservation.objects.filter(
+        pk__in=checkout['retreat_reservations'],
+    ).select_related('retreat')
+    for retreat_reservation in retreat_reservations:
+        send_retreat_confirmation_email(user, retreat_reservation.retreat)
+
+    # Send welcome email membership
+    if checkout['membership']:
+        Membership.objects.get(
+            pk=checkout['membership'],
+        ).send_welcome_email(user)
+
+
+def get_pending_orders_to_reconcile():
+    """
+    Returns the orders still pending once their charge had the time to
+    complete, left behind by a checkout that didn't get the outcome of the
+    charge.
+    """
+    pending_before = timezone.now() - timedelta(
+        minutes=settings.PAYSAFE.get('PENDING_ORDER_DELAY_MINUTES', 15)
+    )
+
+    return Order.objects.filter(
+        status=Order.STATUS_PENDING,
+        transaction_date__lte=pending_before,
+    ).select_related('user')
+
+
+def reconcile_pending_order(order):
+    """
+    Looks up the charge of a pending order by its merchant reference number.
+    The order is completed if Paysafe charged it and released if Paysafe
+    never will. It stays pending while Paysafe is still processing the
+    charge or can't be reached.
+    """
+    try:
+        auths = lookup_card_payments('auths', order.reference_number)
+        charges = [auth for auth in auths if auth['status'] == 'COMPLETED']
+        if charges and not charges[0].get('settlements'):
+            charges[0]['settlements'] = lookup_card_payments(
+                'settlements',
+                order.reference_number,
+            )
+    except (PaymentAPIError, requests.exceptions.RequestException) as err:
+        Log.error(
+            source='CHECKOUT',
+            message=err,
+            additional_data=json.dumps({
+                'order_id': order.id,
+                'reference_number': order.reference_number,
+            })
+        )
+        return
+
+    if charges:
+        checkout = complete_pending_order(order, charges[0])
+        if checkout:
+            send_order_emails(order, checkout, charges[0])
+    elif all(auth['status'] in PAYSAFE_UNCHARGED_STATUS for auth in auths):
+        release_pending_order(order)
+
+
+###############################################################################
+#                          AUTOMATIC REFUND SERVICES                          #
+###############################################################################
+
+# Paysafe errors after which a refund can be tried again later
+# 3406: the settlement has not been batched yet
+REFUND_RETRYABLE_ERRORS = ('3406',)
+
+
+def get_refunds_to_process():
+    """
+    Returns the refunds that are not fully refunded yet and that were either
+    never sent to Paysafe or only failed with errors that can be retried once
+    the retry delay is over.
+
+    Each refund is annotated with its successfully refunded amount so the
+    remaining amount does not need another query.
+    """
+    config = settings.PAYSAFE
+    retry_before = timezone.now() - timedelta(
+        hours=config.get('REFUND_RETRY_DELAY_HOURS', 12)
+    )
+    active_transactions = Q(transactions__deleted__isnull=True)
+
+    return Refund.objects.select_related(
+        'orderline__order',
+    ).annotate(
+        successful_amount=Coalesce(
+            Sum(
+                'transactions__amount',
+                filter=active_transactions & Q(
+                    transactions__is_successful=True
+                ),
+            ),
+            Value(Decimal(0)),
+        ),
+        nb_tries=Count('transactions', filter=active_transactions),
+        nb_retryable_tries=Count(
+            'transactions',
+            filter=active_transactions & Q(
+                transactions__error_code__in=REFUND_RETRYABLE_ERRORS
+            ),
+        ),
+        last_try_date=Max(
+            'transactions__transaction_date',
+            filter=active_transactions,
+        ),
+    ).filter(
+        successful_amount__lt=F('amount'),
+    ).filter(
+        Q(nb_tries=0) | Q(
+            nb_tries=F('nb_retryable_tries'),
+            nb_tries__lt=config.get('REFUND_MAX_TRIES', 5),
+            last_try_date__lte=retry_before,
+        )
+    )
+
+
+def send_refund(settlement_id, amount):
+    """
+    Sends one refund to Paysafe and returns the data of the transaction to
+    record. Runs in a worker thread.
+
+    settlement_id: ID for the Paysafe settlement
+    amount:        Amount to refund, in dollars
+    """
+    transaction_data = {
+        'transaction_id': None,
+        'is_successful': False,
+        'details': None,
+        'error_code': None,
+    }
+    try:
+        # Paysafe uses amounts in cents
+        refund_response = refund_amount(
+            settlement_id,
+            int(round(amount * 100)),
+        )
+        transaction_data['transaction_id'] = refund_response.json()['id']
+        transaction_data['is_successful'] = True
+    except PaymentAPIError as err:
+        transaction_data['details'] = str(err.detail)
+        if isinstance(err.detail, dict):
+            transaction_data['error_code'] = err.detail.get(
+                'error', {}
+            ).get('code')
+
+        if str(err) == PAYSAFE_EXCEPTION['3406']:
+            transaction_data['details'] = \
+                "The order has not been charged yet. Try again later." + \
+                str(err.detail)
+        if str(err) == PAYSAFE_EXCEPTION['3404']:
+            transaction_data['details'] = \
+                "The order has already been refunded by Paysafe." + \
+                str(err.detail)
+    except Exception as err:
+        transaction_data['details'] = repr(err)
+    finally:
+        # Errors are logged in the database from this thread
+        connection.close()
+
+    return transaction_data
+
+
+def process_automatic_refunds(refunds):
+    """
+    Sends the refunds to Paysafe concurrently, on a bounded pool of workers,
+    and records all the resulting RefundTransaction in one query.
+
+    refunds: Refund instances, ideally coming from get_refunds_to_process()
+    """
+    refunds = list(refunds)
+    if not refunds:
+        return []
+
+    amounts = [
+        refund.amount - refund.successful_amount
+        if hasattr(refund, 'successful_amount')
+        else refund.remaining_amount_to_refund()
+        for refund in refunds
+    ]
+
+    with ThreadPoolExecutor(
+            max_workers=settings.PAYSAFE.get('REFUND_WORKERS', 4)
+    ) as executor:
+        results = executor.map(
+            send_refund,
+            [refund.orderline.order.settlement_id for refund in refunds],
+            amounts,
+        )
+        transactions = [
+            RefundTransaction(
+                refund=refund,
+                amount=amount,
+                transaction_date=timezone.now(),
+                **transaction_data
+            )
+            for refund, amount, transaction_data
+            in zip(refunds, amounts, results)
+        ]
+
+    return RefundTransaction.objects.bulk_create(transactions)
+
+
 ###############################################################################
 #                               OTHER SERVICES                                #
 ###############################################################################
 
+# The applicability of a coupon is cached per version of the coupon, so
+# entries never need to be invalidated and only expire to free the cache.
+COUPON_APPLICABILITY_CACHE_TIMEOUT = 60 * 60 * 24
 
-def validate_coupon_for_order(coupon, order):
+# Coupon previews also depend on the uses of the coupon and on the price of
+# the products, so they are only kept for a short time. The order itself is
+# always validated again at checkout.
+COUPON_PREVIEW_CACHE_TIMEOUT = 60
+
+
+def get_coupon_applicability(coupon):
+    """
+    Returns the ids of the products and product types to which the coupon
+    can be applied.
+
+    They are cached for each version of the coupon, the version being
+    incremented each time one of those relations changes.
+    """
+    cache_key = 'coupon_applicability_{0}_{1}'.format(
+        coupon.pk,
+        coupon.version,
+    )
+    applicability = cache.get(cache_key)
+
+    if applicability is None:
+        applicability = {
+            'product_types': set(
+                coupon.applicable_product_types.values_list('id', flat=True)
+            ),
+            'package': set(
+                coupon.applicable_packages.values_list('id', flat=True)
+            ),
+            'timeslot': set(
+                coupon.applicable_timeslots.values_list('id', flat=True)
+            ),
+            'membership': set(
+                coupon.applicable_memberships.values_list('id', flat=True)
+            ),
+            'retreat': set(
+                coupon.applicable_retreats.values_list('id', flat=True)
+            ),
+            'retreat_types': set(
+                coupon.applicable_retreat_types.values_list('id', flat=True)
+            ),
+        }
+        cache.set(
+            cache_key,
+            applicability,
+            COUPON_APPLICABILITY_CACHE_TIMEOUT,
+        )
+
+    return applicability
+
+
+def load_order_line_products(order_lines):
+    """
+    Fetches the products of the order lines with one query per type of
+    product, instead of one query per order line, and caches each product on
+    its order line.
+    """
+    from retirement.models import Retreat
+
+    ids_by_content_type = defaultdict(set)
+    for order_line in order_lines:
+        ids_by_content_type[order_line.content_type_id].add(
+            order_line.object_id
+        )
+
+    products = dict()
+    for content_type_id, ids in ids_by_content_type.items():
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        queryset = model._base_manager.all()
+        if model is Retreat:
+            queryset = queryset.select_related('type')
+        for product_id, product in queryset.in_bulk(ids).items():
+            products[(content_type_id, product_id)] = product
+
+    for order_line in order_lines:
+        product = products.get(
+            (order_line.content_type_id, order_line.object_id)
+        )
+        if product is not None:
+            order_line.content_object = product
+
+
+def is_coupon_applicable_to_order_line(coupon, applicability, order_line):
+    if order_line.content_type_id in applicability['product_types']:
+        return True
+
+    model = ContentType.objects.get_for_id(order_line.content_type_id).model
+    if order_line.object_id in applicability.get(model, ()):
+        return True
+
+    if model == 'retreat':
+        retreat = order_line.content_object
+        if retreat.type_id in applicability['retreat_types']:
+            return True
+        if retreat.deleted is None:
+            if retreat.type.is_virtual:
+                return coupon.is_applicable_to_virtual_retreat
+            return coupon.is_applicable_to_physical_retreat
+
+    return False
+
+
+def validate_coupon_for_order(coupon, order, order_lines=None):
     """
     coupon: Coupon model instance
     order: Order model instance
+    order_lines: OrderLine instances of the order, they are fetched from the
+                 order if not provided
 
     THIS DOES NOT RECORD COUPON USE. Linked CouponUser instance needs to be
     updated outside of this function!
@@ -514,18 +1221,13 @@ def validate_coupon_for_order(coupon, order):
         return coupon_info
 
     # Check if the maximum number of use for this coupon is exceeded
-    coupon_user, created = CouponUser.objects.get_or_create(
+    user_uses = CouponUser.objects.filter(
         coupon=coupon,
         user=user,
-        defaults={'uses': 0},
-    )
-    total_coupon_uses = CouponUser.objects.filter(coupon=coupon)
-    total_coupon_uses = sum(
-        total_coupon_uses.values_list('uses', flat=True)
-    )
-    valid_use = coupon_user.uses < coupon.max_use_per_user
+    ).values_list('uses', flat=True).first() or 0
+    valid_use = user_uses < coupon.max_use_per_user
     valid_use = valid_use or not coupon.max_use_per_user
-    valid_use = valid_use and (total_coupon_uses < coupon.max_use
+    valid_use = valid_use and (coupon.total_uses < coupon.max_use
                                or not coupon.max_use)
     if not valid_use:
         coupon_info['error'] = {
@@ -536,56 +1238,21 @@ def validate_coupon_for_order(coupon, order):
         return coupon_info
 
     # Check if the coupon can be applied to a product in the order
-    from retirement.models import Retreat
-    list_physical_retreat_id_applicable = Retreat.objects.none()
-    if coupon.is_applicable_to_physical_retreat:
-        list_physical_retreat_id_applicable = Retreat.objects.filter(
-            type__is_virtual=False,
-        )
-
-    list_virtual_retreat_id_applicable = Retreat.objects.none()
-    if coupon.is_applicable_to_virtual_retreat:
-        list_virtual_retreat_id_applicable = Retreat.objects.filter(
-            type__is_virtual=True,
-        )
-
-    applicable_orderlines = order.order_lines.filter(
-        Q(content_type__in=coupon.applicable_product_types.all())
-        | Q(content_type__model='package',
-            object_id__in=coupon.applicable_packages.all().
-            values_list('id', flat=True))
-        | Q(content_type__model='timeslot',
-            object_id__in=coupon.applicable_timeslots.all().
-            values_list('id', flat=True))
-        | Q(content_type__model='membership',
-            object_id__in=coupon.applicable_memberships.all().
-            values_list('id', flat=True))
-        | Q(content_type__model='retreat',
-            object_id__in=coupon.applicable_retreats.all().
-            values_list('id', flat=True))
-        | Q(content_type__model='retreat',
-            object_id__in=list_physical_retreat_id_applicable.
-            values_list('id', flat=True))
-        | Q(content_type__model='retreat',
-            object_id__in=list_virtual_retreat_id_applicable.
-            values_list('id', flat=True))
-    )
+    if order_lines is None:
+        order_lines = list(order.order_lines.all())
+    load_order_line_products(order_lines)
+
+    applicability = get_coupon_applicability(coupon)
+    list_applicable_order_lines = [
+        order_line for order_line in order_lines
+        if is_coupon_applicable_to_order_line(
+            coupon,
+            applicability,
+            order_line,
+        )
+    ]
 
-    # check for retreat type application since we don't have GenericRelation
-    applicable_retreat_types = coupon.applicable_retreat_types.all()
-    applicable_order_lines_retreat_type_ids = []
-    for order_line in order.order_lines.all():
-        if order_line.content_type.model == 'retreat':
-            retreat = Retreat.objects.get(pk=order_line.object_id)
-            if retreat.type in applicable_retreat_types:
-                applicable_order_lines_retreat_type_ids.append(order_line.id)
-    applicable_order_lines_retreat_type = OrderLine.objects.filter(
-        pk__in=applicable_order_lines_retreat_type_ids)
-    if applicable_order_lines_retreat_type:
-        applicable_orderlines = applicable_orderlines | \
-                                applicable_order_lines_retreat_type
-
-    if not applicable_orderlines:
+    if not list_applicable_order_lines:
         coupon_info['error'] = {
             'non_field_errors': [_(
                 "This coupon does not apply to any product."
@@ -596,7 +1263,6 @@ def validate_coupon_for_order(coupon, order):
     # The coupon is valid and can be used.
     # We find the product to which it applies.
     # We calculate the official amount to be discounted.
-    list_applicable_order_lines = list(applicable_orderlines)
     list_applicable_order_lines.sort(
         key=lambda order_line_sort: order_line_sort.content_object.price,
         reverse=True
@@ -621,6 +1287,153 @@ def validate_coupon_for_order(coupon, order):
     return coupon_info
 
 
+def get_cart_hash(order_lines):
+    """
+    Returns a hash identifying the products and quantities of a cart,
+    regardless of the order of its lines.
+    """
+    cart = sorted(
+        (
+            order_line.content_type_id,
+            order_line.object_id,
+            order_line.quantity,
+        )
+        for order_line in order_lines
+    )
+    return hashlib.sha256(json.dumps(cart).encode()).hexdigest()
+
+
+def preview_coupon_for_cart(coupon, user, order_lines):
+    """
+    coupon: Coupon model instance
+    user: User that would place the order
+    order_lines: unsaved OrderLine instances of the cart
+
+    Evaluates the coupon against an in-memory cart without writing anything
+    to the database. The result is cached per coupon, user and cart.
+
+    Returns the same dict as validate_coupon_for_order, without the
+    orderlines.
+    """
+    cache_key = 'coupon_preview_{0}_{1}_{2}_{3}'.format(
+        coupon.pk,
+        coupon.version,
+        user.pk,
+        get_cart_hash(order_lines),
+    )
+    coupon_info = cache.get(cache_key)
+
+    if coupon_info is None:
+        coupon_info = validate_coupon_for_order(
+            coupon,
+            Order(user=user),
+            order_lines=order_lines,
+        )
+        del coupon_info['orderlines']
+        cache.set(cache_key, coupon_info, COUPON_PREVIEW_CACHE_TIMEOUT)
+
+    return coupon_info
+
+
+def get_coupon_usages(coupons):
+    """
+    coupons: Coupon model instances
+
+    Gathers the uses of the coupons with one query per related table instead
+    of queries for each order line.
+
+    Returns a dict with the uses of each coupon id, grouped by order:
+    {
+        coupon_id: [{
+            'order': Order instance,
+            'user': User instance,
+            'amount_used': value of the coupon that was not refunded,
+            'product_name': names of the products of the order,
+            'orderlines': [{
+                'amount_used': value of the coupon on the line,
+                'is_refunded': True if the line was refunded or canceled,
+                'cancellation_reason': reasons of refunds and cancellations,
+                'product_name': name of the product of the line,
+            }],
+        }]
+    }
+    """
+    from retirement.models import Reservation as RetreatReservation
+
+    order_lines = list(
+        OrderLine.objects.filter(
+            coupon__in=coupons,
+        ).select_related(
+            'order__user__university',
+            'order__user__affiliation',
+            'order__user__academic_field',
+            'order__user__academic_level',
+        ).order_by('id')
+    )
+    order_line_ids = [order_line.id for order_line in order_lines]
+    load_order_line_products(order_lines)
+
+    refunds = defaultdict(list)
+    for refund in Refund.objects.filter(orderline_id__in=order_line_ids):
+        refunds[refund.orderline_id].append(refund)
+
+    cancellations = defaultdict(list)
+    for reservation in RetreatReservation.objects.filter(
+            order_line_id__in=order_line_ids,
+            is_active=False,
+    ):
+        cancellations[reservation.order_line_id].append(reservation)
+
+    usages = {coupon.id: dict() for coupon in coupons}
+    for order_line in order_lines:
+        line_refunds = refunds[order_line.id]
+        line_cancellations = cancellations[order_line.id]
+
+        # Sometimes, we have a cancellation, but since the price was 0 (due
+        # to the coupon) we don't have a refund
+        model = ContentType.objects.get_for_id(
+            order_line.content_type_id
+        ).model
+        is_refunded = bool(line_refunds) or (
+            model == 'retreat' and bool(line_cancellations)
+        )
+
+        cancellation_reason = [
+            refund.details for refund in line_refunds if refund.details
+        ] + [
+            reservation.cancelation_reason
+            for reservation in line_cancellations
+            if reservation.cancelation_reason
+        ]
+
+        order = order_line.order
+        usages_per_order = usages[order_line.coupon_id]
+        if order.id not in usages_per_order:
+            usages_per_order[order.id] = {
+                'order': order,
+                'user': order.user,
+                'amount_used': 0,
+                'product_name': set(),
+                'orderlines': [],
+            }
+        usage = usages_per_order[order.id]
+
+        if not is_refunded:
+            usage['amount_used'] += order_line.coupon_real_value
+        usage['product_name'].add(order_line.content_object.name)
+        usage['orderlines'].append({
+            'amount_used': order_line.coupon_real_value,
+            'is_refunded': is_refunded,
+            'cancellation_reason': ', '.join(cancellation_reason),
+            'product_name': order_line.content_object.name,
+        })
+
+    return {
+        coupon_id: list(usages_per_order.values())
+        for coupon_id, usages_per_order in usages.items()
+    }
+
+
 def notify_for_coupon(email, coupon):
     """
     This function sends an email to notify a user that he has access to a
@@ -0,0 +1,32 @@
+from django.db.models import F
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
+
+from .models import Coupon
+
+
+@receiver(m2m_changed, sender=Coupon.applicable_retreats.through)
+@receiver(m2m_changed, sender=Coupon.applicable_retreat_types.through)
+@receiver(m2m_changed, sender=Coupon.applicable_timeslots.through)
+@receiver(m2m_changed, sender=Coupon.applicable_packages.through)
+@receiver(m2m_changed, sender=Coupon.applicable_memberships.through)
+@receiver(m2m_changed, sender=Coupon.applicable_product_types.through)
+def update_coupon_version(sender, instance, action, reverse, pk_set,
+                          **kwargs):
+    """
+    Increment the version of the coupons whose applicable products changed,
+    so their cached applicability is not used anymore.
+    """
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        Coupon.objects.filter(pk=instance.pk).update(version=F('version') + 1)
+        instance.refresh_from_db(fields=['version'])
+    elif pk_set is not None:
+        Coupon.objects.filter(pk__in=pk_set).update(
+            version=F('version') + 1
+        )
+    else:
+        # A product has been removed from all its coupons
+        Coupon.objects.all().update(version=F('version') + 1)
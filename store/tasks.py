@@ -1,36 +1,29 @@
-import requests
-
 from celery import shared_task
-from django.db import transaction
-from django.db.models import Q
-from django.utils import timezone
 from django.conf import settings
-from django.db.models import Sum, Q, F, Value
-from django.db.models.functions import Coalesce
 
-from retirement.models import WaitQueuePlace
-from store.models import Refund, RefundTransaction
+from store.services import (
+    get_pending_orders_to_reconcile,
+    get_refunds_to_process,
+    process_automatic_refunds,
+    reconcile_pending_order,
+)
+
 
 @shared_task
 def process_refund():
-    # Get refunds where the total successful transaction amount is less than the refund amount
-    refunds = Refund.objects.annotate(
-        successful_amount=Coalesce(
-            Sum(
-                'transactions__amount',
-                filter=Q(transactions__is_successful=True)
-            ),
-            Value(0)
-        )
-    ).filter(
-        successful_amount__lt=F('amount')
-    )
-    
-    for refund in refunds:
-        if refund.transactions.all().exists():
-            # We already tried to process this refund, so we skip it to avoid duplicates
-            # This logic could be enhance in the future to handle retries and failures
-            continue
-        
-        # Call the external API to process the refund
-        refund.process_automatic_refund()
\ No newline at end of file
+    # Get refunds which still need to be sent to Paysafe: never tried yet,
+    # or only failed because the settlement was not batched yet and the
+    # retry delay is over.
+    refunds = list(get_refunds_to_process())
+
+    batch_size = settings.PAYSAFE.get('REFUND_BATCH_SIZE', 100)
+    for index in range(0, len(refunds), batch_size):
+        process_automatic_refunds(refunds[index:index + batch_size])
+
+
+@shared_task
+def reconcile_pending_orders():
+    # Complete or release the orders left pending by a checkout that didn't
+    # get the outcome of their charge.
+    for order in get_pending_orders_to_reconcile():
+        reconcile_pending_order(order)
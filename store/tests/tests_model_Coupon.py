@@ -43,3 +43,24 @@ class CouponTests(APITestCase):
         )
 
         self.assertEqual(str(coupon), "12345678")
+
+    def test_save_keeps_counters(self):
+        """
+        Ensure saving a coupon loaded before a change of its applicable
+        products or a checkout doesn't overwrite its version nor its total
+        uses.
+        """
+        stale_coupon = Coupon.objects.get(pk=self.coupon.pk)
+
+        self.coupon.applicable_product_types.remove(self.package_type)
+        Coupon.objects.filter(pk=self.coupon.pk).update(total_uses=3)
+        self.coupon.refresh_from_db()
+        version = self.coupon.version
+
+        stale_coupon.details = "New details"
+        stale_coupon.save()
+
+        self.coupon.refresh_from_db()
+        self.assertEqual(self.coupon.details, "New details")
+        self.assertEqual(self.coupon.version, version)
+        self.assertEqual(self.coupon.total_uses, 3)
@@ -13,6 +13,7 @@ from rest_framework import status
 from rest_framework.test import APITestCase
 
 from datetime import datetime, timedelta
+from unittest import mock
 
 from blitz_api.factories import (
     UserFactory,
@@ -24,13 +25,22 @@ from blitz_api.factories import (
 from .paysafe_sample_responses import (
     UNKNOWN_EXCEPTION,
     SAMPLE_INVALID_PAYMENT_TOKEN,
+    SAMPLE_NO_AMOUNT_TO_REFUND,
     SAMPLE_PROFILE_RESPONSE,
+    SAMPLE_REFUND_RESPONSE,
 )
 from retirement.models import (
     Retreat,
 )
 from ..exceptions import PaymentAPIError
-from ..models import PaymentProfile, Order, Coupon, Package, OrderLine
+from ..models import (
+    PaymentProfile,
+    Order,
+    Coupon,
+    Package,
+    OrderLine,
+    Refund,
+)
 from ..services import (
     charge_payment,
     get_external_payment_profile,
@@ -40,6 +50,7 @@ from ..services import (
     create_external_card,
     validate_coupon_for_order,
 )
+from ..tasks import process_refund
 
 User = get_user_model()
 LOCAL_TIMEZONE = pytz.timezone(settings.TIME_ZONE)
@@ -157,6 +168,56 @@ class ServicesTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(json.loads(response.content), SAMPLE_PROFILE_RESPONSE)
 
+    @responses.activate
+    def test_get_external_payment_profile_retry(self):
+        """
+        Ensure idempotent calls are retried when Paysafe is temporarily
+        unavailable.
+        """
+        responses.add(
+            responses.GET,
+            "http://example.com/customervault/v1/profiles/123?fields=cards",
+            status=503
+        )
+        responses.add(
+            responses.GET,
+            "http://example.com/customervault/v1/profiles/123?fields=cards",
+            json=SAMPLE_PROFILE_RESPONSE,
+            status=200
+        )
+
+        with mock.patch('store.services.time.sleep') as sleep:
+            response = get_external_payment_profile(
+                self.payment_profile.external_api_id
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(responses.calls), 2)
+        sleep.assert_called_once()
+
+    @responses.activate
+    def test_charge_payment_not_retried(self):
+        """
+        Ensure a charge is never sent twice to Paysafe.
+        """
+        responses.add(
+            responses.POST,
+            "http://example.com/cardpayments/v1/accounts/0123456789/auths/",
+            json=UNKNOWN_EXCEPTION,
+            status=503
+        )
+
+        with mock.patch('store.services.time.sleep'):
+            self.assertRaises(
+                PaymentAPIError,
+                charge_payment,
+                1000,
+                PAYMENT_TOKEN,
+                "123"
+            )
+
+        self.assertEqual(len(responses.calls), 1)
+
     @responses.activate
     def test_create_external_payment_profile(self):
         """
@@ -246,6 +307,102 @@ class ServicesTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(json.loads(response.content), SAMPLE_PROFILE_RESPONSE)
 
+    @responses.activate
+    def test_process_refund(self):
+        """
+        Ensure pending refunds are sent to Paysafe and recorded once.
+        """
+        responses.add(
+            responses.POST,
+            "http://example.com/cardpayments/v1/accounts/0123456789/"
+            "settlements/1/refunds",
+            json=SAMPLE_REFUND_RESPONSE,
+            status=200
+        )
+        refund = Refund.objects.create(
+            orderline=self.order_line,
+            refund_date=timezone.now(),
+            amount=10,
+        )
+
+        process_refund()
+        process_refund()
+
+        self.assertEqual(len(responses.calls), 1)
+        self.assertEqual(
+            json.loads(responses.calls[0].request.body)['amount'],
+            1000
+        )
+        transaction = refund.transactions.get()
+        self.assertTrue(transaction.is_successful)
+        self.assertEqual(
+            transaction.transaction_id,
+            SAMPLE_REFUND_RESPONSE['id']
+        )
+        self.assertEqual(refund.get_state(), Refund.REFUND_STATE_REFUNDED)
+
+    @responses.activate
+    def test_process_refund_retry_not_batched(self):
+        """
+        Ensure a refund refused because the settlement is not batched yet is
+        tried again once the retry delay is over.
+        """
+        responses.add(
+            responses.POST,
+            "http://example.com/cardpayments/v1/accounts/0123456789/"
+            "settlements/1/refunds",
+            json=SAMPLE_NO_AMOUNT_TO_REFUND,
+            status=400
+        )
+        refund = Refund.objects.create(
+            orderline=self.order_line,
+            refund_date=timezone.now(),
+            amount=10,
+        )
+
+        process_refund()
+        transaction = refund.transactions.get()
+        self.assertFalse(transaction.is_successful)
+        self.assertEqual(transaction.error_code, '3406')
+
+        # Still in the retry delay
+        process_refund()
+        self.assertEqual(refund.transactions.count(), 1)
+
+        refund.transactions.update(
+            transaction_date=timezone.now() - timedelta(hours=13)
+        )
+        process_refund()
+        self.assertEqual(refund.transactions.count(), 2)
+        self.assertEqual(len(responses.calls), 2)
+
+    @responses.activate
+    def test_process_refund_not_retried(self):
+        """
+        Ensure a refund refused for another reason is not tried again.
+        """
+        responses.add(
+            responses.POST,
+            "http://example.com/cardpayments/v1/accounts/0123456789/"
+            "settlements/1/refunds",
+            json=UNKNOWN_EXCEPTION,
+            status=400
+        )
+        refund = Refund.objects.create(
+            orderline=self.order_line,
+            refund_date=timezone.now(),
+            amount=10,
+        )
+
+        process_refund()
+        refund.transactions.update(
+            transaction_date=timezone.now() - timedelta(days=7)
+        )
+        process_refund()
+
+        self.assertEqual(refund.transactions.count(), 1)
+        self.assertEqual(len(responses.calls), 1)
+
     @responses.activate
     def test_unknown_external_api_exception(self):
         """
@@ -378,6 +535,57 @@ class ServicesTests(APITestCase):
             self.payment_profile.external_api_id
         )
 
+    def test_validate_coupon_for_order_num_queries(self):
+        """
+        Ensure the number of queries does not depend on the size of the
+        order once the coupon applicability is cached.
+        """
+        validate_coupon_for_order(self.coupon, self.order)
+
+        with self.assertNumQueries(3):
+            validate_coupon_for_order(self.coupon, self.order)
+
+        for package in [self.package_most_exp_product,
+                        self.package_less_exp_product]:
+            OrderLine.objects.create(
+                order=self.order,
+                quantity=1,
+                content_type=self.package_type,
+                object_id=package.id
+            )
+
+        with self.assertNumQueries(3):
+            coupon_info = validate_coupon_for_order(self.coupon, self.order)
+
+        self.assertEqual(coupon_info['value'], self.coupon.value)
+
+    def test_validate_coupon_for_order_applicability_changed(self):
+        """
+        Ensure a change of the products of a coupon is seen by the
+        validation even if its applicability is cached.
+        """
+        coupon = Coupon.objects.create(
+            value=13,
+            code="IJKLMNOP",
+            start_time=self.coupon.start_time,
+            end_time=self.coupon.end_time,
+            max_use=100,
+            max_use_per_user=2,
+            owner=self.user,
+        )
+
+        coupon_info = validate_coupon_for_order(coupon, self.order)
+        self.assertFalse(coupon_info['valid_use'])
+
+        coupon.applicable_packages.add(self.package_2)
+
+        coupon_info = validate_coupon_for_order(coupon, self.order)
+        self.assertTrue(coupon_info['valid_use'])
+        self.assertEqual(
+            coupon_info['orderlines'][0]['order_line'],
+            self.order_line_2
+        )
+
     def test_validate_coupon_for_order_with_most_exp_product(self):
         order_line_most_exp_product = OrderLine.objects.create(
             order=self.order,
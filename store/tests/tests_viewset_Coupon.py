@@ -1,4 +1,5 @@
 import json
+from io import StringIO
 import pytz
 from datetime import (
     datetime,
@@ -11,6 +12,9 @@ from rest_framework.test import (
 from unittest import mock
 from django.conf import settings
 from django.core import mail
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from django.urls import reverse
 from django.contrib.auth import get_user_model
@@ -1295,6 +1299,7 @@ class CouponTests(CustomAPITestCase):
 
         response = self.client.get(
             reverse('coupon-list'),
+            {'include_usages': 'true'},
             format='json',
         )
 
@@ -1350,7 +1355,6 @@ class CouponTests(CustomAPITestCase):
                 "applicable_packages": [],
                 "applicable_memberships": [],
                 "users": [],
-                "usages": [],
                 "is_applicable_to_physical_retreat": False,
                 "is_applicable_to_virtual_retreat": False
             }, {
@@ -1374,7 +1378,6 @@ class CouponTests(CustomAPITestCase):
                 "applicable_packages": [],
                 "applicable_memberships": [],
                 "users": [],
-                "usages": [],
                 "is_applicable_to_physical_retreat": False,
                 "is_applicable_to_virtual_retreat": False
             }]
@@ -1384,6 +1387,70 @@ class CouponTests(CustomAPITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_list_include_usages(self):
+        """
+        Ensure usages are only listed when asked, with a number of queries
+        that doesn't depend on the number of uses.
+        """
+        self.client.force_authenticate(user=self.admin)
+
+        order = OrderFactory(user=self.user)
+        OrderLineFactory(
+            order=order,
+            content_type=self.package_type,
+            object_id=self.package.id,
+            coupon=self.coupon,
+            coupon_real_value=5
+        )
+
+        response = self.client.get(
+            reverse('coupon-list'),
+            format='json',
+        )
+
+        data = json.loads(response.content)
+        self.assertNotIn('usages', data['results'][0])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse('coupon-list'),
+                {'include_usages': 'true'},
+                format='json',
+            )
+        nb_queries = len(queries)
+
+        data = json.loads(response.content)
+        usages = {
+            coupon['id']: coupon['usages'] for coupon in data['results']
+        }
+        self.assertEqual(len(usages[self.coupon.id]), 1)
+        self.assertEqual(usages[self.coupon.id][0]['amount_used'], 5.0)
+        self.assertEqual(usages[self.coupon2.id], [])
+
+        for coupon in [self.coupon, self.coupon2]:
+            order = OrderFactory(user=self.user)
+            OrderLineFactory(
+                order=order,
+                content_type=self.package_type,
+                object_id=self.package.id,
+                coupon=coupon,
+                coupon_real_value=5
+            )
+
+        with self.assertNumQueries(nb_queries):
+            response = self.client.get(
+                reverse('coupon-list'),
+                {'include_usages': 'true'},
+                format='json',
+            )
+
+        data = json.loads(response.content)
+        usages = {
+            coupon['id']: coupon['usages'] for coupon in data['results']
+        }
+        self.assertEqual(len(usages[self.coupon.id]), 2)
+        self.assertEqual(len(usages[self.coupon2.id]), 1)
+
     def test_list_search_by_code(self):
         """
         Ensure we can list all coupons matching a search.
@@ -1443,6 +1510,7 @@ class CouponTests(CustomAPITestCase):
         CouponUser.objects.create(coupon=c1, user=self.user, uses=1)
         CouponUser.objects.create(coupon=c2, user=self.user, uses=4)
         CouponUser.objects.create(coupon=c3, user=self.user, uses=10)
+        call_command('reconcile_coupon_uses', stdout=StringIO())
 
         response = self.client.get(
             reverse('coupon-list'),
@@ -0,0 +1,120 @@
+from rest_framework import status
+from rest_framework.test import APIClient, APITestCase
+
+from django.urls import reverse
+
+from blitz_api.factories import AdminFactory, CouponFactory, UserFactory
+
+from ..models import CouponUser
+
+
+class CouponUserTests(APITestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = AdminFactory()
+        self.user = UserFactory()
+        self.coupon = CouponFactory(
+            code='ABCD1234',
+            owner=self.admin,
+            total_uses=3,
+        )
+        self.other_coupon = CouponFactory(
+            code='EFGH5678',
+            owner=self.admin,
+        )
+        self.client.force_authenticate(user=self.admin)
+
+    def test_create_updates_total_uses(self):
+        """
+        Ensure the uses of a new CouponUser are added to the total uses of
+        its coupon.
+        """
+        data = {
+            'user': reverse('user-detail', args=[self.user.id]),
+            'coupon': reverse('coupon-detail', args=[self.coupon.id]),
+            'uses': 2,
+        }
+
+        response = self.client.post(
+            reverse('couponuser-list'),
+            data,
+            format='json',
+        )
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_201_CREATED,
+            response.content,
+        )
+        self.coupon.refresh_from_db()
+        self.assertEqual(self.coupon.total_uses, 5)
+
+    def test_update_updates_total_uses(self):
+        """
+        Ensure a change of the uses or the coupon of a CouponUser is applied
+        to the total uses of the coupons.
+        """
+        coupon_user = CouponUser.objects.create(
+            user=self.user,
+            coupon=self.coupon,
+            uses=3,
+        )
+
+        response = self.client.patch(
+            reverse('couponuser-detail', args=[coupon_user.id]),
+            {'uses': 1},
+            format='json',
+        )
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_200_OK,
+            response.content,
+        )
+        self.coupon.refresh_from_db()
+        self.assertEqual(self.coupon.total_uses, 1)
+
+        response = self.client.patch(
+            reverse('couponuser-detail', args=[coupon_user.id]),
+            {
+                'coupon': reverse(
+                    'coupon-detail',
+                    args=[self.other_coupon.id],
+                ),
+            },
+            format='json',
+        )
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_200_OK,
+            response.content,
+        )
+        self.coupon.refresh_from_db()
+        self.other_coupon.refresh_from_db()
+        self.assertEqual(self.coupon.total_uses, 0)
+        self.assertEqual(self.other_coupon.total_uses, 1)
+
+    def test_delete_updates_total_uses(self):
+        """
+        Ensure the uses of a deleted CouponUser are removed from the total
+        uses of its coupon.
+        """
+        coupon_user = CouponUser.objects.create(
+            user=self.user,
+            coupon=self.coupon,
+            uses=2,
+        )
+
+        response = self.client.delete(
+            reverse('couponuser-detail', args=[coupon_user.id]),
+        )
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_204_NO_CONTENT,
+            response.content,
+        )
+        self.coupon.refresh_from_db()
+        self.assertEqual(self.coupon.total_uses, 1)
@@ -14,6 +14,8 @@ from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APIClient, APITestCase
 
+from log_management.tasks import send_outbox_emails
+
 from ..models import CustomPayment, PaymentProfile
 from .paysafe_sample_responses import (SAMPLE_CARD_ALREADY_EXISTS,
                                        SAMPLE_CARD_REFUSED,
@@ -115,6 +117,7 @@ class CustomPaymentTests(APITestCase):
         self.assertEqual(response_data, content)
 
         # Test that one message was sent:
+        send_outbox_emails()
         self.assertEqual(len(mail.outbox), 1)
 
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
@@ -20,6 +20,7 @@ from django.utils import timezone
 from django.urls import reverse
 
 import pytz
+import requests
 import responses
 from unittest import mock
 
@@ -47,6 +48,7 @@ from retirement.models import (
     RetreatType,
     RetreatDate, Reservation,
 )
+from retirement.tasks import send_wait_queue_notifications
 
 from store.tests.paysafe_sample_responses import (
     SAMPLE_PROFILE_RESPONSE,
@@ -57,6 +59,7 @@ from store.tests.paysafe_sample_responses import (
     SAMPLE_CARD_ALREADY_EXISTS,
     SAMPLE_CARD_REFUSED,
     SAMPLE_REFUND_RESPONSE,
+    UNKNOWN_EXCEPTION,
 )
 
 from store.models import (
@@ -76,6 +79,8 @@ from blitz_api.testing_tools import CustomAPITestCase
 from blitz_api.models import (
     Organization,
 )
+from log_management.tasks import send_outbox_emails
+from store.tasks import reconcile_pending_orders
 
 User = get_user_model()
 
@@ -291,6 +296,7 @@ class OrderTests(CustomAPITestCase):
             value=10,
             max_use_per_user=0,
             max_use=0,
+            total_uses=5,
             owner=self.admin,
         )
         self.coupon.applicable_product_types.set([self.package_type])
@@ -471,6 +477,10 @@ class OrderTests(CustomAPITestCase):
         self.coupon_user.refresh_from_db()
         self.assertEqual(self.coupon_user.uses, old_uses + 1)
 
+        old_total_uses = self.coupon.total_uses
+        self.coupon.refresh_from_db()
+        self.assertEqual(self.coupon.total_uses, old_total_uses + 1)
+
         admin = self.admin
         admin.refresh_from_db()
 
@@ -486,6 +496,7 @@ class OrderTests(CustomAPITestCase):
 
         # 1 email for the order details
         # 1 email for the retreat informations
+        send_outbox_emails()
         self.assertEqual(len(mail.outbox), 2)
 
         # validate that the invitation are linked to the
@@ -1788,7 +1799,12 @@ class OrderTests(CustomAPITestCase):
         self.retreat_no_seats.wait_queue_places.all().delete()
         new_wait_queue_place = self.retreat_no_seats.add_wait_queue_place(self.user)
         self.retreat_no_seats.add_user_to_wait_queue(self.user)
-        new_wait_queue_place.notify()
+        # Send the notification email of the Celery task right away
+        with mock.patch(
+                'retirement.tasks.send_wait_queue_notifications.delay',
+                side_effect=send_wait_queue_notifications), \
+                self.captureOnCommitCallbacks(execute=True):
+            new_wait_queue_place.notify()
 
         data = {
             'payment_token': "CZgD1NlBzPuSefg",
@@ -1848,6 +1864,7 @@ class OrderTests(CustomAPITestCase):
         # 1 email for the order details
         # 1 email for the notification
         # 1 email for the retreat informations
+        send_outbox_emails()
         self.assertEqual(len(mail.outbox), 3)
 
     @responses.activate
@@ -2206,6 +2223,7 @@ class OrderTests(CustomAPITestCase):
 
         # 1 email for the order details
         # 1 email for the retreat informations
+        send_outbox_emails()
         self.assertEqual(len(mail.outbox), 2)
 
     @responses.activate
@@ -2284,6 +2302,7 @@ class OrderTests(CustomAPITestCase):
 
         # 1 email for the order details
         # 1 email for the retreat informations
+        send_outbox_emails()
         self.assertEqual(len(mail.outbox), 2)
 
         # Duplicate order
@@ -2470,6 +2489,236 @@ class OrderTests(CustomAPITestCase):
         self.assertEqual(admin.tickets, 1)
         self.assertEqual(admin.membership, None)
 
+    @responses.activate
+    def test_create_with_invalid_payment_token_releases_reservation(self):
+        """
+        Ensure a refused payment releases everything reserved for the order:
+        retreat place, coupon use and the pending order itself.
+        """
+        self.client.force_authenticate(user=self.admin)
+
+        responses.add(
+            responses.POST,
+            "http://example.com/cardpayments/v1/accounts/0123456789/auths/",
+            json=SAMPLE_INVALID_PAYMENT_TOKEN,
+            status=400
+        )
+
+        nb_orders = Order.objects.count()
+
+        data = {
+            'payment_token': "invalid",
+            'coupon': "ABCD1234",
+            'order_lines': [{
+                'content_type': 'retreat',
+                'object_id': self.retreat.id,
+                'quantity': 1,
+            }, {
+                'content_type': 'package',
+                'object_id': self.package.id,
+                'quantity': 1,
+            }],
+        }
+
+        response = self.client.post(
+            reverse('order-list'),
+            data,
+            format='json',
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        charge_data = json.loads(responses.calls[0].request.body)
+        self.assertTrue(charge_data['merchantRefNum'].startswith('charge-'))
+
+        self.assertEqual(Order.objects.count(), nb_orders)
+        self.assertFalse(
+            Reservation.all_objects.filter(
+                user=self.admin,
+                retreat=self.retreat,
+            ).exists()
+        )
+        self.coupon_user.refresh_from_db()
+        self.assertEqual(self.coupon_user.uses, 5)
+
+        admin = self.admin
+        admin.refresh_from_db()
+        self.assertEqual(admin.tickets, 1)
+
+    @responses.activate
+    def test_create_with_invalid_payment_token_releases_coupon_total_uses(
+            self):
+        """
+        Ensure a refused payment gives back the use counted in the total uses
+        of the coupon.
+        """
+        self.client.force_authenticate(user=self.admin)
+
+        responses.add(
+            responses.POST,
+            "http://example.com/cardpayments/v1/accounts/0123456789/auths/",
+            json=SAMPLE_INVALID_PAYMENT_TOKEN,
+            status=400
+        )
+
+        old_total_uses = self.coupon.total_uses
+
+        data = {
+            'payment_token': "invalid",
+            'coupon': "ABCD1234",
+            'order_lines': [{
+                'content_type': 'package',
+                'object_id': self.package.id,
+                'quantity': 1,
+            }],
+        }
+
+        response = self.client.post(
+            reverse('order-list'),
+            data,
+            format='json',
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.coupon.refresh_from_db()
+        self.assertEqual(self.coupon.total_uses, old_total_uses)
+
+    def create_order_with_unknown_payment_outcome(self):
+        """
+        Orders a retreat and a package with a charge that never answers and
+        returns the pending order, dated before the reconciliation delay.
+        """
+        self.client.force_authenticate(user=self.admin)
+
+        responses.add(
+            responses.POST,
+            "http://example.com/cardpayments/v1/accounts/0123456789/auths/",
+            body=requests.exceptions.ReadTimeout(),
+        )
+
+        data = {
+            'payment_token': "CZgD1NlBzPuSefg",
+            'coupon': "ABCD1234",
+            'order_lines': [{
+                'content_type': 'retreat',
+                'object_id': self.retreat.id,
+                'quantity': 1,
+            }, {
+                'content_type': 'package',
+                'object_id': self.package.id,
+                'quantity': 1,
+            }],
+        }
+
+        with self.assertRaises(requests.exceptions.ReadTimeout):
+            self.client.post(
+                reverse('order-list'),
+                data,
+                format='json',
+            )
+
+        order = Order.objects.get(status=Order.STATUS_PENDING)
+        Order.objects.filter(pk=order.pk).update(
+            transaction_date=timezone.now() - timedelta(hours=1),
+        )
+        return order
+
+    @responses.activate
+    def test_create_with_unknown_payment_outcome(self):
+        """
+        Ensure an order whose charge has an unknown outcome stays pending,
+        keeps its reservation and grants nothing until it is reconciled.
+        """
+        order = self.create_order_with_unknown_payment_outcome()
+
+        self.assertTrue(order.reference_number.startswith('charge-'))
+        self.assertIsNotNone(order.pending_checkout)
+        self.assertTrue(
+            Reservation.objects.filter(
+                user=self.admin,
+                retreat=self.retreat,
+            ).exists()
+        )
+        self.coupon_user.refresh_from_db()
+        self.assertEqual(self.coupon_user.uses, 6)
+
+        admin = self.admin
+        admin.refresh_from_db()
+        self.assertEqual(admin.tickets, 1)
+
+        send_outbox_emails()
+        self.assertEqual(len(mail.outbox), 0)
+
+    @responses.activate
+    def test_reconcile_pending_order_charged(self):
+        """
+        Ensure a pending order is completed when Paysafe has its charge.
+        """
+        order = self.create_order_with_unknown_payment_outcome()
+
+        charge = dict(
+            SAMPLE_PAYMENT_RESPONSE,
+            merchantRefNum=order.reference_number,
+        )
+        responses.add(
+            responses.GET,
+            "http://example.com/cardpayments/v1/accounts/0123456789/auths",
+            json={'auths': [charge]},
+            status=200
+        )
+
+        reconcile_pending_orders()
+
+        self.assertIn(
+            'merchantRefNum=' + order.reference_number,
+            responses.calls[-1].request.url,
+        )
+        order.refresh_from_db()
+        self.assertEqual(order.status, Order.STATUS_PAID)
+        self.assertIsNone(order.pending_checkout)
+        self.assertEqual(order.authorization_id, '1')
+        self.assertEqual(order.settlement_id, '1')
+
+        admin = self.admin
+        admin.refresh_from_db()
+        self.assertEqual(admin.tickets, 1 + self.package.reservations)
+
+        # 1 email for the order details
+        # 1 email for the retreat informations
+        send_outbox_emails()
+        self.assertEqual(len(mail.outbox), 2)
+
+    @responses.activate
+    def test_reconcile_pending_order_not_charged(self):
+        """
+        Ensure a pending order is released when Paysafe has no charge for it.
+        """
+        order = self.create_order_with_unknown_payment_outcome()
+
+        responses.add(
+            responses.GET,
+            "http://example.com/cardpayments/v1/accounts/0123456789/auths",
+            json=UNKNOWN_EXCEPTION,
+            status=404
+        )
+
+        reconcile_pending_orders()
+
+        self.assertFalse(Order.objects.filter(pk=order.pk).exists())
+        self.assertFalse(
+            Reservation.all_objects.filter(
+                user=self.admin,
+                retreat=self.retreat,
+            ).exists()
+        )
+        self.coupon_user.refresh_from_db()
+        self.assertEqual(self.coupon_user.uses, 5)
+
+        admin = self.admin
+        admin.refresh_from_db()
+        self.assertEqual(admin.tickets, 1)
+
     @responses.activate
     def test_create_with_single_use_token_no_profile(self):
         """
@@ -3886,6 +4135,59 @@ class OrderTests(CustomAPITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_validate_coupon_read_only(self):
+        """
+        Ensure that validating a coupon doesn't write anything and that the
+        result is reused for the same cart.
+        """
+        self.client.force_authenticate(user=self.admin)
+
+        nb_orders = Order.objects.count()
+        nb_order_lines = OrderLine.objects.count()
+
+        data = {
+            'order_lines': [{
+                'content_type': 'membership',
+                'object_id': self.membership.id,
+                'quantity': 1,
+            }, {
+                'content_type': 'package',
+                'object_id': self.package.id,
+                'quantity': 2,
+            }],
+            'coupon': "ABCD1234",
+        }
+
+        response = self.client.post(
+            reverse('order-validate-coupon'),
+            data,
+            format='json',
+        )
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_200_OK,
+            response.content,
+        )
+        self.assertEqual(json.loads(response.content), {'value': 10.0})
+
+        self.assertEqual(Order.objects.count(), nb_orders)
+        self.assertEqual(OrderLine.objects.count(), nb_order_lines)
+
+        # The same cart in a different order is served from the cache
+        data['order_lines'].reverse()
+
+        with mock.patch(
+                'store.services.validate_coupon_for_order') as validate:
+            response = self.client.post(
+                reverse('order-validate-coupon'),
+                data,
+                format='json',
+            )
+
+        validate.assert_not_called()
+        self.assertEqual(json.loads(response.content), {'value': 10.0})
+
 
 @override_settings(
     PAYSAFE={
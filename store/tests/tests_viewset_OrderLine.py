@@ -1,19 +1,24 @@
+import csv
+import io
 import json
 
-from datetime import timedelta
+from datetime import datetime, timedelta
+from unittest import mock
 
 from rest_framework import status
 from rest_framework.test import APIClient, APITestCase
 
+from django.test import override_settings
 from django.utils import timezone
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.models import ContentType
 
 from blitz_api.factories import UserFactory, AdminFactory
-from blitz_api.models import AcademicLevel
+from blitz_api.models import AcademicLevel, ExportMedia
 
-from ..models import Membership, Order, OrderLine, Package
+from ..exports import LOCAL_TIMEZONE, export_orderlines_sales
+from ..models import Membership, Order, OrderLine, Package, Refund
 from blitz_api import testing_tools
 from blitz_api.testing_tools import CustomAPITestCase
 
@@ -560,3 +565,125 @@ class OrderLineTests(CustomAPITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK, response.content)
 
         self.assertEqual(response.json(), content)
+
+    @mock.patch('store.views.export_orderlines_sales.delay')
+    def test_export_sales_date_range(self, export_delay):
+        """
+        Ensure we can export sales for a range of dates.
+        """
+        self.client.force_authenticate(user=self.admin)
+
+        response = self.client.post(
+            reverse('orderline-export-sales'),
+            {
+                'start_date': '2021-01-15',
+                'end_date': '2021-03-15',
+            },
+            format='json',
+        )
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_204_NO_CONTENT,
+            response.content,
+        )
+        export_delay.assert_called_once_with(
+            self.admin.id,
+            start_date='2021-01-15',
+            end_date='2021-03-15',
+        )
+
+    @mock.patch('store.views.export_orderlines_sales.delay')
+    def test_export_sales_invalid_date_range(self, export_delay):
+        """
+        Ensure we can't export sales for an invalid range of dates.
+        """
+        self.client.force_authenticate(user=self.admin)
+
+        for data in [
+            {'start_date': '2021-01-15'},
+            {'start_date': '2021-01-15', 'end_date': '2021-02-30'},
+            {'start_date': '2021-03-15', 'end_date': '2021-01-15'},
+            {'start_date': '15/01/2021', 'end_date': '2021-03-15'},
+        ]:
+            response = self.client.post(
+                reverse('orderline-export-sales'),
+                data,
+                format='json',
+            )
+
+            self.assertEqual(
+                response.status_code,
+                status.HTTP_400_BAD_REQUEST,
+                data,
+            )
+
+        export_delay.assert_not_called()
+
+    @override_settings(
+        LOCAL_SETTINGS={
+            "EMAIL_SERVICE": True,
+            "FRONTEND_INTEGRATION": {
+                "SSO_URL": "fake_url",
+                "MAGIC_LINK_URL": "fake_url/{{token}}",
+            }
+        }
+    )
+    def test_export_orderlines_sales(self):
+        """
+        Ensure the export contains the orderlines of the period and their
+        refund.
+        """
+        order = Order.objects.create(
+            user=self.user,
+            transaction_date=LOCAL_TIMEZONE.localize(
+                datetime(2021, 2, 28, 23, 30)),
+            authorization_id=1,
+            settlement_id=1,
+        )
+        order_line = OrderLine.objects.create(
+            order=order,
+            quantity=1,
+            content_type=self.package_type,
+            object_id=self.package.id,
+            cost=self.package.price,
+        )
+        Refund.objects.create(
+            orderline=order_line,
+            amount=10,
+            details="Refund details",
+            refund_date=timezone.now(),
+        )
+        Order.objects.create(
+            user=self.user,
+            transaction_date=LOCAL_TIMEZONE.localize(
+                datetime(2021, 3, 1, 0, 30)),
+            authorization_id=1,
+            settlement_id=1,
+        ).order_lines.create(
+            quantity=1,
+            content_type=self.package_type,
+            object_id=self.package.id,
+            cost=self.package.price,
+        )
+
+        for kwargs in [
+            {'year': '2021', 'month': '2'},
+            {'start_date': '2021-02-01', 'end_date': '2021-02-28'},
+        ]:
+            export_orderlines_sales(self.admin.id, **kwargs)
+
+            export = ExportMedia.objects.filter(
+                type=ExportMedia.EXPORT_SALES_AND_REFUND,
+            ).latest('id')
+            with export.file.open('rb') as export_file:
+                rows = list(csv.reader(
+                    io.TextIOWrapper(export_file, encoding='utf-8')
+                ))
+
+            self.assertEqual(len(rows), 2)
+            self.assertEqual(rows[1][7], str(order.id))
+            self.assertEqual(rows[1][9], str(self.package))
+            self.assertEqual(rows[1][15], '0')
+            self.assertEqual(rows[1][16], '10.00')
+            self.assertEqual(rows[1][17], 'Refund details')
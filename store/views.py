@@ -5,10 +5,11 @@ from datetime import datetime
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 from django.db import transaction
-from django.db.models import Sum, F
-from django.db.models.functions import Coalesce
+from django.db.models import F
+from django.db.models.functions import Greatest
 from django.http import Http404, HttpResponse, HttpRequest
 from django.utils import timezone
+from django.utils.dateparse import parse_date
 from django.utils.translation import gettext_lazy as _
 
 from rest_framework import viewsets, status, mixins, exceptions
@@ -23,12 +24,12 @@ from blitz_api.mixins import ExportMixin
 from .exceptions import PaymentAPIError
 from .models import (Package, Membership, Order, OrderLine, PaymentProfile,
                      CustomPayment, Coupon, CouponUser, Refund, BaseProduct,
-                     OptionProduct, OrderLineBaseProduct)
+                     OptionProduct)
 from .permissions import IsOwner
 from .resources import (MembershipResource, PackageResource, OrderResource,
                         OrderLineResource, CustomPaymentResource,
                         CouponResource, CouponUserResource, RefundResource, )
-from .services import (delete_external_card, validate_coupon_for_order,
+from .services import (delete_external_card, preview_coupon_for_cart,
                        notify_for_coupon, )
 from .exports import (
     generate_coupon_usage, export_orderlines_sales,
@@ -277,84 +278,50 @@ class OrderViewSet(ExportMixin, viewsets.ModelViewSet):
 
     export_resource = OrderResource()
 
-    @transaction.atomic
     @action(
         methods=['post'], detail=False, permission_classes=[IsAuthenticated])
     def validate_coupon(self, request, pk=None):
         """
         This validates if a coupon can be used in an order.
-        It has to create temporary objects to be able to use querysets.
-        Temporary objects are then deleted.
-
-        This is not the best way to do it and it could be improved.
+        The order is only built in memory: nothing is written to the database.
         """
-        try:
-            sid = transaction.savepoint()
-            serializer = serializers.OrderSerializer(
-                data=request.data,
-                context={'request': request}
-            )
-            serializer.is_valid(raise_exception=True)
-            # Coupon is necessary for this view
-            if not serializer.validated_data.get('coupon'):
-                error = {
-                    'coupon': [_("This field is required.")]
-                }
-                return Response(error, status=status.HTTP_400_BAD_REQUEST)
-            orderlines = serializer.validated_data.pop('order_lines', None)
-            coupon = serializer.validated_data.pop('coupon', None)
-
-            if coupon.organization and request.user.university != coupon.organization:
-                error = {
-                    'coupon_invalid_university': [coupon.organization.name]
-                }
-                return Response(error, status=status.HTTP_400_BAD_REQUEST)
-            
-            if coupon.affiliation and request.user.affiliation != coupon.affiliation:
-                error = {
-                    'coupon_invalid_affiliation': [coupon.affiliation.name]
-                }
-                return Response(error, status=status.HTTP_400_BAD_REQUEST)
-
-            serializer.validated_data.pop('payment_token', None)
-            serializer.validated_data.pop('single_use_token', None)
-            order = Order(
-                **serializer.validated_data,
-                transaction_date=timezone.now(),
-                user=request.user,
-            )
-            order.save()
-
-            orderline_list = []
-            for idx, orderline in enumerate(orderlines):
-                if 'options' in orderline.keys():
-                    options = orderline.pop('options')
-                orderline_list.append(
-                    OrderLine(
-                        **orderline,
-                        order=order,
-                    )
-                )
+        serializer = serializers.OrderSerializer(
+            data=request.data,
+            context={'request': request}
+        )
+        serializer.is_valid(raise_exception=True)
+        # Coupon is necessary for this view
+        if not serializer.validated_data.get('coupon'):
+            error = {
+                'coupon': [_("This field is required.")]
+            }
+            return Response(error, status=status.HTTP_400_BAD_REQUEST)
+        orderlines = serializer.validated_data.pop('order_lines', None)
+        coupon = serializer.validated_data.pop('coupon', None)
 
-                orderline_list[idx].save()
+        if coupon.organization and request.user.university != coupon.organization:
+            error = {
+                'coupon_invalid_university': [coupon.organization.name]
+            }
+            return Response(error, status=status.HTTP_400_BAD_REQUEST)
 
-                if 'options' in orderline.keys():
-                    for option in options:
-                        OrderLineBaseProduct.objects.create(
-                            order_line=orderline_list[idx],
-                            option_id=option.get('id'),
-                            quantity=option.get('quantity'),
-                        )
-                    orderline_list[idx].save()
+        if coupon.affiliation and request.user.affiliation != coupon.affiliation:
+            error = {
+                'coupon_invalid_affiliation': [coupon.affiliation.name]
+            }
+            return Response(error, status=status.HTTP_400_BAD_REQUEST)
 
-            response = validate_coupon_for_order(coupon, order)
-            del response['orderlines']
+        # Options do not change the discount of a coupon, only the products
+        orderline_list = []
+        for orderline in orderlines:
+            orderline.pop('options', None)
+            orderline_list.append(OrderLine(**orderline))
 
-        except Exception as err:
-            raise err
-        finally:
-            # add rollback in finally, so it always rollback the data
-            transaction.savepoint_rollback(sid)
+        response = preview_coupon_for_cart(
+            coupon,
+            request.user,
+            orderline_list,
+        )
 
         if response.get('valid_use', False):
             response.pop('valid_use', None)
@@ -445,11 +412,30 @@ class OrderLineViewSet(ExportMixin, ChartJSMixin, viewsets.ModelViewSet):
     @action(methods=['post'], detail=False, permission_classes=[IsAdminUser])
     def export_sales(self, request):
         """
-        Export sales data to a csv file.
+        Export sales data to a csv file, for a month (year and month) or for
+        a range of dates (start_date and end_date, both included).
         """
         try:
             year = request.data.get('year', None)
             month = request.data.get('month', None)
+            start_date = request.data.get('start_date', None)
+            end_date = request.data.get('end_date', None)
+
+            if start_date or end_date:
+                if not start_date or not end_date:
+                    raise KeyError
+                # parse_date returns None if the format is wrong and raises
+                # ValueError if the date doesn't exist
+                start_date = parse_date(str(start_date))
+                end_date = parse_date(str(end_date))
+                if not start_date or not end_date or start_date > end_date:
+                    raise ValueError
+                export_orderlines_sales.delay(
+                    request.user.id,
+                    start_date=start_date.isoformat(),
+                    end_date=end_date.isoformat(),
+                )
+                return Response(status=status.HTTP_204_NO_CONTENT)
 
             if not year or not month:
                 raise KeyError
@@ -461,12 +447,15 @@ class OrderLineViewSet(ExportMixin, ChartJSMixin, viewsets.ModelViewSet):
         except KeyError:
             error = {
                     'missing_arguments': _('Please provide a year and a month '
+                                           'or a start date and an end date '
                                            'for this export')
                 }
             return Response(error, status=status.HTTP_400_BAD_REQUEST)
         except ValueError:
             error = {
-                    'invalid_arguments': _('Year and month must be integers')
+                    'invalid_arguments': _('Year and month must be integers '
+                                           'and dates must be valid dates '
+                                           'in the YYYY-MM-DD format')
                 }
             return Response(error, status=status.HTTP_400_BAD_REQUEST)
 
@@ -579,11 +568,22 @@ class CouponViewSet(ExportMixin, viewsets.ModelViewSet):
         if not self.request.user.is_staff:
             queryset = queryset.filter(owner=self.request.user)
 
+        if self.action in ['list', 'retrieve']:
+            queryset = queryset.select_related(
+                'organization',
+                'affiliation',
+            ).prefetch_related(
+                'applicable_product_types',
+                'applicable_retreats',
+                'applicable_retreat_types',
+                'applicable_timeslots',
+                'applicable_packages',
+                'applicable_memberships',
+            )
+
         display_sold_out = self.request.query_params.get('display_sold_out', None)
         # If None or True, we display all coupons
         if display_sold_out and display_sold_out.lower() in ['false', '0']:
-            queryset = queryset.annotate(
-                total_uses=Coalesce(Sum('coupon_users__uses'), 0))
             queryset = queryset.filter(total_uses__lt=F('max_use'))
         return queryset
 
@@ -622,6 +622,45 @@ class CouponUserViewSet(ExportMixin, viewsets.ModelViewSet):
             return CouponUser.objects.all()
         return CouponUser.objects.filter(user=self.request.user)
 
+    @staticmethod
+    def add_coupon_total_uses(coupon_id, uses):
+        """
+        Keeps the total uses counter of the coupon in line with the uses of
+        its CouponUser.
+        """
+        if uses:
+            Coupon.objects.filter(pk=coupon_id).update(
+                total_uses=Greatest(F('total_uses') + uses, 0),
+            )
+
+    def perform_create(self, serializer):
+        with transaction.atomic():
+            coupon_user = serializer.save()
+            self.add_coupon_total_uses(
+                coupon_user.coupon_id,
+                coupon_user.uses,
+            )
+
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            previous = CouponUser.objects.select_for_update().get(
+                pk=serializer.instance.pk,
+            )
+            coupon_user = serializer.save()
+            self.add_coupon_total_uses(previous.coupon_id, -previous.uses)
+            self.add_coupon_total_uses(
+                coupon_user.coupon_id,
+                coupon_user.uses,
+            )
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            previous = CouponUser.objects.select_for_update().get(
+                pk=instance.pk,
+            )
+            instance.delete()
+            self.add_coupon_total_uses(previous.coupon_id, -previous.uses)
+
 
 class RefundViewSet(ExportMixin, viewsets.GenericViewSet,
                     mixins.ListModelMixin,
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class WorkplaceConfig(AppConfig):
     name = 'workplace'
+
+    def ready(self):
+        # Register the signal receivers
+        from . import signals
@@ -22,7 +22,8 @@ from django.utils.translation import gettext_lazy as _
 from blitz_api.serializers import UserSerializer
 from blitz_api.services import (remove_translation_fields,
                                 check_if_translated_field,
-                                getMessageTranslate,)
+                                getMessageTranslate,
+                                invalidate_response_cache,)
 from log_management.models import Log, EmailLog
 
 from .models import Workplace, Picture, Period, TimeSlot, Reservation
@@ -667,7 +668,10 @@ class BatchTimeSlotSerializer(serializers.HyperlinkedModelSerializer):
         return timeslot_data_list
 
     def create(self, validated_data):
-        return TimeSlot.objects.bulk_create(validated_data)
+        timeslots = TimeSlot.objects.bulk_create(validated_data)
+        # bulk_create doesn't send the post_save signal
+        invalidate_response_cache('workplace')
+        return timeslots
 
     def save(self, **kwargs):
         return self.create(self.validated_data)
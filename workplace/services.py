@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives
+from django.template.loader import render_to_string
+
+from blitz_api.services import queue_email_messages
+
+
+def send_cancelation_emails(reservations, custom_message, time_slot=None):
+    """
+    Notify the users of canceled reservations. The emails are sent from the
+    outbox once the current transaction is committed.
+    :param reservations: The canceled reservations
+    :param custom_message: The message of the admin canceling them
+    :param time_slot: The deleted timeslot, if all reservations are on it
+    """
+    messages = []
+    for reservation in reservations:
+        merge_data = {
+            'TIMESLOT_LIST': [time_slot or reservation.timeslot],
+            'SUPPORT_EMAIL': settings.SUPPORT_EMAIL,
+            'CUSTOM_MESSAGE': custom_message,
+        }
+        plain_msg = render_to_string(
+            "cancelation.txt",
+            merge_data
+        )
+        msg_html = render_to_string(
+            "cancelation.html",
+            merge_data
+        )
+
+        message = EmailMultiAlternatives(
+            "Annulation d'un bloc de rédaction",
+            plain_msg,
+            settings.DEFAULT_FROM_EMAIL,
+            [reservation.user.email],
+        )
+        message.attach_alternative(msg_html, 'text/html')
+        messages.append(message)
+
+    return queue_email_messages(messages, 'cancelation')
@@ -0,0 +1,22 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from blitz_api.services import invalidate_response_cache
+
+from .models import Period, Reservation, TimeSlot, Workplace
+
+
+@receiver(post_save, sender=Workplace)
+@receiver(post_save, sender=TimeSlot)
+@receiver(post_save, sender=Period)
+@receiver(post_save, sender=Reservation)
+@receiver(post_delete, sender=Workplace)
+@receiver(post_delete, sender=TimeSlot)
+@receiver(post_delete, sender=Period)
+@receiver(post_delete, sender=Reservation)
+def invalidate_workplace_responses(sender, instance, **kwargs):
+    """
+    Invalidate the cached responses of the time slots, reservations change
+    their remaining places and they include their workplace.
+    """
+    invalidate_response_cache('workplace')
@@ -15,6 +15,7 @@ from django.test.utils import override_settings
 
 from blitz_api.factories import UserFactory, AdminFactory
 from blitz_api.services import remove_translation_fields
+from log_management.tasks import send_outbox_emails
 
 from ..models import Workplace, Period, TimeSlot, Reservation
 
@@ -588,6 +589,7 @@ class PeriodTests(APITestCase):
         self.assertFalse(self.reservation.is_active)
         self.assertEqual(self.reservation.cancelation_reason, 'TD')
         self.assertTrue(self.reservation.cancelation_date)
+        send_outbox_emails()
         self.assertEqual(len(mail.outbox), 2)
         self.assertEqual(self.user.tickets, 3)
         self.assertEqual(self.admin.tickets, 1)
@@ -13,6 +13,7 @@ from rest_framework.test import APIClient, APITestCase
 
 from blitz_api.factories import UserFactory, AdminFactory
 from blitz_api.services import remove_translation_fields
+from log_management.tasks import send_outbox_emails
 from ..models import Period, TimeSlot, Workplace, Reservation
 
 User = get_user_model()
@@ -602,6 +603,7 @@ class TimeSlotTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
         # Test that two messages were sent:
+        send_outbox_emails()
         self.assertEqual(len(mail.outbox), 2)
 
     @mock.patch('blitz_api.services.EmailMessage.send', return_value=0)
@@ -682,6 +684,7 @@ class TimeSlotTests(APITestCase):
         self.assertEqual(user.tickets, 1)
 
         # Test that no message was sent:
+        send_outbox_emails()
         self.assertEqual(len(mail.outbox), 0)
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
@@ -856,6 +859,7 @@ class TimeSlotTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
         # Test that two message was sent:
+        send_outbox_emails()
         self.assertEqual(len(mail.outbox), 2)
 
     @override_settings(
@@ -944,6 +948,7 @@ class TimeSlotTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
         # Test that no email was sent:
+        send_outbox_emails()
         self.assertEqual(len(mail.outbox), 0)
 
     def test_delete(self):
@@ -1001,6 +1006,7 @@ class TimeSlotTests(APITestCase):
         self.assertFalse(self.reservation.is_active)
         self.assertEqual(self.reservation.cancelation_reason, 'TD')
         self.assertTrue(self.reservation.cancelation_date)
+        send_outbox_emails()
         self.assertEqual(len(mail.outbox), 3)
         self.assertEqual(self.user.tickets, 3)
         self.assertEqual(self.admin.tickets, 2)
@@ -1135,6 +1141,62 @@ class TimeSlotTests(APITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    @override_settings(RESPONSE_CACHE_TIMEOUT=300)
+    def test_list_cached(self):
+        """
+        Ensure the list of timeslots is cached per user and answered with a
+        304 while it doesn't change.
+        """
+        self.client.force_authenticate(user=self.user)
+
+        response = self.client.get(
+            reverse('timeslot-list'),
+            format='json',
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+        result = json.loads(response.content)['results'][0]
+        self.assertFalse(result['is_reserved'])
+
+        response = self.client.get(
+            reverse('timeslot-list'),
+            format='json',
+            HTTP_IF_NONE_MATCH=etag,
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+
+        Reservation.objects.create(
+            user=self.user,
+            timeslot=self.time_slot_active,
+            is_active=True,
+        )
+
+        response = self.client.get(
+            reverse('timeslot-list'),
+            format='json',
+            HTTP_IF_NONE_MATCH=etag,
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        result = json.loads(response.content)['results'][0]
+        self.assertTrue(result['is_reserved'])
+        self.assertEqual(result['places_remaining'], 39)
+
+        self.client.force_authenticate(user=UserFactory())
+
+        response = self.client.get(
+            reverse('timeslot-list'),
+            format='json',
+        )
+
+        result = json.loads(response.content)['results'][0]
+        self.assertFalse(result['is_reserved'])
+
     def test_list_inactive(self):
         """
         Ensure we can list all timeslots as an admin user.
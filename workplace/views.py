@@ -10,21 +10,18 @@ from rest_framework.permissions import IsAuthenticated, IsAdminUser
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.core.mail import send_mail as django_send_mail
 from django.db import transaction
 from django.db.models import F, Q
-from django.template.loader import render_to_string
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
-from rest_framework.utils import json
 
-from blitz_api.mixins import ExportMixin
-from log_management.models import Log, EmailLog
+from blitz_api.mixins import CachedResponseMixin, ExportMixin
 
 from .models import Workplace, Picture, Period, TimeSlot, Reservation
 from .resources import (WorkplaceResource, PeriodResource, TimeSlotResource,
                         ReservationResource)
 from . import serializers, permissions
+from .services import send_cancelation_emails
 
 User = get_user_model()
 
@@ -153,7 +150,7 @@ class PeriodViewSet(ExportMixin, viewsets.ModelViewSet):
 
         reservation_cancel = Reservation.objects.filter(
             timeslot__period=instance, is_active=True
-        )
+        ).select_related('user', 'timeslot')
         affected_users = User.objects.filter(
             reservations__in=reservation_cancel
         )
@@ -182,54 +179,18 @@ class PeriodViewSet(ExportMixin, viewsets.ModelViewSet):
             )
             instance.delete()
 
-            for reservation in reservations_cancel_copy:
-                merge_data = {
-                    'TIMESLOT_LIST': [reservation.timeslot],
-                    'SUPPORT_EMAIL': settings.SUPPORT_EMAIL,
-                    'CUSTOM_MESSAGE': custom_message,
-                }
-                plain_msg = render_to_string(
-                    "cancelation.txt",
-                    merge_data
-                )
-                msg_html = render_to_string(
-                    "cancelation.html",
-                    merge_data
-                )
-
-                try:
-                    response_send_mail = django_send_mail(
-                        "Annulation d'un bloc de rédaction",
-                        plain_msg,
-                        settings.DEFAULT_FROM_EMAIL,
-                        [reservation.user.email],
-                        html_message=msg_html,
-                    )
-
-                    EmailLog.add(
-                        reservation.user.email, 'cancelation',
-                        response_send_mail)
-                except Exception as err:
-                    additional_data = {
-                        'title': "Annulation d'un bloc de rédaction",
-                        'default_from': settings.DEFAULT_FROM_EMAIL,
-                        'user_email': user.email,
-                        'merge_data': merge_data,
-                        'template': 'cancelation'
-                    }
-                    Log.error(
-                        source='SENDING_BLUE_TEMPLATE',
-                        message=err,
-                        additional_data=json.dumps(additional_data)
-                    )
-                    raise
+            send_cancelation_emails(
+                reservations_cancel_copy,
+                custom_message,
+            )
 
             instance.time_slots.all().delete()
 
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class TimeSlotViewSet(ExportMixin, viewsets.ModelViewSet):
+class TimeSlotViewSet(CachedResponseMixin, ExportMixin,
+                      viewsets.ModelViewSet):
     """
     retrieve:
     Return the given time slot.
@@ -257,6 +218,9 @@ class TimeSlotViewSet(ExportMixin, viewsets.ModelViewSet):
     }
 
     export_resource = TimeSlotResource()
+    response_cache_namespace = 'workplace'
+    # The serializer tells if the user reserved the time slot
+    response_cache_per_user = True
 
     @action(methods=['post'], detail=False, permission_classes=[IsAdminUser])
     def batch_create(self, request):
@@ -363,7 +327,7 @@ class TimeSlotViewSet(ExportMixin, viewsets.ModelViewSet):
 
         reservation_cancel = instance.reservations.filter(
             is_active=True
-        )
+        ).select_related('user')
         affected_users = User.objects.filter(
             reservations__in=reservation_cancel
         )
@@ -393,46 +357,11 @@ class TimeSlotViewSet(ExportMixin, viewsets.ModelViewSet):
             )
             instance.delete()
 
-            for reservation in reservations_cancel_copy:
-                merge_data = {
-                    'TIMESLOT_LIST': [instance],
-                    'SUPPORT_EMAIL': settings.SUPPORT_EMAIL,
-                    'CUSTOM_MESSAGE': custom_message,
-                }
-                plain_msg = render_to_string(
-                    "cancelation.txt",
-                    merge_data
-                )
-                msg_html = render_to_string(
-                    "cancelation.html",
-                    merge_data
-                )
-                try:
-                    response_send_mail = django_send_mail(
-                        "Annulation d'un bloc de rédaction",
-                        plain_msg,
-                        settings.DEFAULT_FROM_EMAIL,
-                        [reservation.user.email],
-                        html_message=msg_html,
-                    )
-
-                    EmailLog.add(
-                        reservation.user.email,
-                        'cancelation', response_send_mail)
-                except Exception as err:
-                    additional_data = {
-                        'title': "Annulation d'un bloc de rédaction",
-                        'default_from': settings.DEFAULT_FROM_EMAIL,
-                        'user_email': reservation.user.email,
-                        'merge_data': merge_data,
-                        'template': 'cancelation'
-                    }
-                    Log.error(
-                        source='SENDING_BLUE_TEMPLATE',
-                        message=err,
-                        additional_data=json.dumps(additional_data)
-                    )
-                    raise
+            send_cancelation_emails(
+                reservations_cancel_copy,
+                custom_message,
+                time_slot=instance,
+            )
 
         return Response(status=status.HTTP_204_NO_CONTENT)
 